@@ -5,10 +5,13 @@
 #include <iomanip>
 #include <string>
 #include <vector>
+#include <set>
+#include <map>
 
 #include "CfgManager.h"
 #include "CfgManagerT.h"
 #include "TEndcapRings.h"
+#include "StageProfiler.h"
 
 #include "TTree.h"
 #include "TChain.h"
@@ -23,6 +26,31 @@
 
 using namespace std;
 
+//one electron of the calibration skim: the variables used by the calibration and its packed rechits
+//the branch names are the ECALELF ones, the rechit energy is already multiplied by the fraction
+struct SkimElectron
+{
+  Long64_t            entry;         //entry of the event in the original chain, used for the odd/even split
+  UInt_t              runNumber;
+  UShort_t            lumiBlock;
+  UInt_t              eventTime;
+  Int_t               eventNumber;
+  Short_t             chargeEle;
+  Short_t             xSeedSC;
+  Short_t             ySeedSC;
+  Float_t             etaSCEle;
+  Float_t             phiEle;
+  Float_t             rawEnergySCEle;
+  Float_t             energySCEle;
+  Float_t             esEnergySCEle;
+  Float_t             pAtVtxGsfEle;
+  std::vector<short>* XRecHit;
+  std::vector<short>* YRecHit;
+  std::vector<short>* ZRecHit;
+  std::vector<float>* EfracRecHit;
+  std::vector<short>* recoFlagRecHit;
+};
+
 class ECALELFInterface
 {
 
@@ -35,7 +63,7 @@ class ECALELFInterface
   //---utils--
   Long64_t            GetEntries         ()                                                       {return chain_->GetEntries();}
   Long64_t            GetEntry           (const Long64_t &i);
-  Bool_t              isSelected         (const Int_t &i)                                         {return selection_->EvalInstance(i);}
+  Bool_t              isSelected         (const Int_t &i)                                         {StageTimer timer(profiler_, StageProfiler::kSelection); return skim_ ? i==0 : selection_->EvalInstance(i);}
   Bool_t              isEB               (const Int_t &i);
   Bool_t              isEE               (const Int_t &i);
   Float_t             GetEnergy          (const Int_t &i)                                         {return energySCEle_[i];}
@@ -69,6 +97,15 @@ class ECALELFInterface
   void                PrintSettings      (); 
   void                AddVariable        (const string &name, const string &expr);
   double              GetVariableValue   (const string &name, const Int_t &i);
+  //---branch pruning: only the branches of the formulas and of the required accessors are read---
+  void                RequireBranches    (const vector<string> &groups);
+  //---stage profiler (--profile)---
+  StageProfiler&      GetProfiler        ()                                                       {return profiler_;}
+  //---calibration skim---
+  Bool_t              isSkim             ()                                                       {return skim_;}
+  Long64_t            GetSkimEntry       ()                                                       {return skimele_.entry;}
+  TTree*              BookSkimTree       (const char* treename="calibskim");
+  void                FillSkimTree       (TTree* skimtree, const Long64_t &entry, const Int_t &i);
 
  private:
   TEndcapRings* eeRing_;
@@ -76,6 +113,10 @@ class ECALELFInterface
  protected:
   void BranchSelected(TChain* chain);
   void BranchExtraCalib(TChain* chain);
+  void BranchSkim(TChain* chain);
+  void LoadSkimElectron();
+  void AddFormulaBranches(TTreeFormula* formula);
+  void PruneBranches();
 
   TTreeFormula *selection_;
   std::map <string,TTreeFormula*> customvariablesmap_;
@@ -83,6 +124,15 @@ class ECALELFInterface
   std::map<std::string,TBetterChain*> ch_;
   TBetterChain* chain_;
   int Ncurrtree_;
+  StageProfiler profiler_;
+
+  ///! branch pruning (Input.branchPruning) and read-ahead cache (Input.cacheSize, Input.cacheLearnEntries, Input.prefetch)
+  bool                  branchpruning_;
+  bool                  branchespruned_;
+  std::set<std::string> requiredbranches_;
+  float                 cachesize_;
+  int                   cachelearnentries_;
+  bool                  prefetch_;
 
   ///! Declaration of leaf types
   UInt_t          runNumber_;
@@ -111,6 +161,10 @@ class ECALELFInterface
   std::vector<int>     *ZRecHit_[2];
   std::vector<int>     *recoFlagRecHit_[2];
   std::vector<float>   *fracRecHit_[2];
+
+  ///! calibration skim: one entry per selected electron, loaded in the slot 0 of the variables above
+  bool                 skim_;
+  SkimElectron         skimele_;
 };
 
 
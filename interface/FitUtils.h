@@ -69,7 +69,7 @@ namespace FitUtils
     std::cout << "entries: " << h->GetEntries() << std::endl;
 #endif
     fitfunc -> SetParameter(1, 0.99);
-    for(int nTrial = 0; nTrial < 10; ++nTrial)
+    for(int iTrial = 0; iTrial < nTrial; ++iTrial)
     {
       c_template_fit.cd();
       rp = h -> Fit(fitfunc, fitopt.c_str());
@@ -92,6 +92,37 @@ namespace FitUtils
     return false;
   }
 
+  //same as PerseverantFit without any graphics object (option "0"), so that it can run in parallel threads
+  //the fitted function is attached to the histo, the plot can be saved afterwards with SaveFitPlot
+  inline bool PerseverantFitNoGraph( TH1* h, TF1* fitfunc, string fitopt="QRL+", int nTrial=10)
+  {
+    TFitResultPtr rp;
+    int fStatus;
+    fitopt += "0";
+    fitfunc -> SetParameter(1, 0.99);
+    for(int iTrial = 0; iTrial < nTrial; ++iTrial)
+    {
+      rp = h -> Fit(fitfunc, fitopt.c_str());
+      fStatus = rp;
+      if(fStatus != 4 && fitfunc->GetParError(1) != 0. )
+	return true;
+    }
+    return false;
+  }
+
+  //the functions fitted with option "0" are stored with kNotDraw: the bit is cleared to draw them with the histo
+  inline void SaveFitPlot( TH1* h, string TemplatePlotsFolder)
+  {
+    TCanvas c_template_fit;
+    TIter next(h->GetListOfFunctions());
+    while(TObject* obj = next())
+      if(obj->InheritsFrom(TF1::Class()))
+	obj->ResetBit(TF1::kNotDraw);
+    h -> Draw();
+    c_template_fit.Print( Form("%s/fit_%s.png",TemplatePlotsFolder.c_str(), h->GetName()) );
+    c_template_fit.SaveAs( Form("%s/fit_%s.root",TemplatePlotsFolder.c_str(), h->GetName()) );
+  }
+
 }
 
 #endif
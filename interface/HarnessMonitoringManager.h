@@ -0,0 +1,51 @@
+#ifndef HARNESSMONITORINGMANAGER__
+#define HARNESSMONITORINGMANAGER__
+
+#include <iostream>
+#include <string>
+#include <vector>
+
+#include "CfgManager.h"
+#include "CfgManagerT.h"
+#include "MonitoringManager.h"
+#include "TimeBin.h"
+
+//MonitoringManager running over all the harnesses in a single pass over the ntuple
+//each selected electron is routed to its harness through a crystal->harness lookup table
+//the cfg tokens IETAMIN, IETAMAX, IPHIMIN, IPHIMAX are replaced harness by harness in the harness dependent options
+class HarnessMonitoringManager: public MonitoringManager
+{
+
+ public:
+  //---ctors---
+  HarnessMonitoringManager(CfgManager conf);
+  //---dtor---
+  ~HarnessMonitoringManager();
+  //---utils--
+  bool        LoadHarnessMap(const std::string &harnessmapfilename);
+  int         GetNharness() const {return harnessranges_.size();}
+  int         FindHarness(const int &ieta, const int &iphi) const;
+  std::string GetHarnessName(const int &iharness) const;
+  CfgManager  GetHarnessConfig(const int &iharness) const {return harness_conf_.at(iharness);}
+  void        InitHarnessTimeBins();
+  void        FillTimeBins();
+  void        SelectHarness(const int &iharness);
+
+ protected:
+  struct HarnessRange
+  {
+    int ietamin;
+    int ietamax;
+    int iphimin;
+    int iphimax;
+  };
+  std::vector<HarnessRange> harnessranges_;
+  std::vector<int> harnessmap_; //harness index of each EB crystal (1D index), -1 if the crystal does not belong to any harness
+  std::vector<std::vector<TimeBin> > harness_timebins_;
+  std::vector<CfgManager> harness_conf_;
+  CfgManager base_conf_;
+  int selected_harness_;        //-1 --> timebins contains the common (reference) bins, without histos
+  CfgManager BuildHarnessConfig(const HarnessRange &harness);
+};
+
+#endif
@@ -5,6 +5,8 @@
 #include <string>
 #include <vector>
 #include <fstream>
+#include <list>
+#include <cassert>
 
 #include "CfgManager.h"
 #include "CfgManagerT.h"
@@ -16,7 +18,25 @@
 #include "TObject.h"
 #include "TF1.h"
 
-typedef  std::map<int,std::map<int,std::map<int,double> > > IC; // ICvalue = IC [ix] [iy] [iz]
+//INDEXING UTILS (see ICmanager.cc for the reference frames)
+inline int fromIetaIphito1Dindex(const int &ieta, const int &iphi, const int &Neta, const int &Nphi, const int &ietamin, const int &iphimin)
+{
+  return (iphi - iphimin)+Nphi*(ieta - ietamin);
+}
+
+inline int fromTH2indexto1Dindex(const int &binx, const int &biny, const int &Nbinx, const int &Nbiny)
+{
+  return (binx - 1)+Nbinx*(biny - 1);
+}
+
+//dense IC map of one IOV: EB (iz=0) 171x360 with ix=ieta in [-85,85] and iy=iphi in [1,360],
+//followed by EEm (iz=-1) and EEp (iz=+1) 100x100 with ix,iy in [1,100] (see ICmanager::GetICIndex)
+//valid flags the crystals actually loaded, the others have IC=0
+struct IC
+{
+  std::vector<double> values;
+  std::vector<char>   valid;
+};
 
 struct IOV
 {
@@ -53,7 +73,9 @@ struct IOV
       return false;
     return true;
   }
-    
+  //key ordering the IOVs by their first (run,ls)
+  ULong64_t StartKey() const {return ((ULong64_t)runmin<<16) | lsmin;}
+  ULong64_t EndKey() const {return ((ULong64_t)runmax<<16) | lsmax;}
 };
 
 class ICmanager
@@ -67,8 +89,9 @@ class ICmanager
   //---dtor---
   ~ICmanager();
   //---utils--
-  Float_t  GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz);
-  Float_t  GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz, const Int_t &iIOV);
+  inline Float_t GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz);
+  inline Float_t GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz, const Int_t &iIOV);
+  bool     IsValid(const Int_t &ix, const Int_t &iy, const Int_t &iz, const Int_t &iIOV=0);
   int      FindIOVNumber(const UInt_t &run, const UShort_t &ls);
   int      FindCloserIOVNumber(const UInt_t &run, const UShort_t &ls);
   void     GetXboundaries(const Int_t &iz, Float_t &ixmin, Float_t &ixmax) {ixmin=ixmin_.at(iz); ixmax=ixmax_.at(iz);}
@@ -79,9 +102,11 @@ class ICmanager
   void     LoadIC(TH2D* IC, const int &iz);
   void     LoadIC(const std::vector<std::string> &ICcfg);
   IC       GetICFromtxt(const std::string &txtfilename);
+  void     LoadICFromBinary(const std::string &binfilename);
+  IC       GetICFromBinaryCube(const Int_t &iIOV);
   IC       GetICFromTH2D(TH2D* ICmap, const int &iz);
   void     InitIC(Int_t ICvalue);
-  double&  operator()(const Int_t &ix, const Int_t &iy, const Int_t &iz);
+  inline double& operator()(const Int_t &ix, const Int_t &iy, const Int_t &iz);
   TH2D*    GetPulledIC(TH2D* h2_ICpull, const int &iz);
   TH2D*    PullIC(TH2D* h2_ICpull, const int &iz);
   void     EtaringNormalizationEB();
@@ -105,10 +130,38 @@ class ICmanager
   //TGraphErrors* GetResidualSpreadvsEtaringEE(ICmanager* IC2);//TBD
   //void SaveICAs(const char *output);
   bool EB;
+  //---dense storage---
+  static const int kNEB = 171*360;
+  static const int kNEE = 100*100;
+  static const int kNcrystals = kNEB+2*kNEE;
+  static bool  IsInRange(const Int_t &ix, const Int_t &iy, const Int_t &iz);
+  static int   GetICIndex(const Int_t &ix, const Int_t &iy, const Int_t &iz);
+  static IC    GetEmptyIC();
   
  protected:
-  std::vector <IC> timedependent_ICvalues_; //ICvalue = timedependent_ICvalues_[iIOV][ix][iy][iz]
+  std::vector <IC> timedependent_ICvalues_; //ICvalue = timedependent_ICvalues_[iIOV].values[GetICIndex(ix,iy,iz)]
   std::vector <struct IOV> IOVlist_;
+  //IOV lookup: IOV numbers sorted by their start (run,ls), for binary search, max last (run,ls) of the IOVs starting
+  //up to each position (IOVs which can still contain a key) and last IOV found
+  std::vector <int> IOVorder_;
+  std::vector <ULong64_t> IOVstarts_;
+  std::vector <ULong64_t> IOVmaxends_;
+  bool IOVoverlap_;
+  int lastIOV_;
+  //lazy loading (txtICdictionary, binICdictionary): IC file of each IOV or float IC cube of all the IOVs,
+  //loaded IOVs from the most recently used and max number of loaded IOVs
+  std::vector <std::string> IOVfilenames_;
+  std::vector <Float_t> ICcube_;   //ICcube_[iIOV][ieta-cubeietamin_][iphi-cubeiphimin_]
+  int cubeNeta_;
+  int cubeNphi_;
+  int cubeietamin_;
+  int cubeiphimin_;
+  std::list <int> loadedIOVs_;
+  int maxLoadedIOVs_;
+  int lastAccessedIOV_;
+  void BuildIOVIndex();
+  int  FindIOVBefore(const UInt_t &run, const UShort_t &ls);
+  void AccessIOV(const Int_t &iIOV);
   const int izmin_=-1;
   const int izmax_=+1;
   const std::map<int,int> Nx_ =    {{-1,100}, {0,171}, {1,100} };
@@ -120,12 +173,47 @@ class ICmanager
 
 };
 
+inline bool ICmanager::IsInRange(const Int_t &ix, const Int_t &iy, const Int_t &iz)
+{
+  if(iz==0)
+    return ix>=-85 && ix<=85 && iy>=1 && iy<=360;
+  return (iz==-1 || iz==1) && ix>=1 && ix<=100 && iy>=1 && iy<=100;
+}
+
+inline int ICmanager::GetICIndex(const Int_t &ix, const Int_t &iy, const Int_t &iz)
+{
+  if(iz==0)
+    return fromIetaIphito1Dindex(ix, iy, 171, 360, -85, 1);
+  return kNEB + (iz>0 ? kNEE : 0) + fromIetaIphito1Dindex(ix, iy, 100, 100, 1, 1);
+}
+
+//the IOV is (lazily) loaded only when it changes with respect to the previous call
+inline Float_t ICmanager::GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz, const Int_t &iIOV)
+{
+  assert(IsInRange(ix,iy,iz));
+  assert(iIOV>=0 && iIOV<(int)timedependent_ICvalues_.size());
+  if(iIOV!=lastAccessedIOV_)
+    AccessIOV(iIOV);
+  return timedependent_ICvalues_[iIOV].values[GetICIndex(ix,iy,iz)];
+}
+
+inline Float_t ICmanager::GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz)
+{
+  return GetIC(ix,iy,iz,0);
+}
+
+inline double& ICmanager::operator()(const Int_t &ix, const Int_t &iy, const Int_t &iz)
+{
+  assert(IsInRange(ix,iy,iz));
+  if(lastAccessedIOV_!=0)
+    AccessIOV(0);
+  return timedependent_ICvalues_[0].values[GetICIndex(ix,iy,iz)];
+}
+
 TH2D* GetICpull(TH2D* h2_numerator,TH2D* h2_denominator);
 
 
 
-int  fromIetaIphito1Dindex(const int &ieta,  const int &iphi, const int &Neta,  const int &Nphi,  const int &ietamin, const int &iphimin);
-int  fromTH2indexto1Dindex(const int &binx,  const int &biny, const int &Nbinx, const int &Nbiny);
 void from1DindextoIetaIphi(const int &index,       int &ieta,       int &iphi,  const int &Neta,  const int &Nphi,    const int &ietamin, const int &iphimin);
 void from1DindextoTH2index(const int &index,       int &binx,       int &biny,  const int &Nbinx, const int &Nbiny);
 
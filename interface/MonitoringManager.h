@@ -5,6 +5,7 @@
 #include <string>
 #include <vector>
 #include <set>
+#include <unordered_map>
 
 #include "CfgManager.h"
 #include "CfgManagerT.h"
@@ -30,12 +31,16 @@ class MonitoringManager: public calibrator
   ~MonitoringManager();
   //---utils--
   TH1F* BuildTemplate();
-  void  RunDivide();
+  void  RunDivide(const bool &fillhistos=false);
   void  SaveTimeBins(std::string outfilename, std::string writemethod="RECREATE");
+  void  SetSaveHistos(const bool &savehistos) {savehistos_ = savehistos;}
+  bool  HasHistos() const;
   void  LoadTimeBins(std::vector<UInt_t>& runs, std::vector<UInt_t>& times, std::string option="");
   void  LoadTimeBins(string inputfilename, string objname="", std::string option="");
   void  LoadIntegratedLuminosity(string intlumi_vs_time_filename);
+  void  MergeTimeBins(const std::vector<std::string> &inputfilenames, string objname="");
   void  FillTimeBins();
+  void  UpdateNev();
   void  fitScale();
   std::vector<TimeBin>::iterator FindBin(const UInt_t &run, const UShort_t &ls);
   std::vector<TimeBin>::iterator FindBin(const UInt_t &run, const UShort_t &ls, const UInt_t &time );
@@ -44,6 +49,7 @@ class MonitoringManager: public calibrator
   void  RunTemplateFit(string scale);
   void  RunComputeMean(string scale);
   void  RunComputeMedian(string scale);
+  void  RunComputeQuantile(string scale, const double &q);
   //void  SaveScales(TFile* outfile){};
   //void  saveHistos(TFile* outfile){};
   void  PrintScales();
@@ -53,10 +59,21 @@ class MonitoringManager: public calibrator
   enum kvariabletype {kregular, kICenergy_over_p,kICMee};
   int variabletype_;
   std::vector<TimeBin>::iterator last_accessed_bin_;
+  //FindBin index: bin positions sorted by their first (run,ls) and the corresponding keys, rebuilt when timebins change
+  std::vector<int> binorder_;
+  std::vector<ULong64_t> binstarts_;
+  //(run,ls) --> position of the per-lumisection bins while RunDivide is building them
+  std::unordered_map<ULong64_t,int> lsbins_;
+  void ResetBinIndex();
+  void BuildBinIndex();
+  std::vector<TimeBin>::iterator SearchBin(const UInt_t &run, const UShort_t &ls, const UInt_t &time, const bool &usetime);
   std::vector<TimeBin> timebins;
   std::string variablename_;
   std::string label_;
   TH1F* h_template_;
+  double sketchcompression_;
+  double sketchbufferfactor_; //values buffered by the quantile sketches before compressing, in units of sketchcompression_
+  bool savehistos_;        //SaveTimeBins writes also the histo of each bin (<label>_histos/Histo<entry>)
   CfgManager conf_;
   bool BookHistos();
   void SetScaleVariable(const string &variablename);
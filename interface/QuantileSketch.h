@@ -0,0 +1,55 @@
+#ifndef QUANTILESKETCH__
+#define QUANTILESKETCH__
+
+#include <iostream>
+#include <vector>
+
+#include "TTree.h"
+
+//mergeable quantile sketch (merging t-digest): the distribution is summarized by a list of centroids (mean, weight)
+//whose size is bounded by ~compression, the centroids are smaller close to the tails so that quantiles are accurate everywhere
+//two sketches of the same variable can be merged --> quantiles of file groups can be combined afterwards
+//the exact number of entries, sum, sum of squares, min and max are kept as well
+//the values are buffered and compressed into the centroids every bufferfactor*compression entries (and by Compress)
+class QuantileSketch
+{
+
+ public:
+  //---ctors---
+  QuantileSketch(const double &compression=200., const double &bufferfactor=5.);
+
+  //---utils--
+  void   Add(const double &x, const double &w=1.);
+  void   Merge(const QuantileSketch &other);
+  void   Compress();
+  void   Reset();
+  double Quantile(const double &q);
+  double GetN() const {return n_;}
+  double GetMean() const;
+  double GetMeanError() const;
+  int    GetNcentroids() const {return means_.size();}
+  void   SetCompression(const double &compression) {compression_ = compression;}
+  double GetCompression() const {return compression_;}
+  void   SetBufferFactor(const double &bufferfactor) {bufferfactor_ = bufferfactor;}
+  double GetBufferFactor() const {return bufferfactor_;}
+  void   BranchOutput(TTree* outtree);
+  void   BranchInput(TTree* intree);
+
+ protected:
+  double compression_;
+  double bufferfactor_;       //max entries appended before compressing, in units of compression
+  std::vector<float> means_;  //centroids, sorted by mean after Compress
+  std::vector<float> weights_;
+  int    Nunmerged_;          //entries appended after the last Compress
+  double n_;
+  double sumx_;
+  double sumx2_;
+  double min_;
+  double max_;
+  std::vector<float>* inmeans_;   //addresses used by BranchInput
+  std::vector<float>* inweights_;
+  double K(const double &q) const;
+  double Kinv(const double &k) const;
+};
+
+#endif
@@ -0,0 +1,58 @@
+#ifndef STAGEPROFILER__
+#define STAGEPROFILER__
+
+#include <iostream>
+#include <string>
+#include <vector>
+#include <chrono>
+
+//cumulative time and number of calls of the stages of the event loops, enabled by the --profile option of the executables
+//stages can be nested: the time of a stage does not include the stages started inside it (e.g. the IOV lookup inside the energy evaluation)
+//when the profiler is not enabled Start and Stop only test a flag
+class StageProfiler
+{
+
+ public:
+  enum Stage {kIO, kSelection, kVariable, kLookup, kFill, kFit, kWrite, kNstages};
+
+  //---ctors---
+  StageProfiler();
+
+  //---utils--
+  void   Enable(const std::string &executable);
+  bool   IsEnabled() const {return enabled_;}
+  void   Start(const Stage &stage) {if(enabled_) Push(stage);}
+  void   Stop() {if(enabled_) Pop();}
+  double GetTime(const Stage &stage) const {return time_[stage];}
+  long   GetCalls(const Stage &stage) const {return calls_[stage];}
+  void   Print();
+  bool   Save(const std::string &filename);
+  static const char* GetStageName(const int &stage);
+
+ protected:
+  typedef std::chrono::steady_clock clock;
+  bool enabled_;
+  std::string executable_;
+  clock::time_point begin_;
+  clock::time_point last_;   //last start or stop: the running stage is charged from here
+  std::vector<int> stack_;
+  double time_[kNstages];
+  long   calls_[kNstages];
+  void   Push(const Stage &stage);
+  void   Pop();
+  double GetWallTime() const;
+};
+
+//the stage is stopped when the timer goes out of scope
+class StageTimer
+{
+
+ public:
+  StageTimer(StageProfiler &profiler, const StageProfiler::Stage &stage): profiler_(profiler) {profiler_.Start(stage);}
+  ~StageTimer() {profiler_.Stop();}
+
+ private:
+  StageProfiler &profiler_;
+};
+
+#endif
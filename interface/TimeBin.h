@@ -8,6 +8,8 @@
 
 #include "TH1F.h"
 #include "TTree.h"
+#include "TDirectory.h"
+#include "QuantileSketch.h"
 
 using namespace std;
 
@@ -33,23 +35,38 @@ class TimeBin
   void     SetNev(const int &Nev_bin);
   bool     operator<(const TimeBin& other) const;
   void     BranchOutput(TTree* outtree);
-  void     BranchInput(TTree* intree);
+  void     BranchInput(TTree* intree, const bool &loadsketch=false);
   TimeBin& operator=(const TimeBin& other);
   bool     Match(const UInt_t &run, const UShort_t &ls, const UInt_t &time) const;
   bool     Match(const UInt_t &run, const UShort_t &ls) const;
-  void     FillHisto(double x) const {h_scale_->Fill(x);} ;
-  bool     InitHisto( char* name, char* title, const int &Nbin, const double &xmin, const double &xmax);
+  void     FillHisto(double x);
+  bool     InitHisto( char* name, char* title, const int &Nbin, const double &xmin, const double &xmax, const double &sketchcompression=200., const double &sketchbufferfactor=5.);
+  void     RenameHisto(const char* name) {if(h_scale_) {h_scale_->SetName(name); h_scale_->SetTitle(name);}};
+  void     SetHisto(TH1F* h);
+  bool     HasHisto() const {return h_scale_!=0;};
+  void     WriteHisto(TDirectory* dir, const char* name) const {if(h_scale_) dir->WriteTObject(h_scale_, name);};
   int      GetNev() const {return Nev_;};
   double   GetXminScale() const {return h_scale_->GetXaxis()->GetXmin();};
   double   GetXmaxScale() const {return h_scale_->GetXaxis()->GetXmax();};
   bool     Fit(TF1* fitfunc, string fitopt="QRL+", int nTrial=10, string TemplatePlotsFolder="");
+  bool     FitNoGraph(TF1* fitfunc, string fitopt="QRL+", int nTrial=10);
+  void     SaveFitPlot(string TemplatePlotsFolder);
   double   GetMean();
   double   GetMeanError();
   //double GetMean(double xmin, double xmax);
   //double GetMean(double evfraction);
   double   GetMedian();
+  double   GetQuantile(const double &q);
+  void     CompressSketch() {sketch_.Compress();};
+  void     SetSketchCompression(const double &compression) {sketch_.SetCompression(compression);};
   double   GetIntegral(const float &xmin, const float &xmax);
   double   GetBinWidth(const int &ibin);
+  UInt_t   GetRunmin() const {return runmin_;}
+  UInt_t   GetRunmax() const {return runmax_;}
+  UShort_t GetLsmin() const {return lsmin_;}
+  UShort_t GetLsmax() const {return lsmax_;}
+  ULong64_t GetStartKey() const {return RunLSKey(runmin_,lsmin_);}
+  static ULong64_t RunLSKey(const UInt_t &run, const UShort_t &ls) {return ((ULong64_t)run<<16) | ls;}
   UInt_t   GetTimemin() {return timemin_;}
   UInt_t   GetTimemax() {return timemax_;}
   UInt_t   GetTime()    {return 0.5*(timemax_+timemin_);}
@@ -74,6 +91,7 @@ class TimeBin
   double intlumimax_;
   int Nev_;
   TH1F* h_scale_;
+  QuantileSketch sketch_; //values in the histo range, mergeable across jobs
   std::map<std::string,float> variablelist_;
 
 
@@ -27,14 +27,25 @@ using namespace std;
 
 void PrintUsage()
 {
-  cerr << ">>>>> usage:  BuildEopEta --cfg <configFileName> --inputIC <objname> <filename> --Eopweightrange <weightrangemin> <weightrangemax> --Eopweightbins <Nbins> --BuildEopEta_output <outputFileName> --odd[or --even] [--EE]" << endl;
+  cerr << ">>>>> usage:  BuildEopEta --cfg <configFileName> --inputIC <objname> <filename> --Eopweightrange <weightrangemin> <weightrangemax> --Eopweightbins <Nbins> --BuildEopEta_output <outputFileName> --odd[or --even] [--EE] [--profile <profile.json>]" << endl;
   cerr << "               " <<            " --cfg                MANDATORY"<<endl;
   cerr << "               " <<            " --inputIC            OPTIONAL, can be also provided in the cfg"<<endl;
   cerr << "               " <<            " --Eopweightrange     OPTIONAL, can be also provided in the cfg" <<endl; 
   cerr << "               " <<            " --Eopweightbins      OPTIONAL, can be also provided in the cfg" <<endl; 
   cerr << "               " <<            " --BuildEopEta_output OPTIONAL, can be also provided in the cfg" <<endl;
   cerr << "               " <<            " --odd[or --even]     OPTIONAL" <<endl;
+  cerr << "               " <<            " --oddeven            OPTIONAL, fill odd and even in one pass: outputs <output>_odd.root and <output>_even.root" <<endl;
   cerr << "               " <<            " --EE                 OPTIONAL, default false" <<endl;
+  cerr << "               " <<            " --profile            OPTIONAL, save time and calls of the stages of the event loop in the given json file" <<endl;
+}
+
+//output of the given split in the oddeven mode: EopEta.root --> EopEta_odd.root
+string GetSplitFilename(const string &filename, const string &split)
+{
+  size_t extension = filename.rfind(".root");
+  if(extension == string::npos)
+    return filename+"_"+split;
+  return filename.substr(0,extension)+"_"+split+filename.substr(extension);
 }
 
 int main(int argc, char* argv[])
@@ -47,6 +58,7 @@ int main(int argc, char* argv[])
   string outfilename="";
   string splitstat="";
   bool EE=false;
+  string profilefilename="";
 
   //Parse the input options
   for(int iarg=1; iarg<argc; ++iarg)
@@ -73,8 +85,12 @@ int main(int argc, char* argv[])
       splitstat="odd";
     if(string(argv[iarg])=="--even")
       splitstat="even";
+    if(string(argv[iarg])=="--oddeven")
+      splitstat="oddeven";
     if(string(argv[iarg])=="--EE")
       EE=true;
+    if(string(argv[iarg])=="--profile")
+      profilefilename=argv[iarg+1];
   }
 
   if(cfgfilename=="")
@@ -89,7 +105,11 @@ int main(int argc, char* argv[])
 
   //define the calibrator object to easily access to the ntuples data
   calibrator* calorimeter = new calibrator(config);
+  calorimeter->RequireBranches({"ICenergy","momentum"});
   calorimeter->PrintSettings();
+  StageProfiler &profiler = calorimeter->GetProfiler();
+  if(profilefilename!="")
+    profiler.Enable("BuildEopEta");
 
   //set the options directly given as input to the executable, overwriting, in case, the corresponding ones contained in the cfg
   if(ICcfg.size()>0)
@@ -101,7 +121,19 @@ int main(int argc, char* argv[])
       outfilename = config.GetOpt<string> ("Output.BuildEopEta_output");
     else
       outfilename = "EopEta.root";
-  TFile *outFile = new TFile(outfilename.c_str(),"RECREATE");
+
+  //in the oddeven mode each entry is read once and fills the histo of its split (0=odd, 1=even), each split has its own output
+  vector<string> outfilenames;
+  if(splitstat=="oddeven")
+  {
+    outfilenames.push_back(GetSplitFilename(outfilename,"odd"));
+    outfilenames.push_back(GetSplitFilename(outfilename,"even"));
+  }
+  else
+    outfilenames.push_back(outfilename);
+  vector<TFile*> outFiles;
+  for(auto splitfilename : outfilenames)
+    outFiles.push_back(new TFile(splitfilename.c_str(),"RECREATE"));
 
   //define the range for the E/p weight histogram 
   if(Eopweightmin==-1 || Eopweightmax==-1)
@@ -130,11 +162,15 @@ int main(int argc, char* argv[])
   cout<<"> Set Eop range from "<<Eopweightmin<<" to "<<Eopweightmax<<" in "<<Eopweightbins<<" bins"<<endl;
 
 
-  TH2F* Eop_vs_ieta;
-  if(!EE)
-    Eop_vs_ieta = new TH2F("EopEta","EopEta", 171, -85.5, +85.5, Eopweightbins, Eopweightmin, Eopweightmax);
-  else
-    Eop_vs_ieta = new TH2F("EopEta","EopEta", 41, -0.5, +40.5, Eopweightbins, Eopweightmin, Eopweightmax);
+  vector<TH2F*> Eop_vs_ieta;
+  for(auto outFile : outFiles)
+  {
+    outFile->cd();
+    if(!EE)
+      Eop_vs_ieta.push_back(new TH2F("EopEta","EopEta", 171, -85.5, +85.5, Eopweightbins, Eopweightmin, Eopweightmax));
+    else
+      Eop_vs_ieta.push_back(new TH2F("EopEta","EopEta", 41, -0.5, +40.5, Eopweightbins, Eopweightmin, Eopweightmax));
+  }
 
   //loop over entries to fill the histo  
   Long64_t Nentries=calorimeter->GetEntries();
@@ -160,21 +196,38 @@ int main(int argc, char* argv[])
       ientry_increment=2;
     }
   
+  //the calibration skim has one entry per selected electron: the odd/even split is done on the entry of the original ntuples
+  bool skim = calorimeter->isSkim();
+  if(skim)
+  {
+    ientry0=0;
+    ientry_increment=1;
+  }
+
+  int isplit=0;
   for(Long64_t ientry=ientry0 ; ientry<Nentries ; ientry+=ientry_increment)
   {
     if( ientry%100000==0 || (ientry-1)%100000==0)
       std::cout << "Processing entry "<< ientry << "\r" << std::flush;
     calorimeter->GetEntry(ientry);
+    Long64_t splitentry = (skim ? calorimeter->GetSkimEntry() : ientry);
+    if(splitstat=="oddeven")
+      isplit = (splitentry%2==1 ? 0 : 1);
+    else
+      if(skim && splitstat!="" && splitentry%2 != (splitstat=="odd" ? 1 : 0))
+	continue;
     for(int iEle=0;iEle<2;++iEle)
     {
       if(calorimeter->isSelected(iEle))
       {
+	profiler.Start(StageProfiler::kVariable);
 	E=calorimeter->GetICEnergy(iEle);
 	p=calorimeter->GetPcorrected(iEle);
 	if(!EE)
 	  ietaSeed=calorimeter->GetietaSeed(iEle);
 	else
 	  ietaSeed=calorimeter->GetEERingSeed(iEle);
+	profiler.Stop();
 	if(p!=0)
 	{
 	  /*
@@ -188,7 +241,9 @@ int main(int argc, char* argv[])
 		     <<std::endl; 
 	    getchar();
 	  */
-	  Eop_vs_ieta->Fill(ietaSeed,E/p);
+	  profiler.Start(StageProfiler::kFill);
+	  Eop_vs_ieta[isplit]->Fill(ietaSeed,E/p);
+	  profiler.Stop();
 	}
 	//else
 	//  cout<<"[WARNING]: p=0 for entry "<<ientry<<endl;
@@ -200,12 +255,18 @@ int main(int argc, char* argv[])
 
   //save and close
   //if something goes wrong with I/O (usually eos problems) returns failure 
-  if(!outFile->cd())
-    return -1;
-  if(Eop_vs_ieta->Write()<=0)
+  profiler.Start(StageProfiler::kWrite);
+  for(unsigned isplit=0; isplit<outFiles.size(); ++isplit)
+  {
+    if(!outFiles[isplit]->cd())
+      return -1;
+    if(Eop_vs_ieta[isplit]->Write()<=0)
+      return -1;
+    outFiles[isplit]->Close();
+  }
+  profiler.Stop();
+  if(!profiler.Save(profilefilename))
     return -1;
-
-  outFile->Close();
   delete calorimeter;
   return 0;
 }
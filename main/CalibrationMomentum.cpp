@@ -27,19 +27,23 @@ using namespace std;
 
 void PrintUsage()
 {
-  cerr << ">>>>> usage:  CalibrationMomentum --cfg <configFileName>" << endl;
+  cerr << ">>>>> usage:  CalibrationMomentum --cfg <configFileName> [--profile <profile.json>]" << endl;
   cerr << "               " <<            " --cfg                MANDATORY"<<endl;
+  cerr << "               " <<            " --profile            OPTIONAL, save time and calls of the stages of the event loop in the given json file"<<endl;
 }
 
 //**************  MAIN PROGRAM **************************************************************
 int main(int argc, char** argv)
 {
   string cfgfilename="";
+  string profilefilename="";
   // Acquisition from cfg file
   for(int iarg=1; iarg<argc; ++iarg)
   {
     if(string(argv[iarg])=="--cfg")
       cfgfilename=argv[iarg+1];
+    if(string(argv[iarg])=="--profile")
+      profilefilename=argv[iarg+1];
   }
 
   if(cfgfilename=="")
@@ -88,6 +92,10 @@ int main(int argc, char** argv)
 
   //**************************** loop on events
   calibrator* data = new calibrator(config);
+  data->RequireBranches({"ICenergy","momentum","mass"});
+  StageProfiler &profiler = data->GetProfiler();
+  if(profilefilename!="")
+    profiler.Enable("CalibrationMomentum");
   
   long int Nentries = data->GetEntries();
   std::cout << "Loop in data events " << endl;
@@ -122,12 +130,15 @@ int main(int argc, char** argv)
 	continue;
       }
 
+    profiler.Start(StageProfiler::kVariable);
     float Mee_PPositron_EElectron = data->GetMee() * sqrt( data->GetP(posPositron) / data->GetICEnergy(posPositron) ) / 91.19;
     float Mee_PElectron_EPositron = data->GetMee() * sqrt( data->GetP(posElectron) / data->GetICEnergy(posElectron) ) / 91.19;
+    profiler.Stop();
     //NOTE: the correction must be linear in P, therefore I will use Mee^2 to extract the scale correction
 
 
 
+    profiler.Start(StageProfiler::kFill);
     if( doEB && data->isEB(posPositron) )
     {
       /*
@@ -178,6 +189,7 @@ int main(int argc, char** argv)
     else
       if(!doEB && data->isEE(posElectron) )
 	h2_Mee_PElectron_EPositron_vs_phiElectron -> Fill( data->GetPhi(posElectron) , Mee_PElectron_EPositron*Mee_PElectron_EPositron );
+    profiler.Stop();
   }
 
   NEWLINE;
@@ -208,6 +220,7 @@ int main(int argc, char** argv)
 
   int Ngoodfits=0;
   int Nbadfits=0;
+  profiler.Start(StageProfiler::kFit);
   for(int phibin = 1; phibin <= nPhiBins; ++phibin)
   {
     cout<<"Fit progress "<<100*phibin/nPhiBins<<"\%  \r"<<flush;
@@ -288,6 +301,7 @@ int main(int argc, char** argv)
     }
     //NEWLINE;
   }
+  profiler.Stop();
   NEWLINE;
   cout<<"Fit summary:"<<endl;
   cout<<"\t"<<Ngoodfits<<" GOOD fits"<<endl;
@@ -325,6 +339,7 @@ int main(int argc, char** argv)
   //-------
   // Output
   cout<<">> Saving data in "<<outputFile<<endl;
+  profiler.Start(StageProfiler::kWrite);
   o -> cd();
   g_PositronCorrection_vs_phi -> Write();
   g_ElectronCorrection_vs_phi -> Write();
@@ -335,6 +350,8 @@ int main(int argc, char** argv)
   h_Et_Positron->Write();
   h_Et_Electron->Write();
   o -> Close();
+  profiler.Stop();
+  profiler.Save(profilefilename);
 
   cout<<">> Deleting objects"<<endl;
   delete g_PositronCorrection_vs_phi;
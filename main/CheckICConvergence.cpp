@@ -0,0 +1,157 @@
+#include <iostream>
+#include <fstream>
+#include <string>
+#include <cmath>
+#include <cstdlib>
+
+#include "TFile.h"
+#include "TH2D.h"
+#include "TString.h"
+
+using namespace std;
+
+//exit code returned when the ICs converged, used by the DAG to stop the remaining loops
+const int kConverged = 10;
+
+void PrintUsage()
+{
+  cerr << ">>>>> usage:  CheckICConvergence --oldIC <objname> <filename> --newIC <objname> <filename> --loop <iLoop>" << endl;
+  cerr << "               " <<            " --maxRMS            <max RMS of newIC/oldIC-1>                 default 1e-4" <<endl;
+  cerr << "               " <<            " --maxDelta          <max |newIC-oldIC|>                        default 1e-3" <<endl;
+  cerr << "               " <<            " --moveThreshold     <|newIC-oldIC| above which a crystal moves> default 5e-4" <<endl;
+  cerr << "               " <<            " --maxMovingFraction <max fraction of moving crystals>          default 0.01" <<endl;
+  cerr << "               " <<            " --summary           <txt file where one line per loop is appended>" <<endl;
+  cerr << "               " <<            " --finalLoop         <txt file where the final loop is written when converged>" <<endl;
+  cerr << "               " <<            " exit code "<<kConverged<<" when converged, 0 otherwise" <<endl;
+}
+
+TH2D* GetIC(const TString &filename, const TString &objname)
+{
+  TFile file(filename.Data(),"READ");
+  if(file.IsZombie())
+    return 0;
+  TH2D* IC = (TH2D*) file.Get(objname.Data());
+  if(IC)
+    IC->SetDirectory(0);
+  file.Close();
+  return IC;
+}
+
+int main(int argc, char* argv[])
+{
+  //Parse input parameters
+  TString oldFileName="";
+  TString oldObjName="";
+  TString newFileName="";
+  TString newObjName="";
+  TString summaryFileName="";
+  TString finalLoopFileName="";
+  int iLoop=-1;
+  double maxRMS=1e-4;
+  double maxDelta=1e-3;
+  double moveThreshold=5e-4;
+  double maxMovingFraction=0.01;
+
+  for(int iarg=1; iarg<argc; ++iarg)
+  {
+    if(string(argv[iarg])=="--oldIC")
+    {
+      oldObjName=argv[iarg+1];
+      oldFileName=argv[iarg+2];
+    }
+    if(string(argv[iarg])=="--newIC")
+    {
+      newObjName=argv[iarg+1];
+      newFileName=argv[iarg+2];
+    }
+    if(string(argv[iarg])=="--loop")
+      iLoop=atoi(argv[iarg+1]);
+    if(string(argv[iarg])=="--maxRMS")
+      maxRMS=atof(argv[iarg+1]);
+    if(string(argv[iarg])=="--maxDelta")
+      maxDelta=atof(argv[iarg+1]);
+    if(string(argv[iarg])=="--moveThreshold")
+      moveThreshold=atof(argv[iarg+1]);
+    if(string(argv[iarg])=="--maxMovingFraction")
+      maxMovingFraction=atof(argv[iarg+1]);
+    if(string(argv[iarg])=="--summary")
+      summaryFileName=argv[iarg+1];
+    if(string(argv[iarg])=="--finalLoop")
+      finalLoopFileName=argv[iarg+1];
+  }
+
+  if(oldFileName=="" || oldObjName=="" || newFileName=="" || newObjName=="")
+  {
+    PrintUsage();
+    return -1;
+  }
+
+  cout<<">> Comparing "<<newFileName.Data()<<"/"<<newObjName.Data()<<" with "<<oldFileName.Data()<<"/"<<oldObjName.Data()<<endl;
+  TH2D* oldIC = GetIC(oldFileName,oldObjName);
+  TH2D* newIC = GetIC(newFileName,newObjName);
+  if(!oldIC || !newIC)
+  {
+    cout<<"[ERROR]: can't read the ICs"<<endl;
+    return -1;
+  }
+  if(oldIC->GetNbinsX()!=newIC->GetNbinsX() || oldIC->GetNbinsY()!=newIC->GetNbinsY())
+  {
+    cout<<"[ERROR]: IC maps not compatible"<<endl;
+    return -1;
+  }
+
+  //loop over the crystals with a valid IC in both the loops
+  long Ncrystals=0, Nmoving=0;
+  double sum2=0., maxAbsDelta=0.;
+  for(int xbin=1; xbin<newIC->GetNbinsX()+1; ++xbin)
+    for(int ybin=1; ybin<newIC->GetNbinsY()+1; ++ybin)
+    {
+      double oldvalue = oldIC->GetBinContent(xbin,ybin);
+      double newvalue = newIC->GetBinContent(xbin,ybin);
+      if(oldvalue<=0 || newvalue<=0)
+	continue;
+      double delta = fabs(newvalue-oldvalue);
+      sum2 += pow(newvalue/oldvalue-1.,2);
+      if(delta>maxAbsDelta)
+	maxAbsDelta=delta;
+      if(delta>moveThreshold)
+	++Nmoving;
+      ++Ncrystals;
+    }
+
+  if(Ncrystals==0)
+  {
+    cout<<"[ERROR]: no crystal with valid IC"<<endl;
+    return -1;
+  }
+  double RMS = sqrt(sum2/Ncrystals);
+  double movingFraction = 1.*Nmoving/Ncrystals;
+  bool converged = (RMS<maxRMS && maxAbsDelta<maxDelta && movingFraction<maxMovingFraction);
+
+  cout<<">> loop "<<iLoop<<": "<<Ncrystals<<" crystals"<<endl;
+  cout<<">>   RMS(newIC/oldIC-1) = "<<RMS<<" (max "<<maxRMS<<")"<<endl;
+  cout<<">>   max|newIC-oldIC|   = "<<maxAbsDelta<<" (max "<<maxDelta<<")"<<endl;
+  cout<<">>   moving fraction    = "<<movingFraction<<" (max "<<maxMovingFraction<<", threshold "<<moveThreshold<<")"<<endl;
+  cout<<">> "<<(converged ? "CONVERGED" : "not converged")<<endl;
+
+  if(summaryFileName!="")
+  {
+    ofstream summaryFile(summaryFileName.Data(), ios::app);
+    summaryFile<<iLoop<<"\t"<<RMS<<"\t"<<maxAbsDelta<<"\t"<<movingFraction<<"\t"<<converged<<endl;
+    summaryFile.close();
+  }
+
+  delete oldIC;
+  delete newIC;
+
+  if(!converged)
+    return 0;
+
+  if(finalLoopFileName!="")
+  {
+    ofstream finalLoopFile(finalLoopFileName.Data());
+    finalLoopFile<<iLoop<<"\t"<<newFileName.Data()<<endl;
+    finalLoopFile.close();
+  }
+  return kConverged;
+}
@@ -28,13 +28,71 @@ using namespace std;
 
 void PrintUsage()
 {
-  cerr << ">>>>> usage:  ComputeIC_EB --cfg <configFileName> --inputIC <objname> <filename> --Eopweight <objtype> <objname> <filename> --ComputeIC_output <outputFileName> --odd[or --even]" << endl;
+  cerr << ">>>>> usage:  ComputeIC_EB --cfg <configFileName> --inputIC <objname> <filename> --Eopweight <objtype> <objname> <filename> --ComputeIC_output <outputFileName> --odd[or --even] [--profile <profile.json>]" << endl;
   cerr << "               " <<            " --cfg                MANDATORY"<<endl;
   cerr << "               " <<            " --inputIC            OPTIONAL, can be also provided in the cfg"<<endl;
   cerr << "               " <<            " --Eopweight          OPTIONAL, can be also provided in the cfg" <<endl;
   cerr << "               " <<            " --ComputeIC_output    OPTIONAL, can be also provided in the cfg" <<endl;
   cerr << "               " <<            " --odd[or --even]     OPTIONAL" <<endl;
+  cerr << "               " <<            " --oddeven            OPTIONAL, fill odd and even in one pass: outputs <output>_odd.root and <output>_even.root" <<endl;
   cerr << "               " <<            " --EE                 OPTIONAL, default false" <<endl;
+  cerr << "               " <<            " --profile            OPTIONAL, save time and calls of the stages of the event loop in the given json file" <<endl;
+}
+
+//output of the given split in the oddeven mode: IC.root --> IC_odd.root
+string GetSplitFilename(const string &filename, const string &split)
+{
+  size_t extension = filename.rfind(".root");
+  if(extension == string::npos)
+    return filename+"_"+split;
+  return filename.substr(0,extension)+"_"+split+filename.substr(extension);
+}
+
+//compute the temporary IC from numerator and denominator and save everything in outfilename
+//if something goes wrong with I/O (usually eos problems) returns failure
+int WriteOutput(const string &outfilename, ICmanager &numerator, ICmanager &denominator, calibrator* calorimeter)
+{
+  TFile *outFile = new TFile(outfilename.c_str(),"RECREATE");
+  if(!outFile->cd())
+    return -1;
+
+  //get numerator and denominator histos
+  TH2D* h2_numeratorEB = numerator.GetHisto(       0, "numeratorEB",    "numeratorEB");
+  TH2D* h2_denominatorEB = denominator.GetHisto(   0, "denominatorEB",  "denominatorEB");
+  TH2D* h2_numeratorEEm = numerator.GetHisto(     -1, "numeratorEEm",   "numeratorEEm");
+  TH2D* h2_denominatorEEm = denominator.GetHisto( -1, "denominatorEEm", "denominatorEEm");
+  TH2D* h2_numeratorEEp = numerator.GetHisto(     +1, "numeratorEEp",   "numeratorEEp");
+  TH2D* h2_denominatorEEp = denominator.GetHisto( +1, "denominatorEEp", "denominatorEEp");
+
+  //compute temporary IC-pull and IC-values 
+  TH2D* h2_ICpullEB = GetICpull(h2_numeratorEB,h2_denominatorEB);
+  TH2D* h2_temporaryICEB = calorimeter->GetPulledIC(h2_ICpullEB, 0);
+  TH2D* h2_ICpullEEm = GetICpull(h2_numeratorEEm,h2_denominatorEEm);
+  TH2D* h2_temporaryICEEm = calorimeter->GetPulledIC(h2_ICpullEEm, -1);
+  TH2D* h2_ICpullEEp = GetICpull(h2_numeratorEEp,h2_denominatorEEp);
+  TH2D* h2_temporaryICEEp = calorimeter->GetPulledIC(h2_ICpullEEp, +1);
+
+  h2_temporaryICEB->SetName("temporaryICEB");
+  h2_temporaryICEB->SetTitle("temporaryICEB");
+  h2_temporaryICEEm->SetName("temporaryICEEm");
+  h2_temporaryICEEm->SetTitle("temporaryICEEm");
+  h2_temporaryICEEp->SetName("temporaryICEEp");
+  h2_temporaryICEEp->SetTitle("temporaryICEEp");
+
+  //save and close
+  if(!outFile->cd())
+    return -1;
+  if(h2_numeratorEB->Write()<=0 || h2_numeratorEEm->Write()<=0 || h2_numeratorEEp->Write()<=0)
+    return -1;
+  if(h2_denominatorEB->Write()<=0 || h2_denominatorEEm->Write()<=0 || h2_denominatorEEp->Write()<=0)
+    return -1;
+  if(h2_ICpullEB->Write()<=0 || h2_ICpullEEm->Write()<=0 || h2_ICpullEEp->Write()<=0)
+    return -1;
+  if(h2_temporaryICEB->Write()<=0 || h2_temporaryICEEm->Write()<=0 || h2_temporaryICEEp->Write()<=0)
+    return -1;
+
+  outFile->Close();
+  return 0;
 }
 
 int main(int argc, char* argv[])
@@ -45,6 +103,7 @@ int main(int argc, char* argv[])
   string outfilename="";
   string splitstat="";
   bool EE=false;
+  string profilefilename="";
 
   for(int iarg=1; iarg<argc; ++iarg)
   {
@@ -67,8 +126,12 @@ int main(int argc, char* argv[])
       splitstat="odd";
     if(string(argv[iarg])=="--even")
       splitstat="even";
+    if(string(argv[iarg])=="--oddeven")
+      splitstat="oddeven";
     if(string(argv[iarg])=="--EE")
       EE=true;
+    if(string(argv[iarg])=="--profile")
+      profilefilename=argv[iarg+1];
   }
 
   if(cfgfilename=="")
@@ -83,6 +146,10 @@ int main(int argc, char* argv[])
   
   //define the calibrator object to easily access to the ntuples data 
   calibrator* calorimeter = new calibrator(config);
+  calorimeter->RequireBranches({"ICenergy","momentum"});
+  StageProfiler &profiler = calorimeter->GetProfiler();
+  if(profilefilename!="")
+    profiler.Enable("ComputeIC");
 
   //set the options directly given as input to the executable, overwriting, in case, the corresponding ones contained in the cfg
   if(weightcfg.size()>0)
@@ -97,13 +164,17 @@ int main(int argc, char* argv[])
     else
       outfilename = "IC.root";
 
-  TFile *outFile = new TFile(outfilename.c_str(),"RECREATE");
-  ICmanager numerator;
-  ICmanager denominator;
+  //in the oddeven mode each entry is read once and fills the numerator and denominator of its split (0=odd, 1=even)
+  int Nsplits = (splitstat=="oddeven" ? 2 : 1);
+  ICmanager numerator[2];
+  ICmanager denominator[2];
 
   //Initialize numerator and denominator
-  numerator.InitIC(0.);
-  denominator.InitIC(0.);
+  for(int isplit=0; isplit<Nsplits; ++isplit)
+  {
+    numerator[isplit].InitIC(0.);
+    denominator[isplit].InitIC(0.);
+  }
 
   //loop over entries to fill the histo  
   Long64_t Nentries=calorimeter->GetEntries();
@@ -134,11 +205,26 @@ int main(int argc, char* argv[])
       ientry_increment=2;
     }
   
+  //the calibration skim has one entry per selected electron: the odd/even split is done on the entry of the original ntuples
+  bool skim = calorimeter->isSkim();
+  if(skim)
+  {
+    ientry0=0;
+    ientry_increment=1;
+  }
+
+  int isplit=0;
   for(Long64_t ientry=ientry0 ; ientry<Nentries ; ientry+=ientry_increment)
   {
     if( ientry%100000==0 || (ientry-1)%100000==0)
       std::cout << "Processing entry "<< ientry << "\r" << std::flush;
     calorimeter->GetEntry(ientry);
+    Long64_t splitentry = (skim ? calorimeter->GetSkimEntry() : ientry);
+    if(splitstat=="oddeven")
+      isplit = (splitentry%2==1 ? 0 : 1);
+    else
+      if(skim && splitstat!="" && splitentry%2 != (splitstat=="odd" ? 1 : 0))
+	continue;
     for(iEle=0;iEle<2;++iEle)
     {
       if(calorimeter->isSelected(iEle))
@@ -149,10 +235,14 @@ int main(int argc, char* argv[])
 	YRecHit=         calorimeter->GetYRecHit(iEle);
 	ZRecHit=         calorimeter->GetZRecHit(iEle);
 	recoFlagRecHit=  calorimeter->GetrecoFlagRecHit(iEle);
+	profiler.Start(StageProfiler::kVariable);
 	E=               calorimeter->GetICEnergy(iEle);
 	p=               calorimeter->GetPcorrected(iEle);
 	if(p==0)
+	{
+	  profiler.Stop();
 	  continue;
+	}
         //eta=             calorimeter->GetEtaSC(iEle);
 	if(!EE)
 	  ietaSeed=calorimeter->GetietaSeed(iEle);
@@ -160,8 +250,11 @@ int main(int argc, char* argv[])
 	  ietaSeed=calorimeter->GetEERingSeed(iEle);
 	weight=          calorimeter->GetWeight(ietaSeed,E/p);
 	regression=      calorimeter->GetRegression(iEle);
+	profiler.Stop();
 	if(weight==0.)
 	  continue;
+	//the IC of the previous loop is read (flat array) while filling numerator and denominator
+	profiler.Start(StageProfiler::kFill);
 	//cout<<"E="<<E<<"\tp="<<p<<"\teta="<<eta<<"\tweight="<<weight<<"\tregression="<<regression<<endl;
 	for(unsigned iRecHit=0; iRecHit<ERecHit->size(); ++iRecHit)
 	{
@@ -172,51 +265,30 @@ int main(int argc, char* argv[])
 	  iy=YRecHit->at(iRecHit);
 	  iz=ZRecHit->at(iRecHit);
 	  IC=calorimeter->GetIC(ix,iy,iz);
-	  numerator(ix,iy,iz)   += ERecHit->at(iRecHit) * fracRecHit->at(iRecHit) * regression * IC / E * p / E * weight;
-	  denominator(ix,iy,iz) += ERecHit->at(iRecHit) * fracRecHit->at(iRecHit) * regression * IC / E         * weight;
+	  numerator[isplit](ix,iy,iz)   += ERecHit->at(iRecHit) * fracRecHit->at(iRecHit) * regression * IC / E * p / E * weight;
+	  denominator[isplit](ix,iy,iz) += ERecHit->at(iRecHit) * fracRecHit->at(iRecHit) * regression * IC / E         * weight;
 	}
+	profiler.Stop();
       }
     }
   }	  
 
-  //get numerator and denominator histos
-  TH2D* h2_numeratorEB = numerator.GetHisto(       0, "numeratorEB",    "numeratorEB");
-  TH2D* h2_denominatorEB = denominator.GetHisto(   0, "denominatorEB",  "denominatorEB");
-  TH2D* h2_numeratorEEm = numerator.GetHisto(     -1, "numeratorEEm",   "numeratorEEm");
-  TH2D* h2_denominatorEEm = denominator.GetHisto( -1, "denominatorEEm", "denominatorEEm");
-  TH2D* h2_numeratorEEp = numerator.GetHisto(     +1, "numeratorEEp",   "numeratorEEp");
-  TH2D* h2_denominatorEEp = denominator.GetHisto( +1, "denominatorEEp", "denominatorEEp");
-
-  //compute temporary IC-pull and IC-values 
-  TH2D* h2_ICpullEB = GetICpull(h2_numeratorEB,h2_denominatorEB);
-  TH2D* h2_temporaryICEB = calorimeter->GetPulledIC(h2_ICpullEB, 0);
-  TH2D* h2_ICpullEEm = GetICpull(h2_numeratorEEm,h2_denominatorEEm);
-  TH2D* h2_temporaryICEEm = calorimeter->GetPulledIC(h2_ICpullEEm, -1);
-  TH2D* h2_ICpullEEp = GetICpull(h2_numeratorEEp,h2_denominatorEEp);
-  TH2D* h2_temporaryICEEp = calorimeter->GetPulledIC(h2_ICpullEEp, +1);
-
-  h2_temporaryICEB->SetName("temporaryICEB");
-  h2_temporaryICEB->SetTitle("temporaryICEB");
-  h2_temporaryICEEm->SetName("temporaryICEEm");
-  h2_temporaryICEEm->SetTitle("temporaryICEEm");
-  h2_temporaryICEEp->SetName("temporaryICEEp");
-  h2_temporaryICEEp->SetTitle("temporaryICEEp");
-
-  //save and close
-  //if something goes wrong with I/O (usually eos problems) returns failure 
-  if(!outFile->cd())
-    return -1;
-  if(h2_numeratorEB->Write()<=0 || h2_numeratorEEm->Write()<=0 || h2_numeratorEEp->Write()<=0)
-    return -1;
-  if(h2_denominatorEB->Write()<=0 || h2_denominatorEEm->Write()<=0 || h2_denominatorEEp->Write()<=0)
-    return -1;
-  if(h2_ICpullEB->Write()<=0 || h2_ICpullEEm->Write()<=0 || h2_ICpullEEp->Write()<=0)
-    return -1;
-  if(h2_temporaryICEB->Write()<=0 || h2_temporaryICEEm->Write()<=0 || h2_temporaryICEEp->Write()<=0)
+  //compute the temporary IC and save the output of each split
+  profiler.Start(StageProfiler::kWrite);
+  if(splitstat=="oddeven")
+  {
+    if(WriteOutput(GetSplitFilename(outfilename,"odd"), numerator[0], denominator[0], calorimeter)!=0)
+      return -1;
+    if(WriteOutput(GetSplitFilename(outfilename,"even"), numerator[1], denominator[1], calorimeter)!=0)
+      return -1;
+  }
+  else
+    if(WriteOutput(outfilename, numerator[0], denominator[0], calorimeter)!=0)
+      return -1;
+  profiler.Stop();
+  if(!profiler.Save(profilefilename))
     return -1;
 
-  outFile->Close();
-
   delete calorimeter;
   return 0;
 }
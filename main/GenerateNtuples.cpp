@@ -0,0 +1,324 @@
+#include <iostream>
+#include <string>
+#include <vector>
+#include <cmath>
+
+#include "TFile.h"
+#include "TTree.h"
+#include "TRandom3.h"
+#include "TMath.h"
+#include "TString.h"
+#include "TVector2.h"
+
+using namespace std;
+
+//synthetic ECALELF ntuples for the benchmarks (python/benchmark.py) and the tests without access to the real ntuples:
+//the selected and extraCalibTree trees have the branches read by ECALELFInterface::BranchSelected and BranchExtraCalib,
+//two electrons per event (Z->ee) with a seed crystal in EB (ieta,iphi) or EE (ix,iy), a cluster of rechits around the seed,
+//and a run/ls/time structure with a slow response drift (laser-like) growing with |eta|
+
+void PrintUsage()
+{
+  cerr << ">>>>> usage:  GenerateNtuples --output <outputFileName> --Nevents <N> [--extraCalibOutput <outputFileName>] [--Nruns <N>] [--NeventsPerLS <N>] [--EEfraction <f>] [--drift <d>] [--startTime <t>] [--seed <s>]" << endl;
+  cerr << "               " <<            " --output             MANDATORY, selected tree (and extraCalibTree if --extraCalibOutput is not given)"<<endl;
+  cerr << "               " <<            " --Nevents            OPTIONAL, number of events, default 100000"<<endl;
+  cerr << "               " <<            " --extraCalibOutput   OPTIONAL, write the extraCalibTree in this file, as in the ECALELF production"<<endl;
+  cerr << "               " <<            " --Nruns              OPTIONAL, events are shared among Nruns consecutive runs, default 20"<<endl;
+  cerr << "               " <<            " --NeventsPerLS       OPTIONAL, events per lumisection, default 20"<<endl;
+  cerr << "               " <<            " --EEfraction         OPTIONAL, fraction of electrons in the endcaps, default 0.3"<<endl;
+  cerr << "               " <<            " --drift              OPTIONAL, response loss per day at eta=0, default 0.0005"<<endl;
+  cerr << "               " <<            " --startTime          OPTIONAL, unix time of the first event, default 1527000000"<<endl;
+  cerr << "               " <<            " --seed               OPTIONAL, seed of the random generator, default 1"<<endl;
+}
+
+//one rechit of the cluster: crystal, energy fraction of the cluster and reco flag
+struct RecHit
+{
+  int   x;
+  int   y;
+  int   z;
+  float energy;
+  float frac;
+  int   recoFlag;
+};
+
+//EB ieta of the crystal at distance dieta from ieta, skipping ieta=0 (0 outside the barrel)
+int MoveIeta(const int &ieta, const int &dieta)
+{
+  int moved = ieta+dieta;
+  if(ieta>0 && moved<=0)
+    moved -= 1;
+  if(ieta<0 && moved>=0)
+    moved += 1;
+  if(abs(moved)>85)
+    return 0;
+  return moved;
+}
+
+//EE crystal inside the fiducial ring used for the seeds and the rechits
+bool isEEfiducial(const int &ix, const int &iy)
+{
+  double r = sqrt( (ix-50.5)*(ix-50.5) + (iy-50.5)*(iy-50.5) );
+  return r>12 && r<49;
+}
+
+//pseudorapidity of the EE crystal (ix,iy) at the face of the endcap (|z|=317 cm, 2.862 cm crystals)
+float GetEEeta(const int &ix, const int &iy, const int &iz)
+{
+  double r = 2.862*sqrt( (ix-50.5)*(ix-50.5) + (iy-50.5)*(iy-50.5) );
+  double theta = atan2(r, 317.);
+  return iz * (-log(tan(0.5*theta)));
+}
+
+//cluster around the seed: 3x3 core plus a brem tail along phi (iphi in EB, the azimuthal direction in EE)
+//the energy is shared with an exponential profile, few rechits are flagged (recoFlag>=4) or shared with the other cluster (frac<1)
+void MakeCluster(TRandom3 &rnd, const bool &EB, const int &xseed, const int &yseed, const int &zseed, const float &fbrem, const float &rawEnergy, vector<RecHit> &cluster)
+{
+  cluster.clear();
+  int Ntail = int(12*fbrem);
+  double weightsum=0;
+  vector<double> weights;
+  for(int dy=-1-Ntail; dy<=1+Ntail; ++dy)
+    for(int dx=-1; dx<=1; ++dx)
+    {
+      if(abs(dy)>1 && dx!=0)
+	continue;
+      RecHit hit;
+      if(EB)
+      {
+	hit.x = MoveIeta(xseed,dx);
+	hit.y = (yseed-1+dy+360)%360+1;
+	hit.z = 0;
+	if(hit.x==0)
+	  continue;
+      }
+      else
+      {
+	//in EE the brem tail is built along the direction orthogonal to the radius
+	double ux = xseed-50.5, uy = yseed-50.5, norm = sqrt(ux*ux+uy*uy);
+	hit.x = xseed + dx + int(round(-dy*uy/norm));
+	hit.y = yseed + int(round(dy*ux/norm));
+	hit.z = zseed;
+	if(!isEEfiducial(hit.x,hit.y))
+	  continue;
+      }
+      double weight = exp(-1.5*sqrt(dx*dx+dy*dy)) * (abs(dy)>1 ? fbrem : 1.);
+      hit.frac = rnd.Uniform()<0.03 ? rnd.Uniform(0.3,1.) : 1.;
+      hit.recoFlag = rnd.Uniform()<0.02 ? 4+rnd.Integer(10) : (rnd.Uniform()<0.1 ? 1 : 0);
+      weights.push_back(weight);
+      weightsum += weight;
+      cluster.push_back(hit);
+    }
+  for(unsigned ihit=0; ihit<cluster.size(); ++ihit)
+    cluster[ihit].energy = rawEnergy * weights[ihit]/weightsum * rnd.Gaus(1.,0.01);
+}
+
+int main(int argc, char* argv[])
+{
+  string outfilename="";
+  string extracalibfilename="";
+  Long64_t Nevents=100000;
+  int Nruns=20;
+  int NeventsPerLS=20;
+  float EEfraction=0.3;
+  float drift=0.0005;
+  UInt_t startTime=1527000000;
+  UInt_t seed=1;
+
+  //Parse the input options
+  for(int iarg=1; iarg<argc; ++iarg)
+  {
+    if(string(argv[iarg])=="--output")
+      outfilename=argv[iarg+1];
+    if(string(argv[iarg])=="--extraCalibOutput")
+      extracalibfilename=argv[iarg+1];
+    if(string(argv[iarg])=="--Nevents")
+      Nevents=atoll(argv[iarg+1]);
+    if(string(argv[iarg])=="--Nruns")
+      Nruns=atoi(argv[iarg+1]);
+    if(string(argv[iarg])=="--NeventsPerLS")
+      NeventsPerLS=atoi(argv[iarg+1]);
+    if(string(argv[iarg])=="--EEfraction")
+      EEfraction=atof(argv[iarg+1]);
+    if(string(argv[iarg])=="--drift")
+      drift=atof(argv[iarg+1]);
+    if(string(argv[iarg])=="--startTime")
+      startTime=atol(argv[iarg+1]);
+    if(string(argv[iarg])=="--seed")
+      seed=atol(argv[iarg+1]);
+  }
+
+  if(outfilename=="" || Nevents<=0 || Nruns<=0 || NeventsPerLS<=0)
+  {
+    PrintUsage();
+    return -1;
+  }
+
+  //---selected variables---
+  UInt_t   runNumber;
+  UShort_t lumiBlock;
+  UInt_t   eventTime;
+  Int_t    eventNumber;
+  Short_t  chargeEle[3];
+  Short_t  xSeedSC[3];
+  Short_t  ySeedSC[3];
+  Float_t  etaEle[3];
+  Float_t  phiEle[3];
+  Float_t  etaSCEle[3];
+  Float_t  phiSCEle[3];
+  Float_t  rawEnergySCEle[3];
+  Float_t  energySCEle[3];
+  Float_t  esEnergySCEle[3];
+  Float_t  pAtVtxGsfEle[3];
+  Float_t  fbremEle[3];
+  Float_t  invMass;
+  //---extraCalibTree variables---
+  vector<float> ERecHit[2];
+  vector<int>   XRecHit[2];
+  vector<int>   YRecHit[2];
+  vector<int>   ZRecHit[2];
+  vector<int>   recoFlagRecHit[2];
+  vector<float> fracRecHit[2];
+
+  TFile* outFile = new TFile(outfilename.c_str(),"RECREATE");
+  if(!outFile->cd())
+    return -1;
+  TTree* selected = new TTree("selected","selected");
+  selected->Branch("runNumber",        &runNumber,      "runNumber/i");
+  selected->Branch("lumiBlock",        &lumiBlock,      "lumiBlock/s");
+  selected->Branch("eventTime",        &eventTime,      "eventTime/i");
+  selected->Branch("eventNumber",      &eventNumber,    "eventNumber/I");
+  selected->Branch("chargeEle",        chargeEle,       "chargeEle[3]/S");
+  selected->Branch("etaEle",           etaEle,          "etaEle[3]/F");
+  selected->Branch("phiEle",           phiEle,          "phiEle[3]/F");
+  selected->Branch("rawEnergySCEle",   rawEnergySCEle,  "rawEnergySCEle[3]/F");
+  selected->Branch("energy_ECAL_ele",  energySCEle,     "energy_ECAL_ele[3]/F");
+  selected->Branch("invMass_ECAL_ele", &invMass,        "invMass_ECAL_ele/F");
+  selected->Branch("etaSCEle",         etaSCEle,        "etaSCEle[3]/F");
+  selected->Branch("phiSCEle",         phiSCEle,        "phiSCEle[3]/F");
+  selected->Branch("esEnergySCEle",    esEnergySCEle,   "esEnergySCEle[3]/F");
+  selected->Branch("pAtVtxGsfEle",     pAtVtxGsfEle,    "pAtVtxGsfEle[3]/F");
+  selected->Branch("fbremEle",         fbremEle,        "fbremEle[3]/F");
+  selected->Branch("xSeedSC",          xSeedSC,         "xSeedSC[3]/S");
+  selected->Branch("ySeedSC",          ySeedSC,         "ySeedSC[3]/S");
+
+  TFile* extraCalibFile = outFile;
+  if(extracalibfilename!="")
+  {
+    extraCalibFile = new TFile(extracalibfilename.c_str(),"RECREATE");
+    if(!extraCalibFile->cd())
+      return -1;
+  }
+  TTree* extraCalibTree = new TTree("extraCalibTree","extraCalibTree");
+  for(int i=0;i<2;++i)
+  {
+    extraCalibTree->Branch(Form("energyRecHitSCEle%i",i+1),   &ERecHit[i]);
+    extraCalibTree->Branch(Form("XRecHitSCEle%i",i+1),        &XRecHit[i]);
+    extraCalibTree->Branch(Form("YRecHitSCEle%i",i+1),        &YRecHit[i]);
+    extraCalibTree->Branch(Form("ZRecHitSCEle%i",i+1),        &ZRecHit[i]);
+    extraCalibTree->Branch(Form("recoFlagRecHitSCEle%i",i+1), &recoFlagRecHit[i]);
+    extraCalibTree->Branch(Form("fracRecHitSCEle%i",i+1),     &fracRecHit[i]);
+  }
+
+  //run structure: Nruns consecutive runs with the same number of events, 23.31 s lumisections, 2 hours between the runs
+  TRandom3 rnd(seed);
+  Long64_t NeventsPerRun = (Nevents+Nruns-1)/Nruns;
+  const double LSduration = 23.31;
+  double runStartTime = startTime;
+  vector<RecHit> cluster;
+
+  cout<<">> Generating "<<Nevents<<" events in "<<Nruns<<" runs ("<<NeventsPerLS<<" events per lumisection)"<<endl;
+  for(Long64_t ientry=0; ientry<Nevents; ++ientry)
+  {
+    if( ientry%100000==0 )
+      std::cout << "Generating entry "<< ientry << "\r" << std::flush;
+    Long64_t irun = ientry/NeventsPerRun;
+    Long64_t ientry_run = ientry%NeventsPerRun;
+    if(ientry_run==0 && ientry>0)
+      runStartTime += (NeventsPerRun+NeventsPerLS-1)/NeventsPerLS*LSduration + 7200.;
+    runNumber   = 315257 + 3*irun;
+    lumiBlock   = 1 + ientry_run/NeventsPerLS;
+    eventTime   = UInt_t( runStartTime + (lumiBlock-1 + rnd.Uniform())*LSduration );
+    eventNumber = 1000*ientry_run + rnd.Integer(1000);
+    double days = (eventTime - startTime)/86400.;
+
+    //Z->ee with opposite charge electrons, the third slot of the ECALELF arrays is not used
+    invMass = rnd.BreitWigner(91.1876,2.4952) + rnd.Gaus(0.,1.5);
+    Short_t charge = rnd.Uniform()<0.5 ? -1 : +1;
+    for(int i=0;i<2;++i)
+    {
+      bool EB = rnd.Uniform() >= EEfraction;
+      int x,y,z;
+      if(EB)
+      {
+	do x = int(rnd.Integer(171))-85; while(x==0);
+	y = 1 + rnd.Integer(360);
+	z = 0;
+	etaSCEle[i] = (x - (x>0 ? 0.5 : -0.5)) * 0.0174;
+	phiSCEle[i] = TVector2::Phi_mpi_pi( (y-0.5) * TMath::TwoPi()/360. );
+      }
+      else
+      {
+	do {x = 1+rnd.Integer(100); y = 1+rnd.Integer(100);} while(!isEEfiducial(x,y) || fabs(GetEEeta(x,y,1))>2.45);
+	z = rnd.Uniform()<0.5 ? -1 : +1;
+	etaSCEle[i] = GetEEeta(x,y,z);
+	phiSCEle[i] = atan2(y-50.5, x-50.5);
+      }
+      xSeedSC[i]   = x;
+      ySeedSC[i]   = y;
+      chargeEle[i] = (i==0 ? charge : -charge);
+      etaEle[i]    = etaSCEle[i] + rnd.Gaus(0.,0.002);
+      phiEle[i]    = TVector2::Phi_mpi_pi( phiSCEle[i] + rnd.Gaus(0.,0.005) - chargeEle[i]*0.01 );
+      fbremEle[i]  = TMath::Min(0.95, TMath::Max(-0.1, rnd.Exp(0.25)-0.05));
+
+      //true energy from a Jacobian-like pT spectrum, the ECAL response drifts with time (faster at high |eta|)
+      double pT      = 45.*(1. - fabs(rnd.Gaus(0.,0.15)));
+      double Etrue   = pT*cosh(etaSCEle[i]);
+      double response= 1. - drift*days*(1. + pow(fabs(etaSCEle[i])/1.479,2));
+      energySCEle[i]    = Etrue * response * rnd.Gaus(1., EB ? 0.02 : 0.03);
+      esEnergySCEle[i]  = EB ? 0. : Etrue * rnd.Uniform(0.02,0.08);
+      rawEnergySCEle[i] = energySCEle[i]/(EB ? 1.03 : 1.04) - esEnergySCEle[i];
+      pAtVtxGsfEle[i]   = Etrue * rnd.Gaus(1., 0.02+0.08*fbremEle[i]);
+
+      MakeCluster(rnd, EB, x, y, z, fbremEle[i], rawEnergySCEle[i], cluster);
+      ERecHit[i].clear();
+      XRecHit[i].clear();
+      YRecHit[i].clear();
+      ZRecHit[i].clear();
+      recoFlagRecHit[i].clear();
+      fracRecHit[i].clear();
+      for(auto hit : cluster)
+      {
+	ERecHit[i].push_back(hit.energy/hit.frac);
+	XRecHit[i].push_back(hit.x);
+	YRecHit[i].push_back(hit.y);
+	ZRecHit[i].push_back(hit.z);
+	recoFlagRecHit[i].push_back(hit.recoFlag);
+	fracRecHit[i].push_back(hit.frac);
+      }
+    }
+    chargeEle[2]=0;
+    xSeedSC[2]=ySeedSC[2]=0;
+    etaEle[2]=phiEle[2]=etaSCEle[2]=phiSCEle[2]=-999.;
+    rawEnergySCEle[2]=energySCEle[2]=esEnergySCEle[2]=pAtVtxGsfEle[2]=fbremEle[2]=-999.;
+
+    selected->Fill();
+    extraCalibTree->Fill();
+  }
+  cout<<">> "<<selected->GetEntries()<<" events saved in "<<outfilename<<(extracalibfilename!="" ? " and "+extracalibfilename : "")<<endl;
+
+  //save and close
+  //if something goes wrong with I/O returns failure
+  if(!outFile->cd())
+    return -1;
+  if(selected->Write()<=0)
+    return -1;
+  if(!extraCalibFile->cd())
+    return -1;
+  if(extraCalibTree->Write()<=0)
+    return -1;
+  if(extraCalibFile!=outFile)
+    extraCalibFile->Close();
+  outFile->Close();
+  return 0;
+}
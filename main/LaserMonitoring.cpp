@@ -1,6 +1,7 @@
 #include "CfgManager.h"
 #include "CfgManagerT.h"
 #include "MonitoringManager.h"
+#include "HarnessMonitoringManager.h"
 
 #include <iostream>
 #include <string>
@@ -17,7 +18,66 @@ using namespace std;
 
 void PrintUsage()
 {
-  cout<<"Usage: LaserMonitoring.exe --cfg <cfg_filename> [--buildTemplate] [--runDivide] [--scaleMonitor] [--saveHistos] [--scaleFit]"<<endl;
+  cout<<"Usage: LaserMonitoring.exe --cfg <cfg_filename> [--buildTemplate] [--runDivide] [--scaleMonitor] [--singlePass] [--saveHistos] [--fillOnly] [--merge] [--scaleFit] [--profile <profile.json>]"<<endl;
+  cout<<"       --singlePass with --runDivide and --scaleMonitor fills the histos while dividing the runs, in a single loop over the ntuple"<<endl;
+  cout<<"                    (the timebins of runDivide are used, LaserMonitoring.scaleMonitor.runranges is ignored)"<<endl;
+  cout<<"       if LaserMonitoring.harnessmap is given in the cfg, --scaleMonitor runs on all the harnesses in a single pass"<<endl;
+  cout<<"       --merge sums the scaleMonitor outputs LaserMonitoring.merge.inputs and computes again the scales in LaserMonitoring.merge.output"<<endl;
+  cout<<"               (median and quantile scales are computed from the quantile sketches of the bins,"<<endl;
+  cout<<"                the template fits need the histos of the bins: run --scaleMonitor with --saveHistos)"<<endl;
+  cout<<"       --saveHistos saves also the histo of each timebin in the scaleMonitor (and merge) output"<<endl;
+  cout<<"       --fillOnly with --scaleMonitor saves the histos and the quantile sketches of the timebins without computing the scales"<<endl;
+  cout<<"                  (fill jobs of a reduce: the scales are computed once by --merge)"<<endl;
+  cout<<"       --profile saves time and calls of the stages (io, selection, variable, lookup, fill, fit, write) in the given json file"<<endl;
+}
+
+//perform the monitoring, i.e., estrapolate a scale value with the specified method per time bin per variable
+//merged timebins have histos only if all the merged outputs were saved with --saveHistos, otherwise the template fits are skipped
+int RunMonitoredScales(MonitoringManager* monitor, CfgManager config, bool merged=false)
+{
+  vector<string> MonitoredScales = config.GetOpt<vector<string> > ("LaserMonitoring.scaleMonitor.MonitoredScales");
+  for(auto scale : MonitoredScales)
+  {
+    TString method = config.GetOpt<string> (Form("LaserMonitoring.scaleMonitor.%s.method",scale.c_str()));
+    method.ToLower(); //convert capital letters to lower case to avoid mis-understanding
+    if(method=="templatefit")
+    {
+      if(merged && !monitor->HasHistos())
+      {
+	cout<<"[WARNING]: the template fit needs the histos, "<<scale<<" is not computed for merged timebins"<<endl;
+	continue;
+      }
+      monitor->RunTemplateFit(scale);
+    }
+    else
+      if(method=="mean")
+	monitor->RunComputeMean(scale);
+      else
+	if(method=="median")
+	  monitor->RunComputeMedian(scale);
+	else
+	  if(method=="quantile")
+	    monitor->RunComputeQuantile(scale, config.GetOpt<double> (Form("LaserMonitoring.scaleMonitor.%s.quantile",scale.c_str())));
+	  else
+	  {
+	    cout<<"[ERROR]: unknown monitoring method \""<<method<<"\""<<endl;
+	    return -1;
+	  }
+    //save the output
+    string outputfilename = config.GetOpt<string> (merged ? "LaserMonitoring.merge.output" : "LaserMonitoring.scaleMonitor.output");
+    cout<<">> Saving timebins to "<<outputfilename<<endl;
+    monitor->SaveTimeBins(outputfilename);
+  }
+  return 0;
+}
+
+//save the filled timebins with their histos and quantile sketches, to be merged by --merge
+void SaveFilledTimeBins(MonitoringManager* monitor, CfgManager config)
+{
+  monitor->SetSaveHistos(true);
+  string outputfilename = config.GetOpt<string> ("LaserMonitoring.scaleMonitor.output");
+  cout<<">> Saving filled timebins to "<<outputfilename<<endl;
+  monitor->SaveTimeBins(outputfilename);
 }
   
 int main(int argc, char* argv[])
@@ -28,6 +88,10 @@ int main(int argc, char* argv[])
   bool   scaleMonitor  = false;
   bool   scaleFit      = false;
   bool   saveHistos    = false;
+  bool   singlePass    = false;
+  bool   merge         = false;
+  bool   fillOnly      = false;
+  string profilefilename = "";
   
   //Parse the input options
   for(int iarg=1; iarg<argc; ++iarg)
@@ -44,6 +108,14 @@ int main(int argc, char* argv[])
       scaleFit=true;
     if(string(argv[iarg])=="--saveHistos")
       saveHistos=true;
+    if(string(argv[iarg])=="--singlePass")
+      singlePass=true;
+    if(string(argv[iarg])=="--merge")
+      merge=true;
+    if(string(argv[iarg])=="--fillOnly")
+      fillOnly=true;
+    if(string(argv[iarg])=="--profile")
+      profilefilename=argv[iarg+1];
   }
       
   // parse the config file
@@ -52,41 +124,85 @@ int main(int argc, char* argv[])
     PrintUsage();
     return -1;
   }
+  if(singlePass && !(runDivide && scaleMonitor))
+  {
+    cout<<"[ERROR]: --singlePass requires both --runDivide and --scaleMonitor"<<endl;
+    return -1;
+  }
+  if(fillOnly && !scaleMonitor)
+  {
+    cout<<"[ERROR]: --fillOnly requires --scaleMonitor"<<endl;
+    return -1;
+  }
   CfgManager config;
   config.ParseConfigFile(cfgfilename.c_str());
   
   // define the monitoring manager object
-  MonitoringManager monitor(config);
+  // in multi-harness mode all the harnesses are monitored in a single pass over the ntuple
+  MonitoringManager* monitor;
+  HarnessMonitoringManager* harnessmonitor = 0;
+  if(config.OptExist("LaserMonitoring.harnessmap"))
+  {
+    harnessmonitor = new HarnessMonitoringManager(config);
+    monitor = harnessmonitor;
+    if(harnessmonitor->GetNharness()==0)
+    {
+      cout<<"[ERROR]: no harness loaded from "<<config.GetOpt<string> ("LaserMonitoring.harnessmap")<<endl;
+      return -1;
+    }
+  }
+  else
+    monitor = new MonitoringManager(config);
+  if(profilefilename!="")
+    monitor->GetProfiler().Enable("LaserMonitoring");
 
   // perform the requested tasks
   
   if(buildTemplate)
   {
-    TH1F* h_template = monitor.BuildTemplate();
+    if(harnessmonitor)
+    {
+      cout<<"[ERROR]: buildTemplate is not supported in multi-harness mode"<<endl;
+      return -1;
+    }
+    TH1F* h_template = monitor->BuildTemplate();
     string outfilename = config.GetOpt<string> ("LaserMonitoring.BuildTemplate.output");
     TFile* outfile = new TFile(outfilename.c_str(),"RECREATE");
     outfile->cd();
     cout<<">> Saving template to "<<outfilename<<"/"<<h_template->GetName()<<endl;
+    monitor->GetProfiler().Start(StageProfiler::kWrite);
     h_template->Write();
+    monitor->GetProfiler().Stop();
     outfile->Close();
   }
 
   if(runDivide)
   {
+    if(harnessmonitor)
+    {
+      cout<<"[ERROR]: runDivide is not supported in multi-harness mode, provide LaserMonitoring.scaleMonitor.runranges"<<endl;
+      return -1;
+    }
     string outputfilename = config.GetOpt<string> ("LaserMonitoring.RunDivide.output");
-    monitor.RunDivide();
+    monitor->RunDivide(singlePass);
     cout<<">> Saving timebins to "<<outputfilename<<endl;
-    monitor.SaveTimeBins(outputfilename);
+    monitor->SaveTimeBins(outputfilename);
   }
 
+  monitor->SetSaveHistos(saveHistos);
+
   if(scaleMonitor)
   {
 
+    //in single pass mode the timebins and their histos have been filled by runDivide
+    if(singlePass)
+      cout<<">> Monitoring the timebins of runDivide"<<endl;
+    else
     if(config.OptExist("LaserMonitoring.scaleMonitor.runtimes"))
     {
       auto runranges = config.GetOpt<vector<UInt_t> >("LaserMonitoring.scaleMonitor.runranges");
       auto runtimes = config.GetOpt<vector<UInt_t> >("LaserMonitoring.scaleMonitor.runtimes");
-      monitor.LoadTimeBins(runranges, runtimes);
+      monitor->LoadTimeBins(runranges, runtimes);
     }
     else
     {
@@ -100,48 +216,61 @@ int main(int argc, char* argv[])
         objname = inputconf.at(0);
         inputfilename = inputconf.at(1);
       }
-      monitor.LoadTimeBins(inputfilename,objname);
+      monitor->LoadTimeBins(inputfilename,objname);
     }
 
     //fill the histos (one histo per time bin) 
-    monitor.FillTimeBins();
-
-    //perform the monitoring, i.e., estrapolate a scale value with the specified method per time bin per variable
-    vector<string> MonitoredScales = config.GetOpt<vector<string> > ("LaserMonitoring.scaleMonitor.MonitoredScales");
-    for(auto scale : MonitoredScales)
+    if(harnessmonitor)
     {
-      TString method = config.GetOpt<string> (Form("LaserMonitoring.scaleMonitor.%s.method",scale.c_str()));
-      method.ToLower(); //convert capital letters to lower case to avoid mis-understanding
-      if(method=="templatefit")
-	monitor.RunTemplateFit(scale);
-      else
-	if(method=="mean")
-	  monitor.RunComputeMean(scale);
+      harnessmonitor->FillTimeBins();
+      for(int iharness=0; iharness<harnessmonitor->GetNharness(); ++iharness)
+      {
+	cout<<">> Monitoring harness "<<harnessmonitor->GetHarnessName(iharness)<<endl;
+	harnessmonitor->SelectHarness(iharness);
+	if(fillOnly)
+	  SaveFilledTimeBins(monitor, harnessmonitor->GetHarnessConfig(iharness));
 	else
-	  if(method=="median")
-	    monitor.RunComputeMedian(scale);
-	  else
-	  {
-	    cout<<"[ERROR]: unknown monitoring method \""<<method<<"\""<<endl;
+	  if(RunMonitoredScales(monitor, harnessmonitor->GetHarnessConfig(iharness))!=0)
 	    return -1;
-	  }
-      //save the output
-      string outputfilename = config.GetOpt<string> ("LaserMonitoring.scaleMonitor.output");
-      cout<<">> Saving timebins to "<<outputfilename<<endl;
-      monitor.SaveTimeBins(outputfilename);
-
+      }
+      harnessmonitor->SelectHarness(-1);
+    }
+    else
+    {
+      if(singlePass)
+	monitor->UpdateNev();
+      else
+	monitor->FillTimeBins();
+      if(fillOnly)
+	SaveFilledTimeBins(monitor, config);
+      else
+	if(RunMonitoredScales(monitor, config)!=0)
+	  return -1;
     }
+
     cout<<"loaded+produced scales are:"<<endl;
-    monitor.PrintScales();
+    monitor->PrintScales();
     //string writemethod = config.GetOpt<string> ("LaserMonitoring.scaleMonitor.outputmethod");
     //TFile* outfile = new TFile(outfilename.c_str(),writemethod.c_str());
-    //monitor.SaveScales(outfile);
-    //if(saveHistos)
-    //monitor.saveHistos(outfile);
+    //monitor->SaveScales(outfile);
     //outfile->Close();
     
   }//end scaleMonitor
 
+  if(merge)
+  {
+    if(harnessmonitor)
+    {
+      cout<<"[ERROR]: merge is not supported in multi-harness mode, merge the outputs harness by harness"<<endl;
+      return -1;
+    }
+    vector<string> inputfilenames = config.GetOpt<vector<string> >("LaserMonitoring.merge.inputs");
+    monitor->MergeTimeBins(inputfilenames);
+    if(RunMonitoredScales(monitor, config, true)!=0)
+      return -1;
+    monitor->PrintScales();
+  }
+
   if(scaleFit)
   {
     vector<string> inputconf = config.GetOpt<vector<string> >("LaserMonitoring.scaleFit.inputfilename");
@@ -154,16 +283,21 @@ int main(int argc, char* argv[])
       objname = inputconf.at(0);
       inputfilename = inputconf.at(1);
     }
-    monitor.LoadTimeBins(inputfilename,objname);
-    monitor.fitScale();
+    monitor->LoadTimeBins(inputfilename,objname);
+    monitor->fitScale();
     //save the output
     string outputfilename = config.GetOpt<string> ("LaserMonitoring.scaleFit.output");
     cout<<">> Saving timebins to "<<outputfilename<<endl;
-    monitor.SaveTimeBins(outputfilename);      
+    monitor->SaveTimeBins(outputfilename);      
   }
     
+  if(profilefilename!="")
+    monitor->GetProfiler().Save(profilefilename);
     
-
+  if(harnessmonitor)
+    delete harnessmonitor;
+  else
+    delete monitor;
   
   return 0;
   
@@ -0,0 +1,81 @@
+#include "CfgManager.h"
+#include "CfgManagerT.h"
+#include "ECALELFInterface.h"
+
+#include <iostream>
+#include <string>
+
+#include "TFile.h"
+#include "TTree.h"
+
+using namespace std;
+
+void PrintUsage()
+{
+  cerr << ">>>>> usage:  SkimCalibration --cfg <configFileName> --output <outputFileName>" << endl;
+  cerr << "               " <<            " --cfg                MANDATORY"<<endl;
+  cerr << "               " <<            " --output             OPTIONAL, default calibskim.root" <<endl;
+  cerr << "               " <<            " the skim is read back with Input.treelist calibskim and Input.calibskim.filelist" <<endl;
+}
+
+int main(int argc, char* argv[])
+{
+  string cfgfilename="";
+  string outfilename="calibskim.root";
+
+  for(int iarg=1; iarg<argc; ++iarg)
+  {
+    if(string(argv[iarg])=="--cfg")
+      cfgfilename=argv[iarg+1];
+    if(string(argv[iarg])=="--output")
+      outfilename=argv[iarg+1];
+  }
+
+  if(cfgfilename=="")
+  {
+    PrintUsage();
+    return -1;
+  }
+
+  // parse the config file
+  CfgManager config;
+  config.ParseConfigFile(cfgfilename.c_str());
+
+  //the selection of the cfg is applied here once for all the calibration loops
+  ECALELFInterface* ntuple = new ECALELFInterface(config);
+  ntuple->RequireBranches({"ICenergy","momentum"});
+  if(ntuple->isSkim())
+  {
+    cout<<"[ERROR]: the input is already a calibration skim"<<endl;
+    return -1;
+  }
+
+  TFile *outFile = new TFile(outfilename.c_str(),"RECREATE");
+  if(!outFile->cd())
+    return -1;
+  TTree* skimtree = ntuple->BookSkimTree("calibskim");
+
+  Long64_t Nentries=ntuple->GetEntries();
+  cout<<Nentries<<" entries"<<endl;
+  for(Long64_t ientry=0 ; ientry<Nentries ; ++ientry)
+  {
+    if( ientry%100000==0 )
+      std::cout << "Processing entry "<< ientry << "\r" << std::flush;
+    ntuple->GetEntry(ientry);
+    for(int iEle=0;iEle<2;++iEle)
+      if(ntuple->isSelected(iEle))
+	ntuple->FillSkimTree(skimtree, ientry, iEle);
+  }
+  cout<<">> "<<skimtree->GetEntries()<<" selected electrons saved in "<<outfilename<<endl;
+
+  //save and close
+  //if something goes wrong with I/O (usually eos problems) returns failure
+  if(!outFile->cd())
+    return -1;
+  if(skimtree->Write()<=0)
+    return -1;
+  outFile->Close();
+
+  delete ntuple;
+  return 0;
+}
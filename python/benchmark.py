@@ -0,0 +1,258 @@
+#!/bin/python
+import os
+import sys
+import re
+import json
+import time
+import socket
+import subprocess
+from optparse import OptionParser
+import jobAccounting
+import harness_definition
+
+#############################################################################
+# end-to-end throughput benchmark on synthetic ECALELF ntuples (GenerateNtuples.exe), no access to the real ntuples needed
+# for each size the ntuple is generated (once, it is reused by the next runs) and the following steps are timed:
+#   monitoring:          LaserMonitoring.exe --runDivide --scaleMonitor --singlePass
+#   harnessMonitoring:   LaserMonitoring.exe --scaleMonitor with the harness map (all the harnesses in a single pass)
+#   BuildEopEta:         BuildEopEta.exe
+#   ComputeIC:           ComputeIC.exe with the E/p weight of BuildEopEta
+#   harness_corrections: harness_corrections.py --LinearFit on the harnessMonitoring outputs
+# harnessMonitoring uses the timebins of monitoring, ComputeIC the E/p weight of BuildEopEta, harness_corrections the
+# outputs of harnessMonitoring: a subset of the steps (--steps) needs the outputs of a previous run in the same workdir
+# wall time, cpu time and peak RSS are measured by jobAccounting.RunCommand, the events/s are given on the generated events
+# the results are appended to the history file and compared with a previous run: a step is flagged as a regression
+# if its events/s decreased or its peak RSS increased by more than the threshold (the exit code is 1 in that case)
+#############################################################################
+
+steps = ["monitoring","harnessMonitoring","BuildEopEta","ComputeIC","harness_corrections"]
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def GetCommit():
+    #commit of the benchmarked code, "+" if there are local changes
+    try:
+        commit = subprocess.check_output(["git","-C",repo_dir,"rev-parse","--short","HEAD"]).strip()
+        dirty = subprocess.check_output(["git","-C",repo_dir,"status","--porcelain","--untracked-files=no"]).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return "unknown"
+    return commit+("+" if dirty!="" else "")
+
+def WriteConfig(templatefilename,cfgfilename,replacements,removeHarnessmap=False):
+    with open(templatefilename) as fi:
+        contents = fi.read()
+    for token,value in replacements:
+        contents = contents.replace(token,value)
+    if removeHarnessmap:
+        contents = re.sub(r"^\s*harnessmap\s.*\n", "", contents, flags=re.M)
+    with open(cfgfilename,"w") as fo:
+        fo.write(contents)
+
+def RunStep(name,command,sizedir):
+    #run command through the accounting of jobAccounting, its output goes in <sizedir>/<name>.log
+    sidecarname = sizedir+"/benchmark.acct.json"
+    logfilename = sizedir+"/"+name+".log"
+    print(">> %-20s %s"%(name," ".join(command)))
+    stdout = sys.stdout
+    with open(logfilename,"w") as logfile:
+        sys.stdout = logfile
+        try:
+            exitcode = jobAccounting.RunCommand(command,sidecarname,False)
+        finally:
+            sys.stdout = stdout
+    with open(sidecarname) as infile:
+        step = json.load(infile)["steps"][-1]
+    if exitcode!=0:
+        print("[ERROR]: %s failed with exit code %i, see %s"%(name,exitcode,logfilename))
+    return step
+
+def LoadStages(profilefilename):
+    #time of each stage of the --profile output of the executables
+    if not os.path.isfile(profilefilename):
+        return {}
+    with open(profilefilename) as infile:
+        profile = json.load(infile)
+    return dict((stage,values["time"]) for stage,values in profile["stages"].items())
+
+def RunSize(Nevents,options):
+    sizedir = os.path.abspath("%s/N%i/"%(options.workdir,Nevents))
+    os.system("mkdir -p "+sizedir)
+    if os.path.isfile(sizedir+"/benchmark.acct.json"):
+        os.remove(sizedir+"/benchmark.acct.json")
+    results = {}
+
+    #generate the ntuple once, it is generated again only if the generator settings changed
+    ntuplefilename = sizedir+"/ntuple.root"
+    generator_command = [options.exedir+"/GenerateNtuples.exe","--output",ntuplefilename,"--Nevents",str(Nevents),
+                         "--Nruns",str(options.Nruns),"--EEfraction",str(options.EEfraction),"--seed",str(options.seed)]
+    generator_settings = sizedir+"/ntuple.settings"
+    if options.regenerate or not os.path.isfile(ntuplefilename) or not os.path.isfile(generator_settings) or open(generator_settings).read()!=" ".join(generator_command):
+        step = RunStep("GenerateNtuples",generator_command,sizedir)
+        if step["exit_code"]!=0:
+            return results
+        with open(generator_settings,"w") as outfile:
+            outfile.write(" ".join(generator_command))
+    else:
+        print(">> reusing "+ntuplefilename)
+
+    #cfgs of the steps
+    harnessmap_filename = sizedir+"/harness_ranges.txt"
+    harness_ranges = harness_definition.GetHarnessRanges()
+    harness_definition.WriteHarnessRanges(harnessmap_filename,harness_ranges)
+    harnessdir = sizedir+"/harnesses/"
+    for harness_range in harness_ranges:
+        os.system("mkdir -p %s/IEta_%i_%i_IPhi_%i_%i/"%(harnessdir,harness_range[0],harness_range[1],harness_range[2],harness_range[3]))
+    Nevmax_bin = options.Nevmax_bin if options.Nevmax_bin>0 else max(1000,Nevents/20)
+    replacements = [("SELECTED_INPUTFILE",ntuplefilename),
+                    ("EXTRACALIBTREE_INPUTFILE",ntuplefilename),
+                    ("EERINGS_FILE",repo_dir+"/data/eerings.dat"),
+                    ("MOMENTUMCORRECTION_FILE",options.momentumCorrection),
+                    ("HARNESSMAP",harnessmap_filename),
+                    ("NEVMAX_BIN",str(Nevmax_bin)),
+                    ("OUTPUT_RUNDIVIDE",sizedir+"/runranges.root"),
+                    ("BUILDEOPETA_OUTPUT",sizedir+"/EopEta.root"),
+                    ("COMPUTEIC_OUTPUT",sizedir+"/IC.root")]
+    WriteConfig(repo_dir+"/cfg/benchmark_monitoring.cfg",sizedir+"/monitoring.cfg",
+                replacements+[("OUTPUT_SCALEMONITORING",sizedir+"/scalemonitoring.root")],True)
+    WriteConfig(repo_dir+"/cfg/benchmark_monitoring.cfg",sizedir+"/harness_monitoring.cfg",
+                replacements+[("OUTPUT_SCALEMONITORING",harnessdir+"/IEta_IETAMIN_IETAMAX_IPhi_IPHIMIN_IPHIMAX/out_file_0_scalemonitoring.root")])
+    WriteConfig(repo_dir+"/cfg/benchmark_calibration.cfg",sizedir+"/calibration.cfg",replacements)
+
+    commands = {"monitoring":          [options.exedir+"/LaserMonitoring.exe","--cfg",sizedir+"/monitoring.cfg","--runDivide","--scaleMonitor","--singlePass"],
+                "harnessMonitoring":   [options.exedir+"/LaserMonitoring.exe","--cfg",sizedir+"/harness_monitoring.cfg","--scaleMonitor"],
+                "BuildEopEta":         [options.exedir+"/BuildEopEta.exe","--cfg",sizedir+"/calibration.cfg"],
+                "ComputeIC":           [options.exedir+"/ComputeIC.exe","--cfg",sizedir+"/calibration.cfg","--Eopweight","TH2F","EopEta",sizedir+"/EopEta.root"],
+                "harness_corrections": ["python",repo_dir+"/python/harness_corrections.py","-i",harnessdir,"-o",sizedir+"/corrections/",
+                                        "--LinearFit","--force","--rebuildCache","-j",str(options.Nprocesses)]}
+    for name in steps:
+        if not name in options.steps:
+            continue
+        command = commands[name]
+        profilefilename = sizedir+"/"+name+"_profile.json"
+        if command[0].endswith(".exe"):
+            if os.path.isfile(profilefilename):
+                os.remove(profilefilename)
+            command = command+["--profile",profilefilename]
+        step = RunStep(name,command,sizedir)
+        results[name] = {"wall_time": step["wall_time"],
+                         "cpu_time": step["cpu_time"],
+                         "peak_rss_MB": step["peak_rss_MB"],
+                         "events_per_s": Nevents/step["wall_time"] if step["wall_time"]>0 else 0.,
+                         "exit_code": step["exit_code"],
+                         "stages": LoadStages(profilefilename)}
+    return results
+
+def GetReference(history,run,mode):
+    #previous run (or the best one for each step) on the same host, on any host if none
+    candidates = [previous for previous in history if previous["host"]==run["host"]]
+    if len(candidates)==0 and len(history)>0:
+        print("[WARNING]: no previous benchmark on "+run["host"]+" --> compare with the runs on other hosts")
+        candidates = history
+    if len(candidates)==0:
+        return None
+    if mode=="previous":
+        return candidates[-1]["results"]
+    best = {}
+    for previous in candidates:
+        for size,size_results in previous["results"].items():
+            for name,result in size_results.items():
+                if result["exit_code"]!=0:
+                    continue
+                if not name in best.setdefault(size,{}) or result["events_per_s"]>best[size][name]["events_per_s"]:
+                    best[size][name] = result
+    return best
+
+def CompareResults(results,reference,threshold):
+    #print the results with the ratio to the reference, return the list of regressions
+    regressions = []
+    print("----------------------------------------------------------------------------------")
+    print("%10s %-20s %10s %12s %10s %10s %10s"%("events","step","wall [s]","events/s","vs ref","RSS [MB]","vs ref"))
+    for size in sorted(results.keys(),key=int):
+        for name in steps:
+            if not name in results[size]:
+                continue
+            result = results[size][name]
+            ref = reference.get(size,{}).get(name) if reference else None
+            rate_ratio = "-"
+            rss_ratio = "-"
+            flag = ""
+            if result["exit_code"]!=0:
+                flag = "FAILED"
+            elif ref and ref["exit_code"]==0:
+                if ref["events_per_s"]>0:
+                    rate_ratio = "x%.2f"%(result["events_per_s"]/ref["events_per_s"])
+                    if result["events_per_s"] < (1.-threshold)*ref["events_per_s"]:
+                        flag = "REGRESSION"
+                if ref["peak_rss_MB"]>0:
+                    rss_ratio = "x%.2f"%(result["peak_rss_MB"]/ref["peak_rss_MB"])
+                    if result["peak_rss_MB"] > (1.+threshold)*ref["peak_rss_MB"]:
+                        flag = "REGRESSION"
+            if flag=="REGRESSION":
+                regressions.append((size,name))
+            print("%10s %-20s %10.1f %12.0f %10s %10.0f %10s %s"%(size,name,result["wall_time"],result["events_per_s"],rate_ratio,result["peak_rss_MB"],rss_ratio,flag))
+    print("----------------------------------------------------------------------------------")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--sizes",     action="store", type="str",   dest="sizes",     default="10000,100000,1000000", help="comma separated numbers of generated events")
+    parser.add_option("--steps",     action="store", type="str",   dest="steps",     default=",".join(steps),        help="comma separated steps to run, among "+",".join(steps))
+    parser.add_option("-o", "--workdir", action="store", type="str", dest="workdir", default="./benchmark/",         help="folder of the ntuples and of the outputs")
+    parser.add_option("-e", "--exedir",  action="store", type="str", dest="exedir",  default=repo_dir+"/bin/",       help="executable directory")
+    parser.add_option("--history",   action="store", type="str",   dest="history",   default="",                     help="json file of the results of all the runs (default <workdir>/benchmark_history.json)")
+    parser.add_option("-l", "--label", action="store", type="str", dest="label",     default="",                     help="label of this run saved in the history")
+    parser.add_option("--compareTo", action="store", type="str",   dest="compareTo", default="previous",             help="reference of the regression check: previous or best")
+    parser.add_option("--threshold", action="store", type="float", dest="threshold", default=0.1,                    help="relative loss of events/s (or increase of peak RSS) flagged as a regression")
+    parser.add_option("--noSave",    action="store_true",          dest="noSave",    default=False,                  help="do not append this run to the history")
+    parser.add_option("--regenerate", action="store_true",         dest="regenerate", default=False,                 help="generate again the ntuples")
+    parser.add_option("--Nruns",     action="store", type="int",   dest="Nruns",     default=20,                     help="runs of the generated ntuples")
+    parser.add_option("--EEfraction", action="store", type="float", dest="EEfraction", default=0.3,                  help="fraction of EE electrons of the generated ntuples")
+    parser.add_option("--seed",      action="store", type="int",   dest="seed",      default=1,                      help="seed of the generated ntuples")
+    parser.add_option("--Nevmax_bin", action="store", type="int",  dest="Nevmax_bin", default=0,                     help="events per timebin of runDivide (default: 1/20 of the generated events)")
+    parser.add_option("-j", "--Nprocesses", action="store", type="int", dest="Nprocesses", default=1,                help="processes of harness_corrections.py")
+    parser.add_option("--momentumCorrection", action="store", type="str", dest="momentumCorrection",
+                      default=repo_dir+"/data/EBmomentumcorrection_calibration2017_runBCDEF_ULrereco_harnesstag.root", help="momentum correction of BuildEopEta and ComputeIC")
+    (options, args) = parser.parse_args()
+
+    options.steps = options.steps.split(",")
+    for name in options.steps:
+        if not name in steps:
+            print("[ERROR]: unknown step "+name)
+            sys.exit(1)
+    if not options.compareTo in ["previous","best"]:
+        print("[ERROR]: --compareTo must be previous or best")
+        sys.exit(1)
+    options.exedir = os.path.abspath(options.exedir)
+    historyfilename = options.history if options.history!="" else options.workdir+"/benchmark_history.json"
+
+    run = {"timestamp": time.time(),
+           "label": options.label,
+           "commit": GetCommit(),
+           "host": socket.gethostname(),
+           "settings": {"Nruns": options.Nruns, "EEfraction": options.EEfraction, "seed": options.seed, "Nevmax_bin": options.Nevmax_bin},
+           "results": {}}
+    for size in options.sizes.split(","):
+        print("----------------------------------------------------------------------------------")
+        print("benchmark on %s events"%size)
+        run["results"][size] = RunSize(int(size),options)
+
+    history = []
+    if os.path.isfile(historyfilename):
+        with open(historyfilename) as infile:
+            history = json.load(infile)
+    #only the runs with the same generator settings are comparable
+    history = [previous for previous in history if previous.get("settings")==run["settings"]]
+    regressions = CompareResults(run["results"],GetReference(history,run,options.compareTo),options.threshold)
+    print("commit %s on %s: %i regressions (threshold %.0f%%, reference: %s run)"%(run["commit"],run["host"],len(regressions),100*options.threshold,options.compareTo))
+
+    if not options.noSave:
+        full_history = []
+        if os.path.isfile(historyfilename):
+            with open(historyfilename) as infile:
+                full_history = json.load(infile)
+        full_history.append(run)
+        with open(historyfilename+".tmp","w") as outfile:
+            json.dump(full_history,outfile,indent=1)
+        os.rename(historyfilename+".tmp",historyfilename)
+        print(">> results saved in "+historyfilename)
+    sys.exit(1 if len(regressions)>0 else 0)
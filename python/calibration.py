@@ -9,7 +9,59 @@ import subprocess
 from optparse import OptionParser
 import time
 import datetime
+import re
 import findFiles
+import localExecutor
+import jobAccounting
+
+def WritePartialMerges(task,iLoop,prefix,inputfiles,fanin):
+    #tree-reduction merge: each level hadds groups of fanin files in parallel jobs (one DAG node per level)
+    #return the DAG nodes of the levels and the files left for the final merge
+    nodes = []
+    level = 0
+    while fanin>1 and len(inputfiles)>fanin:
+        levelname = "partialmerge"+task+"_loop_"+str(iLoop)+"_level_"+str(level)
+        leveldir = job_parent_folder+"/"+levelname+"/"
+        os.system("mkdir -p "+leveldir)
+        outputfiles = []
+        for igroup in range(0,int(math.ceil(float(len(inputfiles))/fanin))):
+            outputfile = str(options.outdir)+"/"+prefix+"_loop_"+str(iLoop)+"_merge_level_"+str(level)+"_group_"+str(igroup)+".root"
+            mergescriptName = leveldir+"/merge_group_"+str(igroup)+".sh"
+            mergescript = open( mergescriptName,"w")
+            mergescript.write("#!/bin/bash\n")
+            mergescript.write("cd /afs/cern.ch/work/f/fmonti/flashggNew/CMSSW_10_5_0/\n")
+            mergescript.write('eval `scram runtime -sh`\n');
+            mergescript.write("cd -\n");
+            mergescript.write(jobAccounting.AccountedCommand("hadd -f -k "+outputfile+" "+" ".join(inputfiles[igroup*fanin:(igroup+1)*fanin]),mergescriptName,True)+"\n")
+            mergescript.close()
+            os.system("chmod 777 "+mergescriptName)
+            outputfiles.append(outputfile)
+
+        mergesubFilename=job_parent_folder+"/submit_"+levelname+".sub"
+        mergesub = open( mergesubFilename,"w")
+        mergesub.write("executable            = $(scriptname)\n")
+        mergesub.write("output                = $(scriptname).$(ClusterId).out\n")
+        mergesub.write("error                 = $(scriptname).$(ClusterId).err\n")
+        mergesub.write("log                   = "+job_parent_folder+"/log/log.$(ClusterId).log\n")
+        mergesub.write('+JobFlavour           = "longlunch"\n')
+        if options.tier0:
+            mergesub.write('+AccountingGroup      = "group_u_CMS.CAF.ALCA"\n')
+        mergesub.write("queue scriptname matching "+leveldir+"/merge_group_*.sh\n")
+        mergesub.close()
+        dagFile.write("JOB "+levelname+" "+mergesubFilename+"\n")
+
+        nodes.append(levelname)
+        inputfiles = outputfiles
+        level += 1
+    return nodes, inputfiles
+
+def GetSkimConfig(contents,skimfilename):
+    #read the calibration skim instead of the ECALELF trees: the selection is already applied in the skim
+    skimcontents, Nreplaced = re.subn(r"treelist\s+selected\s+extraCalibTree", "treelist calibskim", contents)
+    if Nreplaced==0 or not "</Input>" in skimcontents:
+        print("[ERROR]: can't find 'treelist selected extraCalibTree' in the Input block of "+str(options.configFile)+" --> EXIT")
+        sys.exit()
+    return skimcontents.replace("</Input>", "  <calibskim>\n    filelist "+skimfilename+"\n  </calibskim>\n</Input>", 1)
 
 #print date
 print("----------------------------------------------------------------------------------")
@@ -29,6 +81,7 @@ ignored_ntuples_label_list = ["obsolete"]#ntuples containing anywhere in the pat
 #parse arguments
 parser = OptionParser()
 parser.add_option('--submit',          action='store_true',             dest='submit',          default=False,      help='submit jobs')
+parser.add_option("--local",           action="store",      type="int", dest="local",           default=0,          help="run the jobs on this machine with the given number of parallel processes instead of submitting them")
 parser.add_option("-l", "--label",     action="store",      type="str", dest="label",                               help="job label")
 parser.add_option("-v", "--verbosity", action="store",      type="int", dest="verbosity",       default=1,          help="verbosity level")
 parser.add_option("-o", "--outdir",    action="store",      type="str", dest="outdir",          default="./",       help="output directory")
@@ -38,8 +91,27 @@ parser.add_option("-N", "--Nloop",     action="store",      type="int", dest="Nl
 parser.add_option("--RestartFromLoop", action="store",      type="int", dest="RestartFromLoop", default=0,          help="restart existing calibration from the given loop")
 parser.add_option('--odd',             action='store_true',             dest='odd',             default=False,      help='run only on odd entries')
 parser.add_option('--even',            action='store_true',             dest='even',            default=False,      help='run only on even entries')
+parser.add_option('--oddeven',         action='store_true',             dest='oddeven',         default=False,      help='one job per file filling both odd and even outputs in a single pass')
 parser.add_option('--EE',              action='store_true',             dest='EE',              default=False,      help='run endcap calibration')
 parser.add_option('--tier0',           action='store_true',             dest='tier0',           default=False,      help='submit to CAF queues (only if you are logged in lxplus-t0.cern.ch)')
+parser.add_option('--rescanNtuples',   action='store_true',             dest='rescanNtuples',   default=False,      help='ignore the ntuple index and list again all the ntuple directories')
+parser.add_option("--scanThreads",     action="store",      type="int", dest="scanThreads",     default=8,          help="number of parallel threads scanning the ntuple directories")
+parser.add_option("--balanceBy",       action="store",      type="choice", dest="balanceBy",  default="size",   choices=["size","entries"],
+                  help="weight used to balance the file groups: size (on-disk bytes) or entries (TTree entries)")
+parser.add_option("--groupTarget",     action="store",      type="float", dest="groupTarget",   default=0,
+                  help="target weight per job: GB with --balanceBy size, number of entries with --balanceBy entries")
+parser.add_option("--mergeFanIn",      action="store",      type="int", dest="mergeFanIn",      default=0,
+                  help="merge the job outputs in parallel partial merges of the given number of files before the final merge (0 = single merge)")
+parser.add_option('--checkConvergence', action='store_true',            dest='checkConvergence', default=False,
+                  help='compare the IC of each loop with the previous one and stop the calibration when they converged')
+parser.add_option("--convMaxRMS",      action="store",      type="float", dest="convMaxRMS",    default=1e-4,       help="convergence: max RMS of the per-crystal ratio newIC/oldIC-1")
+parser.add_option("--convMaxDelta",    action="store",      type="float", dest="convMaxDelta",  default=1e-3,       help="convergence: max |newIC-oldIC|")
+parser.add_option("--convMoveThreshold", action="store",    type="float", dest="convMoveThreshold", default=5e-4,   help="convergence: |newIC-oldIC| above which a crystal is moving")
+parser.add_option("--convMaxMovingFraction", action="store", type="float", dest="convMaxMovingFraction", default=0.01, help="convergence: max fraction of moving crystals")
+parser.add_option('--skim',            action='store_true',             dest='skim',            default=False,
+                  help='skim the selected electrons once in a compact tree (outdir/skim/) read by all the calibration loops')
+parser.add_option('--reuseSkim',       action='store_true',             dest='reuseSkim',       default=False,
+                  help='with --skim, do not produce the skim again (reuse the one of a previous submission)')
 
 (options, args) = parser.parse_args()
 
@@ -49,6 +121,14 @@ if(options.odd):
 if(options.even):
     splitstat = ["even"]
 
+#splits run by each job: in the oddeven mode one job reads the file once and writes both the odd and even outputs
+job_splitstat = splitstat
+if options.oddeven:
+    if len(splitstat)==2:
+        job_splitstat = ["oddeven"]
+    else:
+        print("[WARNING]: --oddeven ignored, only "+splitstat[0]+" entries are requested")
+
 tasklist = ["BuildEopEta","ComputeIC"]
 
 additional_options = ""
@@ -60,8 +140,12 @@ else:
 #create outdir
 os.system("mkdir -p "+str(options.outdir))
 
-#get ntuples for the calibration
-selected_filelist,extracalibtree_filelist = findFiles.findFiles(ntuple_dir,"unmerged",tag_list,ignored_ntuples_label_list)
+#get ntuples for the calibration (the persistent ntuple index is kept next to the job area)
+ntuple_index_filename = current_dir+"/jobs/ntuple_index.json"
+records = findFiles.findFileRecords(ntuple_dir,"unmerged",tag_list,ignored_ntuples_label_list,
+                                     ntuple_index_filename,options.scanThreads,options.rescanNtuples)
+selected_filelist = [record["path"] for record in records]
+extracalibtree_filelist = [record["extracalibtree"] for record in records]
 
 if (len(selected_filelist)>0):
     print
@@ -81,9 +165,18 @@ else:
     print("NOT any file found --> EXIT")
     sys.exit()
 
+#weights used to balance the file groups
+if options.balanceBy=="entries":
+    findFiles.GetFileEntries(records,"selected",current_dir+"/jobs/ntuple_entries.json")
+    group_target = options.groupTarget
+else:
+    group_target = options.groupTarget*1e9
+
 #if running on unmerged files i need to reduce the number of jobs to submit to a reasonable value --> Group the files together
-if len(selected_filelist)>200:
-    selected_filelist, extracalibtree_filelist = findFiles.groupFiles(selected_filelist, extracalibtree_filelist, int(len(selected_filelist)/100) )
+#the groups are balanced by weight: about 100 groups, or total weight/--groupTarget groups
+if len(selected_filelist)>200 or group_target>0:
+    if group_target>0: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, 0, group_target )
+    else: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, 100 )
     if(options.verbosity>=1):
         print "grouped files"
         for filename in selected_filelist:
@@ -100,6 +193,50 @@ os.system("mkdir -p "+job_parent_folder+"/log/")
 dagFilename=job_parent_folder+"/submit_manager.dag"
 dagFile = open( dagFilename,"w")
 
+#DAG nodes between each task and the next one: partial merges (if any) and final merge
+merge_nodes = {}
+
+#skim stage: one job per file group, writing the selected electrons needed by the calibration
+skim_dir = str(options.outdir)+"/skim/"
+skim_filelist = [skim_dir+"/skim_file_"+str(iFile)+".root" for iFile in range(0,len(selected_filelist))]
+if options.skim:
+    os.system("mkdir -p "+skim_dir)
+if options.skim and not options.reuseSkim:
+    print("> Generating skim jobs")
+    for iFile in range(0,len(selected_filelist)):
+        jobdir=job_parent_folder+"/job_skim_file_"+str(iFile)+"/"
+        os.system("mkdir "+jobdir)
+        with open(str(options.configFile)) as fi:
+            contents = fi.read()
+            replaced_contents = contents.replace("SELECTED_INPUTFILE", selected_filelist[iFile]).replace("EXTRACALIBTREE_INPUTFILE", extracalibtree_filelist[iFile])
+        cfgfilename=jobdir+"/config.cfg"
+        with open(cfgfilename, "w") as fo:
+            fo.write(replaced_contents)
+
+        outScriptName=jobdir+"/job_skim_file_"+str(iFile)+".sh"
+        outScript = open(outScriptName,"w")
+        outScript.write("#!/bin/bash\n")
+        outScript.write("cd /afs/cern.ch/work/f/fmonti/flashggNew/CMSSW_10_5_0/\n")
+        outScript.write('eval `scram runtime -sh`\n');
+        outScript.write("cd -\n");
+        outScript.write(jobAccounting.AccountedCommand(str(options.exedir)+"/SkimCalibration.exe --cfg "+cfgfilename+" --output "+skim_filelist[iFile],outScriptName,True)+"\n")
+        outScript.write("echo finish\n")
+        outScript.close();
+        os.system("chmod 777 "+outScriptName)
+
+    skimsubFilename=job_parent_folder+"/submit_skim.sub"
+    skimsub = open( skimsubFilename,"w")
+    skimsub.write("executable            = $(scriptname)\n")
+    skimsub.write("output                = $(scriptname).$(ClusterId).out\n")
+    skimsub.write("error                 = $(scriptname).$(ClusterId).err\n")
+    skimsub.write("log                   = "+job_parent_folder+"/log/log.$(ClusterId).log\n")
+    skimsub.write('+JobFlavour           = "workday"\n')
+    if options.tier0:
+        skimsub.write('+AccountingGroup      = "group_u_CMS.CAF.ALCA"\n')
+    skimsub.write("queue scriptname matching "+job_parent_folder+"/job_skim_file_*/*.sh\n")
+    skimsub.close()
+    dagFile.write("JOB skim "+skimsubFilename+"\n")
+
 #make the monitoring files .cfg, .sh, and .sub
 for iLoop in range(options.RestartFromLoop,options.Nloop):
     print("> Generating job for loop "+str(iLoop))
@@ -120,14 +257,21 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
             with open(str(options.configFile)) as fi:
                 contents = fi.read()
                 replaced_contents = contents.replace("SELECTED_INPUTFILE", selected_filename).replace("EXTRACALIBTREE_INPUTFILE", extracalibtree_filename)
+                if options.skim:
+                    replaced_contents = GetSkimConfig(replaced_contents, skim_filelist[iFile])
             cfgfilename=jobdir+"/config.cfg"
             with open(cfgfilename, "w") as fo:
                 fo.write(replaced_contents)
 
-            for split in splitstat:
+            for split in job_splitstat:
                 ##### creates executable options #######
-                BUILDEOPETA_OUTPUT= str(options.outdir)+"/EopEta_loop_"+str(iLoop)+"_file_"+str(iFile)+"_"+split+".root"
-                UPDATEIC_OUTPUT= str(options.outdir)+"/IC_loop_"+str(iLoop)+"_file_"+str(iFile)+"_"+split+".root"
+                #the oddeven jobs append _odd and _even to the given output names
+                if split=="oddeven":
+                    BUILDEOPETA_OUTPUT= str(options.outdir)+"/EopEta_loop_"+str(iLoop)+"_file_"+str(iFile)+".root"
+                    UPDATEIC_OUTPUT= str(options.outdir)+"/IC_loop_"+str(iLoop)+"_file_"+str(iFile)+".root"
+                else:
+                    BUILDEOPETA_OUTPUT= str(options.outdir)+"/EopEta_loop_"+str(iLoop)+"_file_"+str(iFile)+"_"+split+".root"
+                    UPDATEIC_OUTPUT= str(options.outdir)+"/IC_loop_"+str(iLoop)+"_file_"+str(iFile)+"_"+split+".root"
                 BUILDEOPETA_INPUT_OPTION=""
                 UPDATEIC_INPUT_OPTION=""
                 EOPWEIGHTRANGE_OPTION=""
@@ -166,7 +310,7 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
                 outScript.write('eval `scram runtime -sh`\n');
                 outScript.write("cd -\n");
                 outScript.write("echo $PWD\n");
-                outScript.write(
+                outScript.write(jobAccounting.AccountedCommand(
                     str(options.exedir)+"/"+task+".exe"+
                     " --cfg "+cfgfilename+
                     " "+UPDATEIC_INPUT_OPTION+
@@ -175,7 +319,7 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
                     " "+EOPWEIGHTRANGE_OPTION+
                     " --ComputeIC_output "+UPDATEIC_OUTPUT+
                     " --"+split+
-                    " "+additional_options+"\n")
+                    " "+additional_options,outScriptName,True)+"\n")
                 outScript.write("echo finish\n") 
                 outScript.close();
                 os.system("chmod 777 "+outScriptName)
@@ -195,7 +339,19 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
         #fill the submitting manager file
         dagFile.write("JOB "+task+"_loop_"+str(iLoop)+" "+condorsubFilename+"\n")
 
-        #submit the merging step
+        #submit the merging step (optionally preceded by parallel partial merges)
+        merged_files = []
+        partialmerge_nodes = []
+        if "BuildEopEta" in task:
+            merged_files = [str(options.outdir)+"/EopEta_loop_"+str(iLoop)+"_file_"+str(iFile)+"_"+split+".root" for iFile in range(0,len(selected_filelist)) for split in splitstat]
+            partialmerge_nodes, merged_files = WritePartialMerges(task,iLoop,"EopEta",merged_files,options.mergeFanIn)
+        if "ComputeIC" in task:
+            merged_files = [str(options.outdir)+"/IC_loop_"+str(iLoop)+"_file_"+str(iFile)+"_"+split+".root" for iFile in range(0,len(selected_filelist)) for split in splitstat]
+            partialmerge_nodes, merged_files = WritePartialMerges(task,iLoop,"IC",merged_files,options.mergeFanIn)
+        if len(partialmerge_nodes)==0:
+            merged_files = []
+        merge_nodes[task+"_loop_"+str(iLoop)] = partialmerge_nodes + ["merge"+task+"_loop_"+str(iLoop)]
+
         if "BuildEopEta" in task:
             mergescriptName=job_parent_folder+"/merge_"+task+"_loop_"+str(iLoop)+".sh"
             mergescript = open( mergescriptName,"w")
@@ -203,8 +359,11 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
             mergescript.write("cd /afs/cern.ch/work/f/fmonti/flashggNew/CMSSW_10_5_0/\n")
             mergescript.write('eval `scram runtime -sh`\n');
             mergescript.write("cd -\n");
-            mergescript.write("hadd -f -k "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+".root "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+"_file_*_*.root\n")
-            mergescript.write(str(options.exedir)+"/NormalizeBuildEopEta.exe --Eopweight TH2F EopEta "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+".root\n")
+            if len(merged_files)>0:
+                mergescript.write(jobAccounting.AccountedCommand("hadd -f -k "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+".root "+" ".join(merged_files),mergescriptName,True)+"\n")
+            else:
+                mergescript.write(jobAccounting.AccountedCommand("hadd -f -k "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+".root "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+"_file_*_*.root",mergescriptName,True)+"\n")
+            mergescript.write(jobAccounting.AccountedCommand(str(options.exedir)+"/NormalizeBuildEopEta.exe --Eopweight TH2F EopEta "+str(options.outdir)+"/EopEta_loop_"+str(iLoop)+".root",mergescriptName)+"\n")
             mergescript.close()
             os.system("chmod 777 "+mergescriptName)
         if "ComputeIC" in task:
@@ -214,11 +373,14 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
             mergescript.write("cd /afs/cern.ch/work/f/fmonti/flashggNew/CMSSW_10_5_0/\n")
             mergescript.write('eval `scram runtime -sh`\n');
             mergescript.write("cd -\n");
-            mergescript.write("hadd -f -k "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root "+str(options.outdir)+"/IC_loop_"+str(iLoop)+"_file_*_*.root\n")
+            if len(merged_files)>0:
+                mergescript.write(jobAccounting.AccountedCommand("hadd -f -k "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root "+" ".join(merged_files),mergescriptName,True)+"\n")
+            else:
+                mergescript.write(jobAccounting.AccountedCommand("hadd -f -k "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root "+str(options.outdir)+"/IC_loop_"+str(iLoop)+"_file_*_*.root",mergescriptName,True)+"\n")
             if iLoop==0:
-                mergescript.write(str(options.exedir)+"/UpdateIC.exe --newIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root\n")
+                mergescript.write(jobAccounting.AccountedCommand(str(options.exedir)+"/UpdateIC.exe --newIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root",mergescriptName)+"\n")
             else:
-                mergescript.write(str(options.exedir)+"/UpdateIC.exe --oldIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop-1)+".root --newIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root\n")
+                mergescript.write(jobAccounting.AccountedCommand(str(options.exedir)+"/UpdateIC.exe --oldIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop-1)+".root --newIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root",mergescriptName)+"\n")
             mergescript.close()
             os.system("chmod 777 "+mergescriptName)
 
@@ -236,27 +398,78 @@ for iLoop in range(options.RestartFromLoop,options.Nloop):
 
         #fill the submitting manager file
         dagFile.write("JOB merge"+task+"_loop_"+str(iLoop)+" "+mergesubFilename+"\n")
+
+        #check the convergence of the IC after the update
+        #the check exits with 10 when converged: the DAG is then stopped with success (ABORT-DAG-ON ... RETURN 0)
+        if "ComputeIC" in task and options.checkConvergence and iLoop>0:
+            checkscriptName=job_parent_folder+"/checkConvergence_loop_"+str(iLoop)+".sh"
+            checkscript = open( checkscriptName,"w")
+            checkscript.write("#!/bin/bash\n")
+            checkscript.write("cd /afs/cern.ch/work/f/fmonti/flashggNew/CMSSW_10_5_0/\n")
+            checkscript.write('eval `scram runtime -sh`\n');
+            checkscript.write("cd -\n");
+            checkscript.write(jobAccounting.AccountedCommand(str(options.exedir)+"/CheckICConvergence.exe"+
+                              " --oldIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop-1)+".root"+
+                              " --newIC IC "+str(options.outdir)+"/IC_loop_"+str(iLoop)+".root"+
+                              " --loop "+str(iLoop)+
+                              " --maxRMS "+str(options.convMaxRMS)+
+                              " --maxDelta "+str(options.convMaxDelta)+
+                              " --moveThreshold "+str(options.convMoveThreshold)+
+                              " --maxMovingFraction "+str(options.convMaxMovingFraction)+
+                              " --summary "+str(options.outdir)+"/convergence_summary.txt"+
+                              " --finalLoop "+str(options.outdir)+"/IC_final_loop.txt",checkscriptName,True)+"\n")
+            checkscript.close()
+            os.system("chmod 777 "+checkscriptName)
+
+            checksubFilename=job_parent_folder+"/submit_checkConvergence_loop_"+str(iLoop)+".sub"
+            checksub = open( checksubFilename,"w")
+            checksub.write("executable            = "+checkscriptName+"\n")
+            checksub.write("output                = "+checkscriptName+".$(ClusterId).out\n")
+            checksub.write("error                 = "+checkscriptName+".$(ClusterId).err\n")
+            checksub.write("log                   = "+job_parent_folder+"/log/log.$(ClusterId).log\n")
+            checksub.write('+JobFlavour           = "espresso"\n')
+            if options.tier0:
+                checksub.write('+AccountingGroup      = "group_u_CMS.CAF.ALCA"\n')
+            checksub.write("queue 1\n")
+            checksub.close()
+
+            dagFile.write("JOB checkConvergence_loop_"+str(iLoop)+" "+checksubFilename+"\n")
+            dagFile.write("ABORT-DAG-ON checkConvergence_loop_"+str(iLoop)+" 10 RETURN 0\n")
+            merge_nodes[task+"_loop_"+str(iLoop)].append("checkConvergence_loop_"+str(iLoop))
             
 #setting hierarchy of the submitting manager file
+if options.skim and not options.reuseSkim:
+    dagFile.write("PARENT skim CHILD "+tasklist[0]+"_loop_"+str(options.RestartFromLoop)+"\n")
 for iLoop in range(options.RestartFromLoop,options.Nloop):
     for iTask in range(0,len(tasklist)):
-        dagFile.write("PARENT "+tasklist[iTask]+"_loop_"+str(iLoop)+" CHILD merge"+tasklist[iTask]+"_loop_"+str(iLoop)+"\n")
+        chain = [tasklist[iTask]+"_loop_"+str(iLoop)] + merge_nodes[tasklist[iTask]+"_loop_"+str(iLoop)]
+        for iNode in range(0,len(chain)-1):
+            dagFile.write("PARENT "+chain[iNode]+" CHILD "+chain[iNode+1]+"\n")
         if iTask<(len(tasklist)-1):
-            dagFile.write("PARENT merge"+tasklist[iTask]+"_loop_"+str(iLoop)+" CHILD "+tasklist[iTask+1]+"_loop_"+str(iLoop)+"\n")
+            dagFile.write("PARENT "+chain[-1]+" CHILD "+tasklist[iTask+1]+"_loop_"+str(iLoop)+"\n")
         else:
             if( iLoop < (options.Nloop-1) ):
-                dagFile.write("PARENT merge"+tasklist[iTask]+"_loop_"+str(iLoop)+" CHILD "+tasklist[0]+"_loop_"+str(iLoop+1)+"\n")
+                dagFile.write("PARENT "+chain[-1]+" CHILD "+tasklist[0]+"_loop_"+str(iLoop+1)+"\n")
 
 #add possibility to re-submit failed jobs
+if options.skim and not options.reuseSkim:
+    dagFile.write("Retry skim 3\n")
 for iLoop in range(options.RestartFromLoop,options.Nloop):
     for iTask in range(0,len(tasklist)):
         dagFile.write("Retry "+tasklist[iTask]+"_loop_"+str(iLoop)+" 3\n")
-        dagFile.write("Retry merge"+tasklist[iTask]+"_loop_"+str(iLoop)+" 3\n")
+        for node in merge_nodes[tasklist[iTask]+"_loop_"+str(iLoop)]:
+            if node.startswith("checkConvergence"):
+                dagFile.write("Retry "+node+" 3 UNLESS-EXIT 10\n")
+            else:
+                dagFile.write("Retry "+node+" 3\n")
 
 dagFile.close()
 
 submit_command = "condor_submit_dag "+dagFilename
 print("SUBMIT COMMAND: "+submit_command)
-#submit in case the option is given
-if(options.submit):
+print("ACCOUNTING REPORT (after the jobs): python "+jobAccounting.accounting_script+" report --jobdir "+job_parent_folder)
+#submit in case the option is given, or run the DAG on this machine
+if(options.local>0):
+    sys.exit(localExecutor.RunDag(dagFilename,options.local))
+elif(options.submit):
     os.system(submit_command)
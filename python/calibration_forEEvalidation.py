@@ -10,6 +10,7 @@ from optparse import OptionParser
 import time
 import datetime
 import findFiles
+import localExecutor
 
 #print date
 print("----------------------------------------------------------------------------------")
@@ -29,6 +30,7 @@ ignored_ntuples_label_list = ["obsolete"]#ntuples containing anywhere in the pat
 #parse arguments
 parser = OptionParser()
 parser.add_option('--submit',          action='store_true',             dest='submit',          default=False,      help='submit jobs')
+parser.add_option("--local",           action="store",      type="int", dest="local",           default=0,          help="run the jobs on this machine with the given number of parallel processes instead of submitting them")
 parser.add_option("-l", "--label",     action="store",      type="str", dest="label",                               help="job label")
 parser.add_option("-v", "--verbosity", action="store",      type="int", dest="verbosity",       default=1,          help="verbosity level")
 parser.add_option("-o", "--outdir",    action="store",      type="str", dest="outdir",          default="./",       help="output directory")
@@ -41,6 +43,12 @@ parser.add_option('--odd',             action='store_true',             dest='od
 parser.add_option('--even',            action='store_true',             dest='even',            default=False,      help='run only on even entries')
 parser.add_option('--EE',              action='store_true',             dest='EE',              default=False,      help='run endcap calibration')
 parser.add_option('--tier0',           action='store_true',             dest='tier0',           default=False,      help='submit to CAF queues (only if you are logged in lxplus-t0.cern.ch)')
+parser.add_option('--rescanNtuples',   action='store_true',             dest='rescanNtuples',   default=False,      help='ignore the ntuple index and list again all the ntuple directories')
+parser.add_option("--scanThreads",     action="store",      type="int", dest="scanThreads",     default=8,          help="number of parallel threads scanning the ntuple directories")
+parser.add_option("--balanceBy",       action="store",      type="choice", dest="balanceBy",  default="size",   choices=["size","entries"],
+                  help="weight used to balance the file groups: size (on-disk bytes) or entries (TTree entries)")
+parser.add_option("--groupTarget",     action="store",      type="float", dest="groupTarget",   default=0,
+                  help="target weight per job: GB with --balanceBy size, number of entries with --balanceBy entries")
 
 (options, args) = parser.parse_args()
 
@@ -63,8 +71,12 @@ else:
 os.system("mkdir -p "+str(options.outdir)+"/EEP/")
 os.system("mkdir -p "+str(options.outdir)+"/EEM/")
 
-#get ntuples for the calibration
-selected_filelist,extracalibtree_filelist = findFiles.findFiles(ntuple_dir,"unmerged",tag_list,ignored_ntuples_label_list)
+#get ntuples for the calibration (the persistent ntuple index is kept next to the job area)
+ntuple_index_filename = current_dir+"/jobs/ntuple_index.json"
+records = findFiles.findFileRecords(ntuple_dir,"unmerged",tag_list,ignored_ntuples_label_list,
+                                     ntuple_index_filename,options.scanThreads,options.rescanNtuples)
+selected_filelist = [record["path"] for record in records]
+extracalibtree_filelist = [record["extracalibtree"] for record in records]
 
 if (len(selected_filelist)>0):
     print
@@ -84,9 +96,18 @@ else:
     print("NOT any file found --> EXIT")
     sys.exit()
 
+#weights used to balance the file groups
+if options.balanceBy=="entries":
+    findFiles.GetFileEntries(records,"selected",current_dir+"/jobs/ntuple_entries.json")
+    group_target = options.groupTarget
+else:
+    group_target = options.groupTarget*1e9
+
 #if running on unmerged files i need to reduce the number of jobs to submit to a reasonable value --> Group the files together
-if len(selected_filelist)>200:
-    selected_filelist, extracalibtree_filelist = findFiles.groupFiles(selected_filelist, extracalibtree_filelist, int(len(selected_filelist)/100) )
+#the groups are balanced by weight: about 100 groups, or total weight/--groupTarget groups
+if len(selected_filelist)>200 or group_target>0:
+    if group_target>0: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, 0, group_target )
+    else: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, 100 )
     if(options.verbosity>=1):
         print "grouped files"
         for filename in selected_filelist:
@@ -282,6 +303,8 @@ dagFile.close()
 
 submit_command = "condor_submit_dag "+dagFilename
 print("SUBMIT COMMAND: "+submit_command)
-#submit in case the option is given
-if(options.submit):
+#submit in case the option is given, or run the DAG on this machine
+if(options.local>0):
+    sys.exit(localExecutor.RunDag(dagFilename,options.local))
+elif(options.submit):
     os.system(submit_command)
@@ -0,0 +1,83 @@
+#!/bin/python
+import os
+import sys
+import json
+from optparse import OptionParser
+
+#############################################################################
+# compare the stage profiles written by the --profile option of LaserMonitoring, BuildEopEta, ComputeIC and CalibrationMomentum
+# the first profile is the reference: for each stage the time (or the time per entry with --perEntry) of the other profiles
+# is shown together with its ratio to the reference
+#############################################################################
+
+stages = ["io","selection","variable","lookup","fill","fit","write","untracked"]
+
+def LoadProfile(filename):
+    with open(filename) as infile:
+        profile = json.load(infile)
+    profile["label"] = os.path.basename(filename).replace(".json","")
+    return profile
+
+def GetStageValue(profile,stage,perEntry):
+    time = profile["stages"].get(stage,{"time":0.})["time"]
+    if perEntry:
+        return 1e6*time/profile["entries"] if profile["entries"]>0 else 0.
+    return time
+
+def FormatRatio(value,reference):
+    if reference<=0:
+        return "-"
+    return "x%.2f"%(value/reference)
+
+parser = OptionParser(usage="usage: %prog [options] <reference.json> <profile.json> [<profile.json> ...]")
+parser.add_option("--perEntry", action="store_true", dest="perEntry", default=False, help="compare the time per entry read [us] instead of the total time [s] (for runs on different inputs)")
+parser.add_option("--labels",   action="store", type="str", dest="labels", default="", help="comma separated labels of the profiles (default: file names)")
+(options, args) = parser.parse_args()
+
+if len(args)<1:
+    parser.print_help()
+    sys.exit(1)
+
+profiles = [LoadProfile(filename) for filename in args]
+if options.labels!="":
+    for profile,label in zip(profiles,options.labels.split(",")):
+        profile["label"] = label
+executables = set([profile["executable"] for profile in profiles])
+if len(executables)>1:
+    print("[WARNING]: comparing profiles of different executables: "+", ".join(sorted(executables)))
+
+unit = "us/entry" if options.perEntry else "s"
+reference = profiles[0]
+columnwidth = max(22,max(len(profile["label"]) for profile in profiles)+2)
+print("----------------------------------------------------------------------------------")
+print("%-12s"%("stage ["+unit+"]")+"".join(["%*s"%(columnwidth,profile["label"]) for profile in profiles]))
+for stage in stages:
+    line = "%-12s"%stage
+    reference_value = GetStageValue(reference,stage,options.perEntry)
+    for iprofile,profile in enumerate(profiles):
+        value = GetStageValue(profile,stage,options.perEntry)
+        fraction = profile["stages"].get(stage,{"time":0.})["time"]/profile["wall_time"] if profile["wall_time"]>0 else 0.
+        if iprofile==0:
+            cell = "%.3f (%4.1f%%)"%(value,100*fraction)
+        else:
+            cell = "%.3f (%4.1f%%) %s"%(value,100*fraction,FormatRatio(value,reference_value))
+        line += "%*s"%(columnwidth,cell)
+    print(line)
+print("----------------------------------------------------------------------------------")
+for name,getter in [("wall [s]",lambda profile: profile["wall_time"]),
+                    ("entries",lambda profile: profile["entries"]),
+                    ("entries/s",lambda profile: profile["entries"]/profile["wall_time"] if profile["wall_time"]>0 else 0.)]:
+    line = "%-12s"%name
+    reference_value = getter(reference)
+    for iprofile,profile in enumerate(profiles):
+        value = getter(profile)
+        cell = "%.1f"%value if iprofile==0 else "%.1f %s"%(value,FormatRatio(value,reference_value))
+        line += "%*s"%(columnwidth,cell)
+    print(line)
+
+#calls per stage: a change in the number of calls (e.g. of the lookups) explains part of a time change
+print("----------------------------------------------------------------------------------")
+print("%-12s"%"calls"+"".join(["%*s"%(columnwidth,profile["label"]) for profile in profiles]))
+for stage in stages[:-1]:
+    print("%-12s"%stage+"".join(["%*i"%(columnwidth,profile["stages"].get(stage,{"calls":0})["calls"]) for profile in profiles]))
+print("----------------------------------------------------------------------------------")
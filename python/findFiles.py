@@ -9,20 +9,136 @@ import subprocess
 from optparse import OptionParser
 import time
 import datetime
+import json
+import re
+import stat
+from multiprocessing.pool import ThreadPool
 
 
-def findFiles(ntuple_dir,ntuples_type,tag_list,ignored_ntuples_label_list,selected_filelist=[],extracalibtree_filelist=[]):
+def findFiles(ntuple_dir,ntuples_type,tag_list,ignored_ntuples_label_list,selected_filelist=[],extracalibtree_filelist=[],index_filename="",nthreads=8,rescan=False):
     #get ntuples for the calibration
-    for root, dirs, files in os.walk(ntuple_dir):
-        for file in files:
-            if type_match(file,ntuples_type):
-                if(not any (ignored_ntuples_label in os.path.join(root, file) for ignored_ntuples_label in ignored_ntuples_label_list)):
-                    if file.find("extraCalibTree")==-1:
-                        selected_filelist.append(os.path.join(root, file))
-                        extracalibtree_filename = generate_extracalibtree_filename(file,ntuples_type)
-                        extracalibtree_filelist.append(os.path.join(root, extracalibtree_filename))
+    for record in findFileRecords(ntuple_dir,ntuples_type,tag_list,ignored_ntuples_label_list,index_filename,nthreads,rescan):
+        selected_filelist.append(record["path"])
+        extracalibtree_filelist.append(record["extracalibtree"])
     return selected_filelist,extracalibtree_filelist
 
+def findFileRecords(ntuple_dir,ntuples_type,tag_list,ignored_ntuples_label_list,index_filename="",nthreads=8,rescan=False):
+    #same as findFiles, but return one record per selected ntuple: path, size, mtime, tag, extracalibtree, extracalibtree_size
+    index = UpdateIndex(ntuple_dir,index_filename,nthreads,rescan)
+    return QueryIndex(index,ntuples_type,tag_list,ignored_ntuples_label_list)
+
+
+#############################################################################
+# persistent ntuple index
+# the index stores, for each directory below ntuple_dir, its mtime, its files (name -> [size,mtime]) and its subdirectories
+# rescans list again only the directories whose mtime changed, the others are just stat-ed to check their mtime
+#############################################################################
+
+def LoadIndex(index_filename):
+    if index_filename=="" or not os.path.isfile(index_filename):
+        return {}
+    try:
+        with open(index_filename) as index_file:
+            return json.load(index_file)
+    except ValueError:
+        print "[WARNING]: corrupted ntuple index "+index_filename+" --> rebuild it"
+        return {}
+
+def SaveIndex(index,index_filename):
+    if index_filename=="":
+        return
+    index_dirname = os.path.dirname(os.path.abspath(index_filename))
+    if not os.path.isdir(index_dirname):
+        os.makedirs(index_dirname)
+    #write to a temporary file and rename it, so an interrupted job generation never leaves a truncated index
+    with open(index_filename+".tmp","w") as index_file:
+        json.dump(index,index_file)
+    os.rename(index_filename+".tmp",index_filename)
+
+def ScanDirectory(dirpath,cached_entry):
+    try:
+        dir_mtime = os.stat(dirpath).st_mtime
+    except OSError:
+        return dirpath,None
+    if cached_entry is not None and cached_entry["mtime"]==dir_mtime:
+        return dirpath,cached_entry
+    entry = {"mtime":dir_mtime, "files":{}, "subdirs":[]}
+    try:
+        names = os.listdir(dirpath)
+    except OSError:
+        return dirpath,None
+    for name in names:
+        fullpath = os.path.join(dirpath,name)
+        try:
+            st = os.stat(fullpath)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            entry["subdirs"].append(name)
+        else:
+            entry["files"][name] = [st.st_size,st.st_mtime]
+    return dirpath,entry
+
+def UpdateIndex(ntuple_dir,index_filename="",nthreads=8,rescan=False):
+    index = LoadIndex(index_filename)
+    if rescan or index.get("ntuple_dir")!=ntuple_dir:
+        index = {"ntuple_dir":ntuple_dir, "dirs":{}}
+    old_dirs = index["dirs"]
+    new_dirs = {}
+    Nlisted = 0
+    #breadth-first walk, each level is scanned in parallel by a bounded pool of threads
+    pool = ThreadPool(max(1,nthreads))
+    level = [ntuple_dir]
+    while len(level)>0:
+        next_level = []
+        for dirpath,entry in pool.map(lambda dirpath: ScanDirectory(dirpath,old_dirs.get(dirpath)), level):
+            if entry is None:
+                continue
+            if entry is not old_dirs.get(dirpath):
+                Nlisted += 1
+            new_dirs[dirpath] = entry
+            for subdir in entry["subdirs"]:
+                next_level.append(os.path.join(dirpath,subdir))
+        level = next_level
+    pool.close()
+    pool.join()
+    index["dirs"] = new_dirs
+    print "ntuple index: %i directories, %i (re)listed"%(len(new_dirs),Nlisted)
+    SaveIndex(index,index_filename)
+    return index
+
+def GetTag(path,tag_list=[]):
+    #tag = first label of tag_list found in the path, otherwise the era (e.g. Run2018C) found in the path
+    for tag in tag_list:
+        if tag in path:
+            return tag
+    era = re.search(r"Run20[0-9]{2}[A-Z]",path)
+    if era:
+        return era.group(0)
+    return ""
+
+def QueryIndex(index,ntuples_type,tag_list,ignored_ntuples_label_list):
+    records = []
+    for dirpath,entry in index["dirs"].items():
+        for filename,(size,mtime) in entry["files"].items():
+            if not type_match(filename,ntuples_type):
+                continue
+            if filename.find("extraCalibTree")!=-1:
+                continue
+            fullpath = str(os.path.join(dirpath,filename))
+            if any(ignored_ntuples_label in fullpath for ignored_ntuples_label in ignored_ntuples_label_list):
+                continue
+            if len(tag_list)>0 and not any(tag in fullpath for tag in tag_list):
+                continue
+            extracalibtree_filename = generate_extracalibtree_filename(filename,ntuples_type)
+            extracalibtree_size = None
+            if extracalibtree_filename in entry["files"]:
+                extracalibtree_size = entry["files"][extracalibtree_filename][0]
+            records.append({"path":fullpath, "size":size, "mtime":mtime, "tag":GetTag(fullpath,tag_list),
+                            "extracalibtree":str(os.path.join(dirpath,extracalibtree_filename)), "extracalibtree_size":extracalibtree_size})
+    records.sort(key=lambda record: record["path"])
+    return records
+
 
 def type_match(filename,ntuples_type):
     if not filename.endswith(".root"):
@@ -78,6 +194,10 @@ def groupFiles(selected_filelist, extracalibtree_filelist, Nfiles_per_group):
                 selected_filename_group_str=""
                 extracalibtree_filename_group_str=""
 
+    if Nfiles_in_group>0:#close the trailing partial group
+        grouped_selected_filelist.append(selected_filename_group_str[:-4])
+        grouped_extracalibtree_filelist.append(extracalibtree_filename_group_str[:-4])
+
     print str(len(grouped_selected_filelist))+" groups created"
     return grouped_selected_filelist, grouped_extracalibtree_filelist
 
@@ -106,5 +226,83 @@ def groupFilesByTag(selected_filelist, extracalibtree_filelist, tag_list):
     print str(len(grouped_selected_filelist))+" groups created"
     return grouped_selected_filelist, grouped_extracalibtree_filelist
 
-    
 
+#############################################################################
+# balanced grouping
+# files are bin-packed by on-disk size or by number of TTree entries, so that all the jobs get about the same load
+#############################################################################
+
+def GetFileEntries(records,treename="selected",cache_filename=""):
+    #fill record["entries"] with the number of entries of treename, counts are cached by (path,size,mtime) in cache_filename
+    import ROOT
+    cache = LoadIndex(cache_filename)
+    Nopened = 0
+    for record in records:
+        cached = cache.get(record["path"])
+        if cached is not None and cached[0]==record["size"] and cached[1]==record["mtime"]:
+            record["entries"] = cached[2]
+            continue
+        record["entries"] = 0
+        rootfile = ROOT.TFile.Open(record["path"])
+        if rootfile and not rootfile.IsZombie():
+            tree = rootfile.Get(treename)
+            if tree:
+                record["entries"] = tree.GetEntries()
+            rootfile.Close()
+        else:
+            print "[WARNING]: can't open "+record["path"]+" --> weight 0"
+        cache[record["path"]] = [record["size"],record["mtime"],record["entries"]]
+        Nopened += 1
+    print "entries of %i files read, %i from cache"%(Nopened,len(records)-Nopened)
+    SaveIndex(cache,cache_filename)
+    return records
+
+def packRecords(records,weight,Ngroups):
+    #longest processing time first: the heaviest file still to be placed goes to the lightest group
+    groups = [[] for igroup in range(0,Ngroups)]
+    load = [0]*Ngroups
+    for record in sorted(records, key=lambda record: record[weight], reverse=True):
+        igroup = load.index(min(load))
+        groups[igroup].append(record)
+        load[igroup] += record[weight]
+    for group in groups:
+        group.sort(key=lambda record: record["path"])
+    return [group for group in groups if len(group)>0], [l for l,group in zip(load,groups) if len(group)>0]
+
+def groupFilesBalanced(records, weight="size", Ngroups=0, target=0, groupByTag=False, tag_list=[]):
+    #weight: "size" (bytes) or "entries" (see GetFileEntries)
+    #the number of groups is Ngroups if >0, otherwise total weight/target; with target=0 and Ngroups=0 one group is created
+    #groupByTag: files with different tags are never grouped together, Ngroups and target then apply to each tag
+    print "grouping "+str(len(records))+" files balancing the "+weight
+    if groupByTag:
+        tagged_records = [(tag,[record for record in records if record["tag"]==tag]) for tag in tag_list]
+        for tag,tag_records in tagged_records:
+            if len(tag_records)==0:
+                print "[WARNING]: can't find any file matching "+tag+" tag"
+    else:
+        tagged_records = [("",records)]
+
+    grouped_selected_filelist = []
+    grouped_extracalibtree_filelist = []
+    loads = []
+    for tag,tag_records in tagged_records:
+        if len(tag_records)==0:
+            continue
+        total = sum(record[weight] for record in tag_records)
+        if Ngroups>0:
+            Ngroups_tag = Ngroups
+        elif target>0:
+            Ngroups_tag = int(math.ceil(float(total)/target))
+        else:
+            Ngroups_tag = 1
+        Ngroups_tag = max(1,min(Ngroups_tag,len(tag_records)))
+        groups, group_loads = packRecords(tag_records,weight,Ngroups_tag)
+        for group in groups:
+            grouped_selected_filelist.append(" \\ \n".join(record["path"] for record in group))
+            grouped_extracalibtree_filelist.append(" \\ \n".join(record["extracalibtree"] for record in group))
+        loads += group_loads
+
+    print str(len(grouped_selected_filelist))+" groups created"
+    if len(loads)>0:
+        print "%s per group: min %g, mean %g, max %g"%(weight,min(loads),float(sum(loads))/len(loads),max(loads))
+    return grouped_selected_filelist, grouped_extracalibtree_filelist
@@ -4,6 +4,9 @@ import glob
 import math
 from array import array
 import sys
+import json
+import multiprocessing
+import numpy as np
 from optparse import OptionParser
 
 def HarnessLimits(harnessname):
@@ -38,30 +41,181 @@ def SetAxisTitle(axis,name):
         axis.SetTitle("E/p scale (template fit)")
 
 def writeIC(icfilename,ICmap):
+    #ICmap is the (171 x 360) array of the EB IC, indexed as [ieta+85][iphi-1]
     with open(icfilename,'w') as icfile:
-        for ieta,iphi_ICmap in ICmap.items():
-            for iphi,IC in iphi_ICmap.items():
-                icfile.write("%i\t%i\t0\t%f\t0.\n"%(ieta,iphi,IC))
-            
-
-def GetGraph(tree,selection,xname,yname,xuncname="",yuncname=""):
-    Npoints = chain.Draw( "%s:%s"%(yname,xname), selection, "goff")
-    y = chain.GetV1(); y.SetSize(Npoints)        #trick to handle c-pointers AKA PyDoubleBuffer
-    x = chain.GetV2(); x.SetSize(Npoints)
-    a_x = array('d',x)
-    a_y = array('d',y)
+        for ieta in range(-85,86):
+            if ieta==0: continue
+            for iphi in range(1,361):
+                icfile.write("%i\t%i\t0\t%f\t0.\n"%(ieta,iphi,ICmap[ieta+85][iphi-1]))
+
+#binary multi-IOV IC file, read by ICmanager::LoadIC with input type "binICdictionary"
+#little endian layout, the IC cube can be memory-mapped at offset 32+16*nIOV:
+#  char[8]     magic "EopICv01"
+#  int32[6]    nIOV, Neta=171, Nphi=360, ietamin=-85, iphimin=1, 0
+#  uint32[4]   runmin, lsmin, runmax, lsmax of each IOV
+#  float32     IC[iIOV][ieta-ietamin][iphi-iphimin]
+ICcube_magic = "EopICv01"
+
+def writeICcube(icfilename,IOV_table,ICcube):
+    nIOV,Neta,Nphi = ICcube.shape
+    with open(icfilename,'wb') as icfile:
+        icfile.write(ICcube_magic)
+        np.array([nIOV,Neta,Nphi,-85,1,0],dtype="<i4").tofile(icfile)
+        np.asarray(IOV_table,dtype="<u4").reshape(nIOV,4).tofile(icfile)
+        np.asarray(ICcube,dtype="<f4").tofile(icfile)
+
+def readICcube(icfilename):
+    #return the IOV table (nIOV x 4) and a read-only memory map of the IC cube (nIOV x 171 x 360)
+    with open(icfilename,'rb') as icfile:
+        if icfile.read(8)!=ICcube_magic:
+            print "[ERROR]: %s is not a binary IC file"%icfilename
+            return None,None
+        nIOV,Neta,Nphi,ietamin,iphimin,dummy = np.fromfile(icfile,dtype="<i4",count=6)
+        IOV_table = np.fromfile(icfile,dtype="<u4",count=4*nIOV).reshape(nIOV,4)
+    ICcube = np.memmap(icfilename,dtype="<f4",mode="r",offset=32+16*nIOV,shape=(nIOV,Neta,Nphi))
+    return IOV_table,ICcube
+
+
+#############################################################################
+# columnar cache of the scalemonitoring outputs
+# each out_file_*_scalemonitoring.root is read once and the time bins of each harness are stored in a numpy structured array
+# (runmin, runmax, lsmin, lsmax, timemin, timemax, intlumimin, intlumimax, Nev and all the scale_* branches)
+# the arrays of all the harnesses are cached in a single .npz file, rebuilt only when the input files change
+#############################################################################
+
+integer_columns = {"runmin":"i8", "runmax":"i8", "lsmin":"i4", "lsmax":"i4", "Nev":"i8"}
+
+def GetHarnessInputs(inputdir):
+    #harnessname -> sorted list of [filename,size,mtime] (same ordering as TChain::Add with wildcards)
+    inputs = {}
+    for dirname in os.listdir(inputdir):
+        fullpath = os.path.join(inputdir,dirname)
+        if not os.path.isdir(fullpath):
+            continue
+        if dirname.find("IEta")!=-1 and dirname.find("IPhi")!=-1:
+            inputs[dirname] = []
+            #the output of the reduce job (harness_monitoring.py --reduce) replaces the ones of the file groups
+            filenames = glob.glob(fullpath+"/out_merged_scalemonitoring.root")
+            if len(filenames)==0:
+                filenames = glob.glob(fullpath+"/out_file_*_scalemonitoring.root")
+            for filename in sorted(filenames):
+                filestat = os.stat(filename)
+                inputs[dirname].append([filename,filestat.st_size,filestat.st_mtime])
+    return inputs
+
+def ReadHarness(harnessname,filelist):
+    #read the tree harnessname of all the files into one structured array
+    columns = []
+    rows = []
+    for filename,size,mtime in filelist:
+        rootfile = ROOT.TFile.Open(filename)
+        if not rootfile or rootfile.IsZombie():
+            print "[WARNING]: can't open %s --> skip it"%filename
+            continue
+        tree = rootfile.Get(harnessname)
+        if not tree:
+            rootfile.Close()
+            continue
+        if len(columns)==0:
+            #the quantile sketches (sketch_*) are needed only to merge the outputs, see LaserMonitoring.exe --merge
+            columns = [branch.GetName() for branch in tree.GetListOfBranches() if not branch.GetName().startswith("sketch_")]
+        for entry in tree:
+            rows.append(tuple(getattr(entry,column) for column in columns))
+        rootfile.Close()
+    dtype = [(column,integer_columns.get(column,"f8")) for column in columns]
+    return np.array(rows,dtype=dtype)
+
+def LoadScaleMonitoring(inputdir,cachefilename,rebuild=False):
+    #return the time bins of each harness and the fingerprint of its input files
+    #only the harnesses whose input files changed since the cache was written are read again
+    inputs = json.loads(json.dumps(GetHarnessInputs(inputdir)))
+    data_dict = {}
+    if not rebuild and os.path.isfile(cachefilename):
+        cache = np.load(cachefilename)
+        if "__inputs__" in cache.files:
+            cached_inputs = json.loads(str(cache["__inputs__"]))
+            for harnessname,filelist in inputs.items():
+                if cached_inputs.get(harnessname)==filelist and harnessname in cache.files:
+                    data_dict[harnessname] = cache[harnessname]
+        cache.close()
+        print "%i harnesses read from the cache %s"%(len(data_dict),cachefilename)
+
+    Nread = 0
+    for harnessname,filelist in inputs.items():
+        if harnessname not in data_dict:
+            data_dict[harnessname] = ReadHarness(str(harnessname),filelist)
+            Nread += 1
+    print "scalemonitoring outputs of %i harnesses read"%Nread
+    if Nread>0 or len(data_dict)==0:
+        arrays = dict((str(harnessname),data) for harnessname,data in data_dict.items())
+        arrays["__inputs__"] = np.array(json.dumps(inputs))
+        with open(cachefilename+".tmp","wb") as cachefile:
+            np.savez(cachefile,**arrays)
+        os.rename(cachefilename+".tmp",cachefilename)
+    return dict((str(harnessname),data) for harnessname,data in data_dict.items()), dict((str(harnessname),filelist) for harnessname,filelist in inputs.items())
+
+#############################################################################
+# manifest of the harness results
+# for each harness the manifest stores the fingerprint of its inputs, the linear fit result and the rendered plots,
+# each one tagged with the settings used to produce it: a result is reused only if both inputs and settings did not change
+#############################################################################
+
+def LoadManifest(manifestfilename):
+    if not os.path.isfile(manifestfilename):
+        return {}
+    try:
+        with open(manifestfilename) as manifestfile:
+            return json.load(manifestfile)
+    except ValueError:
+        print "[WARNING]: corrupted manifest "+manifestfilename+" --> ignore it"
+        return {}
+
+def SaveManifest(manifest,manifestfilename):
+    with open(manifestfilename+".tmp","w") as manifestfile:
+        json.dump(manifest,manifestfile)
+    os.rename(manifestfilename+".tmp",manifestfilename)
+
+def GetHarnessEntry(manifest,harnessname,filelist):
+    #entry of the harness in the manifest, reset if its input files changed
+    entry = manifest.get(harnessname)
+    if entry is None or entry.get("inputs")!=filelist:
+        entry = {"inputs":filelist, "fit":None, "plots":{}}
+        manifest[harnessname] = entry
+    return entry
+
+def GetCachedFit(manifest,harnessname,key):
+    fit = manifest[harnessname]["fit"]
+    if fit is not None and fit["key"]==key:
+        return fit
+    return None
+
+def PlotUpToDate(manifest,harnessname,plotfilename,key):
+    return manifest[harnessname]["plots"].get(plotfilename)==key and os.path.isfile(plotfilename)
+
+def EvalColumn(data,expression):
+    #evaluate a branch name or a formula of branch names, e.g. 0.5*(timemin+timemax), on a structured array
+    if expression in data.dtype.names:
+        return data[expression].astype("f8")
+    namespace = dict((column,data[column].astype("f8")) for column in data.dtype.names)
+    namespace.update({"abs":np.abs, "sqrt":np.sqrt, "exp":np.exp, "log":np.log})
+    return np.asarray(eval(expression,{"__builtins__":{}},namespace),dtype="f8")*np.ones(len(data))
+
+def TimeSelection(data,t_min,t_max):
+    return (data["timemin"]>t_min) & (data["timemax"]<t_max)
+
+def GetGraph(data,selection,xname,yname,xuncname="",yuncname=""):
+    selected = data[selection]
+    Npoints = len(selected)
+    a_x = array('d',EvalColumn(selected,xname))
+    a_y = array('d',EvalColumn(selected,yname))
 
     if(xuncname!=""):
-        chain.Draw( xuncname, selection, "goff")
-        ex  = chain.GetV1(); ex.SetSize(Npoints)
-        a_ex = array('d',ex)
+        a_ex = array('d',EvalColumn(selected,xuncname))
     else:
         a_ex = array('d',(0,)*Npoints)
 
     if(yuncname!=""):
-        chain.Draw( yuncname, selection, "goff")
-        ey  = chain.GetV1(); ey.SetSize(Npoints)
-        a_ey = array('d',ey)
+        a_ey = array('d',EvalColumn(selected,yuncname))
     else:
         a_ey = array('d',(0,)*Npoints)
 
@@ -90,13 +244,206 @@ def NormalizeGraph(graph,refpointlist):
         graph.SetPointEYhigh(ipoint, eyh/mean)
         
 
+def GetGraphArrays(graph):
+    #x, y and y uncertainty of the graph points as numpy arrays
+    Npoints = graph.GetN()
+    if Npoints==0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    x  = graph.GetX();      x.SetSize(Npoints)
+    y  = graph.GetY();      y.SetSize(Npoints)
+    ey = graph.GetEYhigh(); ey.SetSize(Npoints)
+    return np.array(x,dtype="f8"), np.array(y,dtype="f8"), np.array(ey,dtype="f8")
+
+def BatchLinearFit(x_list,y_list,ey_list):
+    #weighted least squares fit of y = p0 + p1*x of all the graphs at once
+    #the points are padded in a (Ngraphs x Npoints_max) array with weight 0
+    #as in TGraph::Fit, points with zero uncertainty are ignored, unless all the uncertainties of the graph are zero (unit weights)
+    Ngraphs = len(x_list)
+    Npoints_max = max([len(x) for x in x_list]+[1])
+    x = np.zeros((Ngraphs,Npoints_max))
+    y = np.zeros((Ngraphs,Npoints_max))
+    w = np.zeros((Ngraphs,Npoints_max))
+    unit_weights = np.zeros(Ngraphs,dtype=bool)
+    for igraph in range(0,Ngraphs):
+        Npoints = len(x_list[igraph])
+        x[igraph,:Npoints] = x_list[igraph]
+        y[igraph,:Npoints] = y_list[igraph]
+        ey = ey_list[igraph]
+        if np.all(ey<=0):
+            unit_weights[igraph] = True
+            w[igraph,:Npoints] = 1.
+        else:
+            w[igraph,:Npoints] = np.where(ey>0, 1./np.maximum(ey,1e-300)**2, 0.)
+
+    #x is centred on its weighted mean to keep the normal equations well conditioned (x can be a unix time)
+    S   = w.sum(axis=1)
+    x0  = (w*x).sum(axis=1)/np.where(S>0,S,1.)
+    dx  = (x-x0[:,np.newaxis])*(w>0)
+    Sy  = (w*y).sum(axis=1)
+    Sxx = (w*dx*dx).sum(axis=1)
+    Sxy = (w*dx*y).sum(axis=1)
+    valid = (S>0) & (Sxx>0)
+    S_safe   = np.where(valid,S,1.)
+    Sxx_safe = np.where(valid,Sxx,1.)
+    p1 = Sxy/Sxx_safe
+    p0_centred = Sy/S_safe
+    residuals = (y-p0_centred[:,np.newaxis]-p1[:,np.newaxis]*dx)*(w>0)
+    chi2 = (w*residuals*residuals).sum(axis=1)
+    ndf  = (w>0).sum(axis=1)-2
+    #parameters and covariance back at x=0
+    p0 = p0_centred-p1*x0
+    var_p1 = 1./Sxx_safe
+    var_p0 = 1./S_safe+x0*x0/Sxx_safe
+    cov_p0p1 = -x0/Sxx_safe
+    #with unit weights the uncertainties are estimated from the residuals (as ROOT does for graphs without errors)
+    scale = np.where(unit_weights & (ndf>0), chi2/np.maximum(ndf,1), 1.)
+    return {"p0":p0, "p1":p1, "ep0":np.sqrt(var_p0*scale), "ep1":np.sqrt(var_p1*scale), "cov":cov_p0p1*scale,
+            "chi2":chi2, "ndf":ndf, "valid":valid & (ndf>0) & np.isfinite(p0) & np.isfinite(p1)}
+
+#############################################################################
+# parallel rendering of the per harness plots
+# the harnesses are split among a pool of forked processes, each one drawing its share with ROOT in batch mode
+# the workers inherit data_dict and graph_dict (including the fitted functions) from the main process
+#############################################################################
+
+def DrawHarnessDefaultPlots(harnessnames):
+    #Nev and scale (template fit, mean, median) vs time plots of the given harnesses
+    c = ROOT.TCanvas()
+    c.SetGrid()
+    for harnessname in harnessnames:
+        data = data_dict[harnessname]
+        selection = TimeSelection(data,options.t_min,options.t_max)
+
+        Nev_graph = GetGraph(data,
+                                selection,                                               #selection
+                                "0.5*(timemin+timemax)", "Nev",                  #x,y variables names
+                                "",            "")               #ex,ey, variables names
+
+        Nev_graph.SetMarkerStyle(20)
+        Nev_graph.SetMarkerColor(1)
+        Nev_graph.Draw("AP")
+        if("time" in options.xname):
+            Nev_graph.GetXaxis().SetTimeFormat("%d/%m%F1970-01-01 00:00:00")
+            Nev_graph.GetXaxis().SetTimeDisplay(1)
+        SetAxisTitle(Nev_graph.GetXaxis(),options.xname)
+        Nev_graph.GetYaxis().SetTitle("Number of events")
+        Nev_graph.GetYaxis().SetRangeUser(0.,30000.)
+        c.Print("%s/defaultplots/%s_Nev_vs_t.png"%(outdir,harnessname))
+        #c.Print("%s/defaultplots/%s.pdf"%(outdir,harnessname))
+        #c.SaveAs("%s/defaultplots/%s.root"%(outdir,harnessname))
+        #c.SaveAs("%s/defaultplots/%s.C"%(outdir,harnessname))
+        c.Clear()
+
+
+        templatefit_graph = GetGraph(data,
+                                     selection,                                               #selection
+                                     options.xname, "scale_Eop_templatefit",                  #x,y variables names
+                                     "",            "scale_unc_Eop_templatefit")               #ex,ey, variables names
+        mean_graph = GetGraph(data,
+                              selection,                                               #selection
+                              options.xname, "scale_Eop_mean",                  #x,y variables names
+                              "",            "scale_unc_Eop_mean")               #ex,ey, variables names
+        median_graph = GetGraph(data,
+                                selection,                                               #selection
+                                options.xname, "scale_Eop_median",                  #x,y variables names
+                                "",            "scale_unc_Eop_median")               #ex,ey, variables names
+
+
+        NormalizeGraph(templatefit_graph,[1])
+        NormalizeGraph(mean_graph,[1])
+        NormalizeGraph(median_graph,[1])
+
+        templatefit_graph.SetMarkerStyle(20)
+        mean_graph.SetMarkerStyle(21)
+        median_graph.SetMarkerStyle(22)
+        templatefit_graph.SetMarkerColor(1)
+        mean_graph.SetMarkerColor(2)
+        median_graph.SetMarkerColor(3)
+
+        multigraph = ROOT.TMultiGraph()
+        multigraph.Add(templatefit_graph)
+        multigraph.Add(mean_graph)
+        multigraph.Add(median_graph)
+
+        multigraph.Draw("AP")
+        if("time" in options.xname):
+            multigraph.GetXaxis().SetTimeFormat("%d/%m%F1970-01-01 00:00:00")
+            multigraph.GetXaxis().SetTimeDisplay(1)
+        SetAxisTitle(multigraph.GetXaxis(),options.xname)
+        multigraph.GetYaxis().SetTitle("E/p scale")
+
+        legend = ROOT.TLegend(0.12,0.12,0.48,0.3)
+        legend.AddEntry(templatefit_graph, "template fit", "p")
+        legend.AddEntry(mean_graph,        "mean",         "p")
+        legend.AddEntry(median_graph,      "median",       "p")
+        legend.Draw()
+
+        c.Print("%s/defaultplots/%s.png"%(outdir,harnessname))
+        #c.Print("%s/defaultplots/%s.pdf"%(outdir,harnessname))
+        #c.SaveAs("%s/defaultplots/%s.root"%(outdir,harnessname))
+        #c.SaveAs("%s/defaultplots/%s.C"%(outdir,harnessname))
+        c.Clear()
+
+def DrawHarnessPlots(harnessnames):
+    #y vs x plots of the given harnesses (with the linear fit, if done)
+    c = ROOT.TCanvas()
+    c.SetGrid()
+    for harnessname in harnessnames:
+        graph = graph_dict[harnessname]
+    
+        xmin_graph = ROOT.TMath.MinElement(graph.GetN(),graph.GetX())
+        xmax_graph = ROOT.TMath.MaxElement(graph.GetN(),graph.GetX())
+        ietamin,ietamax,iphimin,iphimax = HarnessLimits(harnessname)
+        graph.SetTitle("PN region: %i #leq i#eta #leq %i, %i #leq i#phi #leq %i"%(ietamin,ietamax,iphimin,iphimax)) 
+        graph.SetMarkerStyle(20)
+        graph.Draw("AP")
+        graph.GetXaxis().SetLimits( xmin_graph-0.07*(xmax_graph-xmin_graph), xmax_graph+0.07*(xmax_graph-xmin_graph))
+        #graph.GetYaxis().SetRangeUser( 0.98, 1.02) #setting RANGE HARCODED
+        if("time" in options.xname):
+            graph.GetXaxis().SetTimeFormat("%d/%m%F1970-01-01 00:00:00")
+            graph.GetXaxis().SetTimeDisplay(1)
+
+        SetAxisTitle(graph.GetXaxis(),options.xname)
+        SetAxisTitle(graph.GetYaxis(),options.yname)
+        graph.GetXaxis().SetTitleOffset(0.8)
+        graph.GetXaxis().SetLabelSize(0.03)
+
+        c.Print(GetHarnessPlotName(harnessname))
+        c.Clear()
+
+def GetHarnessPlotName(harnessname):
+    ietamin,ietamax,iphimin,iphimax = HarnessLimits(harnessname)
+    if ietamin<0:
+        return "%s/fit/EBm/%s.png"%(outdir,harnessname)
+    else:
+        return "%s/fit/EBp/%s.png"%(outdir,harnessname)
+
+def RenderHarnessPlots(args):
+    function, harnessnames = args
+    ROOT.gROOT.SetBatch(1)
+    function(harnessnames)
+    return len(harnessnames)
+
+def RenderInParallel(function,harnessnames,Nprocesses):
+    if Nprocesses<=1 or len(harnessnames)<=1:
+        function(harnessnames)
+        return
+    Nprocesses = min(Nprocesses,len(harnessnames))
+    print "rendering %i harnesses with %i processes"%(len(harnessnames),Nprocesses)
+    pool = multiprocessing.Pool(Nprocesses)
+    pool.map(RenderHarnessPlots, [(function,harnessnames[iprocess::Nprocesses]) for iprocess in range(0,Nprocesses)])
+    pool.close()
+    pool.join()
+
 #parse arguments
 parser = OptionParser()
 parser.add_option('--DrawDefaultPlots',  action='store_true',        dest='DrawDefaultPlots',   default=False,      help='draw default plots')
 parser.add_option('--DrawPlots',      action='store_true',        dest='DrawPlots',   default=False,      help='make per harness plots')
 parser.add_option('--LinearFit',      action='store_true',        dest='LinearFit',   default=False,      help='perform a linear fit of x vs y')
 parser.add_option("--GetPointCorrections", action='store_true',        dest='GetPointCorrections',   default=False,
-                  help='extract an IC set for each time bin and save it in a output txt file')
+                  help='extract an IC set for each time bin and save all of them in a binary file (PointCorrections/IC.bin)')
+parser.add_option("--txtPointCorrections", action='store_true',        dest='txtPointCorrections',   default=False,
+                  help='with --GetPointCorrections, write also one txt IC file per time bin and the IOVdictionary.txt')
 
 parser.add_option("-i", "--inputdir", action="store", type="str", dest="inputdir",                    help="input directory")
 parser.add_option("-x", "--xname",    action="store", type="str", dest="xname",    default="0.5*(timemin+timemax)",  help="name in the tree of the x variable")
@@ -107,6 +454,10 @@ parser.add_option("--xupname",        action="store", type="str", dest="xupname"
 parser.add_option("-y", "--yname",    action="store", type="str", dest="yname",  default="scale_Eop_mean", help="name in the tree of the y variable")
 parser.add_option("--yuncname",           action="store", type="str", dest="yuncname", default="",     help="name in the tree of the y uncertainty variable")
 #parser.add_option("--NormalizetoIOV",     action="store", type="str", dest="NormalizetoIOV", default="0",  help="normalize scale to the average of the scale in the given IOV (e.g. 1,2,3) the default is 0 --> not normalized")
+parser.add_option("--cache",    action="store", type="str", dest="cache",  default="",  help="cache of the scalemonitoring outputs (default: <outdir>/scalemonitoring_cache.npz)")
+parser.add_option('--force',          action='store_true',        dest='force',          default=False,      help='ignore the manifest: fit and draw again all the harnesses')
+parser.add_option('--rebuildCache',   action='store_true',        dest='rebuildCache',   default=False,      help='read again all the scalemonitoring outputs ignoring the cache')
+parser.add_option("-j", "--Nprocesses", action="store", type="int", dest="Nprocesses", default=multiprocessing.cpu_count(),  help="number of processes drawing the per harness plots")
 parser.add_option("-o", "--outdir",    action="store",      type="str", dest="outdir",          default="",       help="output directory")
 
 (options, args) = parser.parse_args()
@@ -125,30 +476,33 @@ ROOT.gErrorIgnoreLevel = ROOT.kWarning #switch off 'Info in <TCanvas::Print>: bl
 #ROOT.Math.MinimizerOptions.SetDefaultMinimizer("Minuit2", "Fumili2")
 ROOT.Math.MinimizerOptions.SetDefaultStrategy(2) #help converging fit with almost flat slope
 
-#build the dictionary of the TChains
-print "building the chains"
-chain_dict = {}
-for dirname in os.listdir(options.inputdir):
-    fullpath = os.path.join(options.inputdir,dirname)
-    if not os.path.isdir(fullpath):
-        continue
-    if dirname.find("IEta")!=-1 and dirname.find("IPhi")!=-1:
-        harnessname = dirname
-        chain_dict[harnessname] = ROOT.TChain(harnessname,harnessname)
-        chain_dict[harnessname].Add(fullpath+"/out_file_*_scalemonitoring.root")#to be properly modified 
-
-print "%i chains created"%len(chain_dict)
+#load the time bins of all the harnesses (each input file is read once, then the cache is used)
+if(options.cache == ""):
+    cachefilename = outdir+"/scalemonitoring_cache.npz"
+else:
+    cachefilename = options.cache
+data_dict, inputs_dict = LoadScaleMonitoring(options.inputdir,cachefilename,options.rebuildCache)
+print "%i harnesses loaded"%len(data_dict)
+
+#harness results of the previous runs (the entries of the harnesses whose inputs changed are reset)
+manifestfilename = outdir+"/harness_corrections_manifest.json"
+if options.force:
+    manifest = {}
+else:
+    manifest = LoadManifest(manifestfilename)
+for harnessname, filelist in inputs_dict.items():
+    GetHarnessEntry(manifest,harnessname,filelist)
 
 #build the dictionary of the TGraphAsymmErrors
 print "building y vs x graphs"
 graph_dict = {}
-for harnessname, chain in chain_dict.items():
-    #print harnessname+" - "+str(chain.GetEntries())
-    if chain.GetEntries()<=0: 
-        print "[WARNING]: %s chain is empty --> skip it"%harnessname
+for harnessname, data in data_dict.items():
+    #print harnessname+" - "+str(len(data))
+    if len(data)<=0: 
+        print "[WARNING]: %s harness is empty --> skip it"%harnessname
         continue
-    graph_dict[harnessname] = GetGraph(chain,
-                                       "timemin>%f && timemax<%f"%(options.t_min,options.t_max),#selection
+    graph_dict[harnessname] = GetGraph(data,
+                                       TimeSelection(data,options.t_min,options.t_max),         #selection
                                        options.xname, options.yname,                            #x,y variables names
                                        "",            options.yuncname)                         #ex,ey, variables names
 
@@ -171,16 +525,46 @@ if options.LinearFit:
         start_run = 4.
         end_run   = 10.
  
-    nTrialsMax = 10
+    #normalize the graphs and fit all of them at once, except the ones with a valid fit in the manifest
+    fit_key = json.dumps([options.xname, options.yname, options.yuncname, options.t_min, options.t_max])
+    fit_harnesses = []
+    cached_harnesses = []
+    x_list, y_list, ey_list = [], [], []
     for harnessname, graph in graph_dict.items():
-        #print ">>>>>>> Fit harness "+harnessname
         if (graph.GetN() == 0):
-            #print ">>>>>>> Empty graph"
             continue
-        
         NormalizeGraph(graph,[1]) 
-        minDate = ROOT.TMath.MinElement(graph.GetN(),graph.GetX())
-        maxDate = ROOT.TMath.MaxElement(graph.GetN(),graph.GetX())
+        if GetCachedFit(manifest,harnessname,fit_key) is not None:
+            cached_harnesses.append(harnessname)
+            continue
+        x, y, ey = GetGraphArrays(graph)
+        fit_harnesses.append(harnessname)
+        x_list.append(x)
+        y_list.append(y)
+        ey_list.append(ey)
+    batch = BatchLinearFit(x_list,y_list,ey_list)
+
+    for harnessname in cached_harnesses:
+        graph = graph_dict[harnessname]
+        fit = GetCachedFit(manifest,harnessname,fit_key)
+        fit_func[harnessname] = ROOT.TF1("fitfunc_"+harnessname,"[0]+[1]*x",fit["xmin"],fit["xmax"])
+        fit_func[harnessname].SetParName(0,"intercept")
+        if ("time" in options.xname): fit_func[harnessname].SetParName(1,"slope (1/s)")
+        elif("lumi" in options.xname):fit_func[harnessname].SetParName(1,"slope (1/fb^{-1})")
+        fit_func[harnessname].SetParameters(fit["p0"], fit["p1"])
+        fit_func[harnessname].SetParErrors(array('d',[fit["ep0"], fit["ep1"]]))
+        fit_func[harnessname].SetChisquare(fit["chi2"])
+        fit_func[harnessname].SetNDF(fit["ndf"])
+        graph.GetListOfFunctions().Add(fit_func[harnessname])
+        p0_map[harnessname] = fit_func[harnessname].Eval(start_run)
+
+    #harnesses failing the quality checks are fitted again with Minuit, starting from the batch solution
+    nTrialsMax = 10
+    Nrefit = 0
+    for ifit,harnessname in enumerate(fit_harnesses):
+        graph = graph_dict[harnessname]
+        minDate = x_list[ifit].min()
+        maxDate = x_list[ifit].max()
 
         fit_func[harnessname] = ROOT.TF1("fitfunc_"+harnessname,"[0]+[1]*x",minDate - 0.07*(maxDate-minDate), maxDate + 0.07*(maxDate-minDate))
         fit_func[harnessname].SetParName(0,"intercept")
@@ -188,35 +572,40 @@ if options.LinearFit:
         if ("time" in options.xname): fit_func[harnessname].SetParName(1,"slope (1/s)")
         elif("lumi" in options.xname):fit_func[harnessname].SetParName(1,"slope (1/fb^{-1})")
 
+        fit_func[harnessname].SetParameters(batch["p0"][ifit], batch["p1"][ifit])
+        if batch["valid"][ifit] and batch["chi2"][ifit]/batch["ndf"][ifit] <= 6:
+            fit_func[harnessname].SetParErrors(array('d',[batch["ep0"][ifit], batch["ep1"][ifit]]))
+            fit_func[harnessname].SetChisquare(batch["chi2"][ifit])
+            fit_func[harnessname].SetNDF(int(batch["ndf"][ifit]))
+            graph.GetListOfFunctions().Add(fit_func[harnessname])
+            p0_map[harnessname] = fit_func[harnessname].Eval(start_run)
+            continue
+
+        print ">>>>>>> harness %s -> Bad chisquare or failed batch fit --> refit with Minuit"%harnessname
+        Nrefit += 1
         fStatus = 1
         nTrials = 0
         while( fStatus!=3 and nTrials<nTrialsMax ):
             rp = graph.Fit(fit_func[harnessname], "RSQME")
             p0_map[harnessname] = fit_func[harnessname].Eval(start_run)
             fStatus=rp.CovMatrixStatus()
-            
             nTrials += 1
-            #print nTrials
             if(fStatus==3):
                 print ">>>>>>> Converged after %i trials"%nTrials
-            if (fit_func[harnessname].GetChisquare() / fit_func[harnessname].GetNDF() < 1 or fStatus == 2):
-                if (nTrials == nTrialsMax):    
-                  print "[WARNING]: harness %s -> points very close to the line --> matrix not pos def"%harnessname
-            else:
-                if (fit_func[harnessname].GetChisquare() / fit_func[harnessname].GetNDF() > 6 or fStatus != 3): #was 1000 before
-                    print ">>>>>>> harness %s -> Bad chisquare"%harnessname
-                    fit_func[harnessname].SetParameter(0, 15.)
-                    fit_func[harnessname].SetParameter(1, -8e-10 ) 
-                    while (fStatus != 3 and nTrials < 10):
-                        rp = graph.Fit(fit_func[harnessname], "RSQME")
-                        p0_map[harnessname] = fit_func[harnessname].Eval(start_run)
-                        fStatus=rp.CovMatrixStatus()
-                        nTrials += 1
-                        print nTrials
-                        #if(fStatus==3):
-                        #    print ">>>>>>> Converged after %i trials"%nTrials
-                    if(fStatus != 3):
-                        print ">>>>>>> harness %s -> NOT Converged"%harnessname
+            elif(fit_func[harnessname].GetNDF()>0 and fit_func[harnessname].GetChisquare() / fit_func[harnessname].GetNDF() < 1):
+                #points very close to the line --> the covariance matrix can't be made pos def, keep the fit
+                print "[WARNING]: harness %s -> points very close to the line --> matrix not pos def"%harnessname
+                break
+        if(fStatus != 3):
+            print ">>>>>>> harness %s -> NOT Converged"%harnessname
+    print "%i harnesses fitted, %i of them refitted with Minuit, %i fits taken from the manifest"%(len(fit_harnesses),Nrefit,len(cached_harnesses))
+
+    for harnessname in fit_harnesses:
+        manifest[harnessname]["fit"] = {"key":fit_key,
+                                        "xmin":fit_func[harnessname].GetXmin(), "xmax":fit_func[harnessname].GetXmax(),
+                                        "p0":fit_func[harnessname].GetParameter(0), "p1":fit_func[harnessname].GetParameter(1),
+                                        "ep0":fit_func[harnessname].GetParError(0), "ep1":fit_func[harnessname].GetParError(1),
+                                        "chi2":fit_func[harnessname].GetChisquare(), "ndf":fit_func[harnessname].GetNDF()}
 
     #Fill histos
     print "Filling histos"
@@ -335,84 +724,22 @@ if options.LinearFit:
 ################################################################################################################
 
 if options.DrawDefaultPlots:
-    c = ROOT.TCanvas()
-    c.SetGrid()
+    print "Drawing default plots"
     os.system("mkdir %s/defaultplots"%outdir)
     #os.system("cp index.php %s/defaultplots"%outdir)
-    for harnessname, chain in chain_dict.items():
-        #print harnessname+" - "+str(chain.GetEntries())
-        if chain.GetEntries()<=0: 
+    plot_key = json.dumps([options.xname, options.t_min, options.t_max])
+    outdated_harnesses = []
+    for harnessname, data in data_dict.items():
+        if len(data)<=0:
             continue
-
-        Nev_graph = GetGraph(chain,
-                                "timemin>%f && timemax<%f"%(options.t_min,options.t_max),#selection
-                                "0.5*(timemin+timemax)", "Nev",                  #x,y variables names
-                                "",            "")               #ex,ey, variables names
-
-        Nev_graph.SetMarkerStyle(20)
-        Nev_graph.SetMarkerColor(1)
-        Nev_graph.Draw("AP")
-        if("time" in options.xname):
-            Nev_graph.GetXaxis().SetTimeFormat("%d/%m%F1970-01-01 00:00:00")
-            Nev_graph.GetXaxis().SetTimeDisplay(1)
-        SetAxisTitle(Nev_graph.GetXaxis(),options.xname)
-        Nev_graph.GetYaxis().SetTitle("Number of events")
-        Nev_graph.GetYaxis().SetRangeUser(0.,30000.)
-        c.Print("%s/defaultplots/%s_Nev_vs_t.png"%(outdir,harnessname))
-        #c.Print("%s/defaultplots/%s.pdf"%(outdir,harnessname))
-        #c.SaveAs("%s/defaultplots/%s.root"%(outdir,harnessname))
-        #c.SaveAs("%s/defaultplots/%s.C"%(outdir,harnessname))
-        c.Clear()
-
-
-        templatefit_graph = GetGraph(chain,
-                                     "timemin>%f && timemax<%f"%(options.t_min,options.t_max),#selection
-                                     options.xname, "scale_Eop_templatefit",                  #x,y variables names
-                                     "",            "scale_unc_Eop_templatefit")               #ex,ey, variables names
-        mean_graph = GetGraph(chain,
-                              "timemin>%f && timemax<%f"%(options.t_min,options.t_max),#selection
-                              options.xname, "scale_Eop_mean",                  #x,y variables names
-                              "",            "scale_unc_Eop_mean")               #ex,ey, variables names
-        median_graph = GetGraph(chain,
-                                "timemin>%f && timemax<%f"%(options.t_min,options.t_max),#selection
-                                options.xname, "scale_Eop_median",                  #x,y variables names
-                                "",            "scale_unc_Eop_median")               #ex,ey, variables names
-
-
-        NormalizeGraph(templatefit_graph,[1])
-        NormalizeGraph(mean_graph,[1])
-        NormalizeGraph(median_graph,[1])
-
-        templatefit_graph.SetMarkerStyle(20)
-        mean_graph.SetMarkerStyle(21)
-        median_graph.SetMarkerStyle(22)
-        templatefit_graph.SetMarkerColor(1)
-        mean_graph.SetMarkerColor(2)
-        median_graph.SetMarkerColor(3)
-
-        multigraph = ROOT.TMultiGraph()
-        multigraph.Add(templatefit_graph)
-        multigraph.Add(mean_graph)
-        multigraph.Add(median_graph)
-
-        multigraph.Draw("AP")
-        if("time" in options.xname):
-            multigraph.GetXaxis().SetTimeFormat("%d/%m%F1970-01-01 00:00:00")
-            multigraph.GetXaxis().SetTimeDisplay(1)
-        SetAxisTitle(multigraph.GetXaxis(),options.xname)
-        multigraph.GetYaxis().SetTitle("E/p scale")
-
-        legend = ROOT.TLegend(0.12,0.12,0.48,0.3)
-        legend.AddEntry(templatefit_graph, "template fit", "p")
-        legend.AddEntry(mean_graph,        "mean",         "p")
-        legend.AddEntry(median_graph,      "median",       "p")
-        legend.Draw()
-
-        c.Print("%s/defaultplots/%s.png"%(outdir,harnessname))
-        #c.Print("%s/defaultplots/%s.pdf"%(outdir,harnessname))
-        #c.SaveAs("%s/defaultplots/%s.root"%(outdir,harnessname))
-        #c.SaveAs("%s/defaultplots/%s.C"%(outdir,harnessname))
-        c.Clear()
+        plotfilenames = ["%s/defaultplots/%s_Nev_vs_t.png"%(outdir,harnessname), "%s/defaultplots/%s.png"%(outdir,harnessname)]
+        if not all(PlotUpToDate(manifest,harnessname,plotfilename,plot_key) for plotfilename in plotfilenames):
+            outdated_harnesses.append(harnessname)
+    print "%i harnesses to draw, %i up to date"%(len(outdated_harnesses),len([data for data in data_dict.values() if len(data)>0])-len(outdated_harnesses))
+    RenderInParallel(DrawHarnessDefaultPlots, outdated_harnesses, options.Nprocesses)
+    for harnessname in outdated_harnesses:
+        manifest[harnessname]["plots"]["%s/defaultplots/%s_Nev_vs_t.png"%(outdir,harnessname)] = plot_key
+        manifest[harnessname]["plots"]["%s/defaultplots/%s.png"%(outdir,harnessname)] = plot_key
 
 #draw the "scale vs time"-like plots
 if options.DrawPlots:
@@ -421,103 +748,67 @@ if options.DrawPlots:
     #os.system("cp index.php  %s/fit/EBm/"%outdir)
     os.system("mkdir -p %s/fit/EBp/"%outdir)
     #os.system("cp index.php  %s/fit/EBp/"%outdir)
-    c = ROOT.TCanvas()
-    c.SetGrid()
+    plot_key = json.dumps([options.xname, options.yname, options.yuncname, options.t_min, options.t_max, options.LinearFit])
+    outdated_harnesses = []
     for harnessname, graph in graph_dict.items():
-        if graph.GetN()==0: continue
-    
-        xmin_graph = ROOT.TMath.MinElement(graph.GetN(),graph.GetX())
-        xmax_graph = ROOT.TMath.MaxElement(graph.GetN(),graph.GetX())
-        ietamin,ietamax,iphimin,iphimax = HarnessLimits(harnessname)
-        graph.SetTitle("PN region: %i #leq i#eta #leq %i, %i #leq i#phi #leq %i"%(ietamin,ietamax,iphimin,iphimax)) 
-        graph.SetMarkerStyle(20)
-        graph.Draw("AP")
-        graph.GetXaxis().SetLimits( xmin_graph-0.07*(xmax_graph-xmin_graph), xmax_graph+0.07*(xmax_graph-xmin_graph))
-        #graph.GetYaxis().SetRangeUser( 0.98, 1.02) #setting RANGE HARCODED
-        if("time" in options.xname):
-            graph.GetXaxis().SetTimeFormat("%d/%m%F1970-01-01 00:00:00")
-            graph.GetXaxis().SetTimeDisplay(1)
-
-        SetAxisTitle(graph.GetXaxis(),options.xname)
-        SetAxisTitle(graph.GetYaxis(),options.yname)
-        graph.GetXaxis().SetTitleOffset(0.8)
-        graph.GetXaxis().SetLabelSize(0.03)
-
-        if ietamin<0:
-            #        c.Print("%s/fit/EBm/%s.pdf"%(outdir,harnessname))
-            c.Print("%s/fit/EBm/%s.png"%(outdir,harnessname))
-            #        c.SaveAs("%s/fit/EBm/%s.root"%(outdir,harnessname))
-            #        c.SaveAs("%s/fit/EBm/%s.C"%(outdir,harnessname))
-        else: 
-            #        c.Print("%s/fit/EBp/%s.pdf"%(outdir,harnessname))
-            c.Print("%s/fit/EBp/%s.png"%(outdir,harnessname))
-            #        c.SaveAs("%s/fit/EBp/%s.root"%(outdir,harnessname))
-            #        c.SaveAs("%s/fit/EBp/%s.C"%(outdir,harnessname))
-        c.Clear()
+        if graph.GetN()==0:
+            continue
+        if not PlotUpToDate(manifest,harnessname,GetHarnessPlotName(harnessname),plot_key):
+            outdated_harnesses.append(harnessname)
+    print "%i harnesses to draw, %i up to date"%(len(outdated_harnesses),len([graph for graph in graph_dict.values() if graph.GetN()>0])-len(outdated_harnesses))
+    RenderInParallel(DrawHarnessPlots, outdated_harnesses, options.Nprocesses)
+    for harnessname in outdated_harnesses:
+        manifest[harnessname]["plots"][GetHarnessPlotName(harnessname)] = plot_key
 
 if options.GetPointCorrections:
     print "Creating point corrections"
-    IOV_list = []
-    IC = {} #IC is a list of dictionaries, i.e. IC [iIOV] [ix] [iy] 
+    IOV_table = None
+    ICcube = None #IC [iIOV] [ieta+85] [iphi-1]
     print "Loop over harnesses"
-    for harnessname, chain in chain_dict.items():
+    for harnessname, data in data_dict.items():
         #print "doing harness", harnessname
-        if chain.GetEntries()!=0:
-            Npoints = chain.Draw( "%s:runmin:lsmin:runmax:lsmax"%options.yname, 
-                                  "timemin>%f && timemax<%f"%(options.t_min,options.t_max),
-                                  "goff")
-            
-            Escale   = chain.GetVal(0)
-            runmin   = chain.GetVal(1)    
-            lsmin    = chain.GetVal(2)
-            runmax   = chain.GetVal(3)
-            lsmax    = chain.GetVal(4)
-            Escale.SetSize(Npoints)
-            runmin.SetSize(Npoints)
-            lsmin.SetSize(Npoints)
-            runmax.SetSize(Npoints)
-            lsmax.SetSize(Npoints)
-            if len(IOV_list)==0:
-                for iIOV in range(0,Npoints):
-                    #print "iIOV", iIOV
-                    IOV = [runmin[iIOV],lsmin[iIOV],runmax[iIOV],lsmax[iIOV]]
-                    IOV_list.append(IOV)
-                    IC[iIOV] = {}
-                    for ieta in range(-85,86):
-                        IC[iIOV][ieta]={}
+        if len(data)!=0:
+            selected = data[TimeSelection(data,options.t_min,options.t_max)]
+            Escale   = EvalColumn(selected,options.yname)
+            IOVs     = np.column_stack((selected["runmin"],selected["lsmin"],selected["runmax"],selected["lsmax"]))
+            if IOV_table is None:
+                IOV_table = IOVs
+                ICcube = np.ones((len(IOV_table),171,360),dtype="f4")
+
+            if len(IOVs)!=len(IOV_table):
+                print "[ERROR]: missing IOVs in harness "+harnessname
+                exit()
+            if np.any(IOVs!=IOV_table):
+                print "[ERROR]: IOV mismatching in harness "+harnessname
+                exit()
 
 #            ref_scale = Escale[0]
 #            if(ref_scale<=0.5 or ref_scale>2.):
 #                ref_scale=1.
             ref_scale = 1.
-            for iIOV in range(0,len(IOV_list)):
-                IOV = IOV_list[iIOV]
-                if Npoints!=len(IOV_list):
-                    print "[ERROR]: missing IOVs in harness "+harnessname
-                    exit()
-                if ( runmin[iIOV]!=IOV[0] or lsmin[iIOV]!=IOV[1] or runmax[iIOV]!=IOV[2] or lsmax[iIOV]!=IOV[3] ):
-                    print "[ERROR]: IOV mismatching in harness "+harnessname
-                    exit()
-                else:
-                    ietamin,ietamax,iphimin,iphimax = HarnessLimits(harnessname)
-                    for ieta in range(ietamin,ietamax+1):
-                        for iphi in range(iphimin,iphimax+1):
-                            if( Escale[iIOV]<=0.5 or Escale[iIOV]>2.):
-                                ICvalue = ref_scale
-                            else:
-                                ICvalue = ref_scale/Escale[iIOV]
-                            IC[iIOV][ieta][iphi] = ICvalue
-
-    print "writing output txt files"
+            good_scale = (Escale>0.5) & (Escale<=2.)
+            ICvalues = np.where(good_scale, ref_scale/np.where(good_scale,Escale,1.), ref_scale)
+            ietamin,ietamax,iphimin,iphimax = HarnessLimits(harnessname)
+            ICcube[:, ietamin+85:ietamax+86, iphimin-1:iphimax] = ICvalues[:,np.newaxis,np.newaxis]
+
+    if IOV_table is None:
+        print "[ERROR]: no time bins selected --> no point corrections"
+        exit()
+
     os.system("mkdir -p %s/PointCorrections/"%outdir)
-    IOVdict_filename="%s/PointCorrections/IOVdictionary.txt"%outdir
-    IOVdict_file = open(IOVdict_filename,"w")
-    #IOVdict_file.write("RUNMIN\tLSMIN\tRUNMAX\tLSMAX\tICFILENAME\n")
-    for iIOV in range(0,len(IOV_list)):
-        icfilename = "%s/PointCorrections/IC%i.txt"%(outdir,iIOV)
-        IOVdict_file.write("%i\t%i\t%i\t%i\t%s\n"%(IOV_list[iIOV][0],IOV_list[iIOV][1],IOV_list[iIOV][2],IOV_list[iIOV][3],icfilename))
-        writeIC(icfilename,IC[iIOV])
-    IOVdict_file.close()
-                    
-                    
-                
+    icfilename = "%s/PointCorrections/IC.bin"%outdir
+    print "writing %i IOVs to %s"%(len(IOV_table),icfilename)
+    writeICcube(icfilename,IOV_table,ICcube)
+
+    if options.txtPointCorrections:
+        print "writing output txt files"
+        IOVdict_filename="%s/PointCorrections/IOVdictionary.txt"%outdir
+        IOVdict_file = open(IOVdict_filename,"w")
+        #IOVdict_file.write("RUNMIN\tLSMIN\tRUNMAX\tLSMAX\tICFILENAME\n")
+        for iIOV in range(0,len(IOV_table)):
+            icfilename = "%s/PointCorrections/IC%i.txt"%(outdir,iIOV)
+            IOVdict_file.write("%i\t%i\t%i\t%i\t%s\n"%(IOV_table[iIOV][0],IOV_table[iIOV][1],IOV_table[iIOV][2],IOV_table[iIOV][3],icfilename))
+            writeIC(icfilename,ICcube[iIOV])
+        IOVdict_file.close()
+
+SaveManifest(manifest,manifestfilename)
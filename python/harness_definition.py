@@ -48,3 +48,9 @@ def GetModuleRanges():
     return ModuleRanges
 
 
+
+def WriteHarnessRanges(filename,HarnessRanges):
+    #txt file read by HarnessMonitoringManager to build the crystal->harness lookup table
+    with open(filename,'w') as harnessfile:
+        for HarnessRange in HarnessRanges:
+            harnessfile.write("%i\t%i\t%i\t%i\n"%(HarnessRange[0],HarnessRange[1],HarnessRange[2],HarnessRange[3]))
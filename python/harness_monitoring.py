@@ -4,12 +4,15 @@ import glob
 import math
 from array import array
 import sys
+import re
 import time
 import subprocess
 from optparse import OptionParser
 import time
 import datetime
 import findFiles
+import localExecutor
+import jobAccounting
 import harness_definition
 
 #print date
@@ -31,6 +34,7 @@ ignored_ntuples_label_list = ["obsolete","failed"]#ntuples containing anywhere i
 #parse arguments
 parser = OptionParser()
 parser.add_option('--submit',          action='store_true',             dest='submit',          default=False,      help='submit jobs')
+parser.add_option("--local",           action="store",      type="int", dest="local",           default=0,          help="run the jobs on this machine with the given number of parallel processes instead of submitting them")
 parser.add_option("-q", "--queue",     action="store",      type="str", dest="condor_queue",    default="workday",  help="condor queue: espresso, longlunch, workday...")  
 parser.add_option("-l", "--label",     action="store",      type="str", dest="label",                               help="job label")
 parser.add_option("-v", "--verbosity", action="store",      type="int", dest="verbosity",       default=1,          help="verbosity level")
@@ -43,13 +47,29 @@ parser.add_option('--EE',              action='store_true',             dest='EE
 parser.add_option('--tier0',           action='store_true',             dest='tier0',           default=False,      help='submit to CAF queues (only if you are logged in lxplus-t0.cern.ch)')
 parser.add_option('--groupByTag',      action='store_true',             dest='groupByTag',      default=False,      help='group files by Tag, eg Run2018C, Run2018D...')
 parser.add_option('--groupByN',        action='store_true',             dest='groupByN',      default=False,      help='group files in batches of a certain number')
+parser.add_option("--balanceBy",       action="store",      type="choice", dest="balanceBy",  default="size",   choices=["size","entries"],
+                  help="weight used to balance the file groups: size (on-disk bytes) or entries (TTree entries)")
+parser.add_option("--groupTarget",     action="store",      type="float", dest="groupTarget",   default=0,
+                  help="target weight per job: GB with --balanceBy size, number of entries with --balanceBy entries")
+parser.add_option('--multiHarness',    action='store_true',             dest='multiHarness',    default=False,
+                  help='one job per file group monitoring all the harnesses in a single pass (the cfg must provide LaserMonitoring.harnessmap HARNESSMAP)')
+parser.add_option('--singlePass',      action='store_true',             dest='singlePass',      default=False,
+                  help='runDivide and scaleMonitor in a single loop over the ntuples (the histos are filled while dividing the runs)')
+parser.add_option('--reduce',          action='store_true',             dest='reduce',          default=False,
+                  help='the jobs save the histos of the time bins, then one reduce job per harness sums the file groups and extracts the scales once (scaleMonitor only, the time bins come from the shared LaserMonitoring.scaleMonitor.runranges)')
+parser.add_option('--rescanNtuples',   action='store_true',             dest='rescanNtuples',   default=False,      help='ignore the ntuple index and list again all the ntuple directories')
+parser.add_option("--scanThreads",     action="store",      type="int", dest="scanThreads",     default=8,          help="number of parallel threads scanning the ntuple directories")
 (options, args) = parser.parse_args()
 
 #create outdir
 os.system("mkdir -p "+str(options.outdir))
 
-#get ntuples for the calibration
-selected_filelist, extracalibtree_filelist = findFiles.findFiles(ntuple_dir, "unmerged", tag_list, ignored_ntuples_label_list)
+#get ntuples for the calibration (the persistent ntuple index is kept next to the job area)
+ntuple_index_filename = current_dir+"/jobs/ntuple_index.json"
+records = findFiles.findFileRecords(ntuple_dir,"unmerged",tag_list,ignored_ntuples_label_list,
+                                     ntuple_index_filename,options.scanThreads,options.rescanNtuples)
+selected_filelist = [record["path"] for record in records]
+extracalibtree_filelist = [record["extracalibtree"] for record in records]
 
 if (len(selected_filelist)>0):
     print
@@ -72,9 +92,20 @@ else:
 
 
 
+#weights used to balance the file groups
+if options.balanceBy=="entries":
+    findFiles.GetFileEntries(records,"selected",current_dir+"/jobs/ntuple_entries.json")
+    group_target = options.groupTarget
+else:
+    group_target = options.groupTarget*1e9
+
 #Group the files together, NB when building templates you need statistics (at least an era)
-if options.groupByTag: selected_filelist, extracalibtree_filelist = findFiles.groupFilesByTag(selected_filelist, extracalibtree_filelist, tag_list )
-elif options.groupByN: selected_filelist, extracalibtree_filelist = findFiles.groupFiles(selected_filelist, extracalibtree_filelist, nfiles )
+#--groupByTag: without --groupTarget one group per tag, otherwise each tag is split in balanced groups
+#--groupByN: as many groups as batches of nfiles files (or as given by --groupTarget), balanced by weight
+if options.groupByTag: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, 0, group_target, True, tag_list )
+elif options.groupByN:
+    if group_target>0: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, 0, group_target )
+    else: selected_filelist, extracalibtree_filelist = findFiles.groupFilesBalanced(records, options.balanceBy, int(math.ceil(float(len(records))/nfiles)) )
 else:  selected_filelist, extracalibtree_filelist = findFiles.groupFiles(selected_filelist, extracalibtree_filelist, len(selected_filelist) )
 
 if(options.verbosity>=1):
@@ -97,56 +128,164 @@ else: harness_ranges = harness_definition.GetHarnessRanges()
 
 print(">>>>>> Generating jobs for task lists "+options.tasklist)
 
-#make the monitoring files .cfg, .sh, and .sub
-for iFile in range(0,len(selected_filelist)):
-    selected_filename=selected_filelist[iFile]
-    extracalibtree_filename=extracalibtree_filelist[iFile]
-    if(options.verbosity>=1):
-        print(">>> Generating job for file "+selected_filename)
+def WriteJobScript(outScriptName,cfgfilename):
+    outScript = open(outScriptName,"w")
+    outScript.write("#!/bin/bash\n")
+    #outScript.write('source setup.sh\n')
+    outScript.write("cd /afs/cern.ch/work/f/fcetorel/private/work2/EFlow/CMSSW_10_5_0/src/\n")
+    outScript.write('eval `scram runtime -sh`\n');
+    outScript.write("cd -\n");
+    outScript.write("echo $PWD\n");
+    command = str(options.exedir)+"/LaserMonitoring.exe --cfg "+cfgfilename
+    for task in options.tasklist.split(','):
+        command += " --"+task
+    if options.singlePass:
+        command += " --singlePass"
+    #the fill jobs of the reduce only save the histos and the sketches, the scales are computed once by the reduce jobs
+    if options.reduce:
+        command += " --fillOnly"
+    outScript.write(jobAccounting.AccountedCommand(command,outScriptName,True)+"\n")
+    outScript.write("echo finish\n") 
+    outScript.close();
+    os.system("chmod 777 "+outScriptName)
+
+if options.singlePass and not ('runDivide' in options.tasklist and 'scaleMonitor' in options.tasklist):
+    print("[ERROR]: --singlePass requires both the runDivide and scaleMonitor tasks")
+    sys.exit()
+
+if options.reduce and (not 'scaleMonitor' in options.tasklist or 'buildTemplate' in options.tasklist):
+    print("[ERROR]: --reduce requires the scaleMonitor task (and does not support buildTemplate)")
+    sys.exit()
+
+#the reduce merges the time bins with the same run/ls boundaries: all the file groups must share the same time bins,
+#i.e. the ones of a runranges file produced by a separate runDivide pass and given in LaserMonitoring.scaleMonitor.runranges
+if options.reduce and ('runDivide' in options.tasklist or options.singlePass):
+    print("[ERROR]: --reduce does not support the runDivide task nor --singlePass (each file group would define its own time bins)")
+    print("         run runDivide first and give the shared runranges file in LaserMonitoring.scaleMonitor.runranges")
+    sys.exit()
+
+if options.reduce:
+    with open(str(options.configFile)) as fi:
+        if re.search(r"^\s*runranges\s.*OUTPUT_RUNDIVIDE", fi.read(), flags=re.M):
+            print("[ERROR]: --reduce requires a runranges file shared by all the file groups, LaserMonitoring.scaleMonitor.runranges can't be OUTPUT_RUNDIVIDE")
+            sys.exit()
+
+if options.multiHarness:
+    if 'buildTemplate' in options.tasklist or 'runDivide' in options.tasklist:
+        print("[ERROR]: --multiHarness supports only the scaleMonitor task (runranges must be provided in the cfg)")
+        sys.exit()
+    #the harness map is used by LaserMonitoring.exe to route each electron to its harness
+    harnessmap_filename = job_parent_folder+"/harness_ranges.txt"
+    harness_definition.WriteHarnessRanges(harnessmap_filename,harness_ranges)
     for harness_range in harness_ranges:
-        etamin = harness_range[0]
-        etamax = harness_range[1]
-        phimin = harness_range[2]
-        phimax = harness_range[3]
+        os.system("mkdir -p %s/IEta_%i_%i_IPhi_%i_%i/"%(options.outdir,harness_range[0],harness_range[1],harness_range[2],harness_range[3]))
 
+#make the monitoring files .cfg, .sh, and .sub
+if options.multiHarness:
+    for iFile in range(0,len(selected_filelist)):
+        selected_filename=selected_filelist[iFile]
+        extracalibtree_filename=extracalibtree_filelist[iFile]
         if(options.verbosity>=1):
-            print(">>> Generating job for harness IEta_%i_%i_IPhi_%i_%i"%(etamin,etamax,phimin,phimax))
+            print(">>> Generating multi-harness job for file "+selected_filename)
 
-        jobdir="%s/IEta_%i_%i_IPhi_%i_%i/job_file_%i/"%(job_parent_folder,etamin,etamax,phimin,phimax,iFile)
+        jobdir="%s/multiharness/job_file_%i/"%(job_parent_folder,iFile)
         os.system("mkdir -p "+jobdir)
-        outdir = "%s/IEta_%i_%i_IPhi_%i_%i/"%(options.outdir,etamin,etamax,phimin,phimax) 
-        os.system("mkdir -p "+outdir)
-
+        #harness tokens (IETAMIN, IETAMAX, IPHIMIN, IPHIMAX) are left in the cfg, LaserMonitoring.exe replaces them harness by harness
+        outdir = "%s/IEta_IETAMIN_IETAMAX_IPhi_IPHIMIN_IPHIMAX/"%(options.outdir)
         with open(str(options.configFile)) as fi:
             contents = fi.read()
             replaced_contents = contents.replace("SELECTED_INPUTFILE", selected_filename).replace("EXTRACALIBTREE_INPUTFILE", extracalibtree_filename)
-            replaced_contents = replaced_contents.replace("IETAMIN",str(etamin)) 
-            replaced_contents = replaced_contents.replace("IETAMAX",str(etamax))
-            replaced_contents = replaced_contents.replace("IPHIMIN",str(phimin)) 
-            replaced_contents = replaced_contents.replace("IPHIMAX",str(phimax)) 
-            replaced_contents = replaced_contents.replace("OUTPUT_RUNDIVIDE","%s/out_file_%i_runranges.root"%(outdir,iFile))
+            replaced_contents = replaced_contents.replace("HARNESSMAP",harnessmap_filename)
             replaced_contents = replaced_contents.replace("OUTPUT_SCALEMONITORING","%s/out_file_%i_scalemonitoring.root"%(outdir,iFile))
             replaced_contents = replaced_contents.replace("OUTPUT_FOLDER",outdir)
             cfgfilename=jobdir+"/config.cfg"
             with open(cfgfilename, "w") as fo:
                 fo.write(replaced_contents)
 
-        ##### creates script #######
-        outScriptName=jobdir+"/job_file_"+str(iFile)+".sh"
-        outScript = open(outScriptName,"w")
-        outScript.write("#!/bin/bash\n")
-        #outScript.write('source setup.sh\n')
-        outScript.write("cd /afs/cern.ch/work/f/fcetorel/private/work2/EFlow/CMSSW_10_5_0/src/\n")
-        outScript.write('eval `scram runtime -sh`\n');
-        outScript.write("cd -\n");
-        outScript.write("echo $PWD\n");
-        outScript.write(str(options.exedir)+"/LaserMonitoring.exe --cfg "+cfgfilename)
-        for task in options.tasklist.split(','):
-            outScript.write(" --"+task)
-        outScript.write("\n")
-        outScript.write("echo finish\n") 
-        outScript.close();
-        os.system("chmod 777 "+outScriptName)
+        WriteJobScript(jobdir+"/job_file_"+str(iFile)+".sh",cfgfilename)
+else:
+    for iFile in range(0,len(selected_filelist)):
+        selected_filename=selected_filelist[iFile]
+        extracalibtree_filename=extracalibtree_filelist[iFile]
+        if(options.verbosity>=1):
+            print(">>> Generating job for file "+selected_filename)
+        for harness_range in harness_ranges:
+            etamin = harness_range[0]
+            etamax = harness_range[1]
+            phimin = harness_range[2]
+            phimax = harness_range[3]
+
+            if(options.verbosity>=1):
+                print(">>> Generating job for harness IEta_%i_%i_IPhi_%i_%i"%(etamin,etamax,phimin,phimax))
+
+            jobdir="%s/IEta_%i_%i_IPhi_%i_%i/job_file_%i/"%(job_parent_folder,etamin,etamax,phimin,phimax,iFile)
+            os.system("mkdir -p "+jobdir)
+            outdir = "%s/IEta_%i_%i_IPhi_%i_%i/"%(options.outdir,etamin,etamax,phimin,phimax) 
+            os.system("mkdir -p "+outdir)
+
+            with open(str(options.configFile)) as fi:
+                contents = fi.read()
+                replaced_contents = contents.replace("SELECTED_INPUTFILE", selected_filename).replace("EXTRACALIBTREE_INPUTFILE", extracalibtree_filename)
+                replaced_contents = replaced_contents.replace("IETAMIN",str(etamin)) 
+                replaced_contents = replaced_contents.replace("IETAMAX",str(etamax))
+                replaced_contents = replaced_contents.replace("IPHIMIN",str(phimin)) 
+                replaced_contents = replaced_contents.replace("IPHIMAX",str(phimax)) 
+                replaced_contents = replaced_contents.replace("OUTPUT_RUNDIVIDE","%s/out_file_%i_runranges.root"%(outdir,iFile))
+                replaced_contents = replaced_contents.replace("OUTPUT_SCALEMONITORING","%s/out_file_%i_scalemonitoring.root"%(outdir,iFile))
+                replaced_contents = replaced_contents.replace("OUTPUT_FOLDER",outdir)
+                cfgfilename=jobdir+"/config.cfg"
+                with open(cfgfilename, "w") as fo:
+                    fo.write(replaced_contents)
+
+            ##### creates script #######
+            WriteJobScript(jobdir+"/job_file_"+str(iFile)+".sh",cfgfilename)
+
+#reduce: one job per harness merging the outputs of all the file groups (histos and quantile sketches of the time bins)
+#the merged output out_merged_scalemonitoring.root is used by harness_corrections.py in place of the per file group outputs
+def WriteReduceConfig(cfgfilename,harness_range,inputfilenames,outputfilename,outdir):
+    with open(str(options.configFile)) as fi:
+        contents = fi.read()
+    #the ntuples are not read by the merge, the ones of the first file group are used to fill the Input block
+    replaced_contents = contents.replace("SELECTED_INPUTFILE", selected_filelist[0]).replace("EXTRACALIBTREE_INPUTFILE", extracalibtree_filelist[0])
+    replaced_contents = replaced_contents.replace("IETAMIN",str(harness_range[0]))
+    replaced_contents = replaced_contents.replace("IETAMAX",str(harness_range[1]))
+    replaced_contents = replaced_contents.replace("IPHIMIN",str(harness_range[2]))
+    replaced_contents = replaced_contents.replace("IPHIMAX",str(harness_range[3]))
+    replaced_contents = replaced_contents.replace("OUTPUT_SCALEMONITORING",outputfilename)
+    replaced_contents = replaced_contents.replace("OUTPUT_FOLDER",outdir)
+    #the merge runs harness by harness
+    replaced_contents = re.sub(r"^\s*harnessmap\s.*\n", "", replaced_contents, flags=re.M)
+    if not "</LaserMonitoring>" in replaced_contents:
+        print("[ERROR]: can't find the LaserMonitoring block in "+str(options.configFile)+" --> EXIT")
+        sys.exit()
+    replaced_contents = replaced_contents.replace("</LaserMonitoring>", "  <merge>\n    inputs "+" ".join(inputfilenames)+"\n    output "+outputfilename+"\n  </merge>\n</LaserMonitoring>", 1)
+    with open(cfgfilename, "w") as fo:
+        fo.write(replaced_contents)
+
+def WriteReduceScript(outScriptName,cfgfilename):
+    outScript = open(outScriptName,"w")
+    outScript.write("#!/bin/bash\n")
+    outScript.write("cd /afs/cern.ch/work/f/fcetorel/private/work2/EFlow/CMSSW_10_5_0/src/\n")
+    outScript.write('eval `scram runtime -sh`\n');
+    outScript.write("cd -\n");
+    outScript.write("echo $PWD\n");
+    outScript.write(jobAccounting.AccountedCommand(str(options.exedir)+"/LaserMonitoring.exe --cfg "+cfgfilename+" --merge",outScriptName,True)+"\n")
+    outScript.write("echo finish\n") 
+    outScript.close();
+    os.system("chmod 777 "+outScriptName)
+
+if options.reduce:
+    for harness_range in harness_ranges:
+        harnessname = "IEta_%i_%i_IPhi_%i_%i"%(harness_range[0],harness_range[1],harness_range[2],harness_range[3])
+        if(options.verbosity>=1):
+            print(">>> Generating reduce job for harness "+harnessname)
+        jobdir = "%s/%s/reduce/"%(job_parent_folder,harnessname)
+        os.system("mkdir -p "+jobdir)
+        outdir = "%s/%s/"%(options.outdir,harnessname)
+        inputfilenames = ["%s/out_file_%i_scalemonitoring.root"%(outdir,iFile) for iFile in range(0,len(selected_filelist))]
+        cfgfilename = jobdir+"/config.cfg"
+        WriteReduceConfig(cfgfilename,harness_range,inputfilenames,outdir+"/out_merged_scalemonitoring.root",outdir)
+        WriteReduceScript(jobdir+"/reduce.sh",cfgfilename)
 
 #generate condor multijob submitfile for each task
 condorsubFilename=job_parent_folder+"/submit_jobs.sub"
@@ -158,14 +297,46 @@ condorsub.write("log                   = "+job_parent_folder+"/log/log.$(Cluster
 condorsub.write('+JobFlavour           = '+options.condor_queue+'\n')
 if options.tier0:
     condorsub.write('+AccountingGroup      = "group_u_CMS.CAF.ALCA"\n')
-if 'buildTemplate' in options.tasklist:
+if options.multiHarness:
+    condorsub.write("queue scriptname matching "+job_parent_folder+"/multiharness/job_file_*/*.sh\n")
+elif 'buildTemplate' in options.tasklist:
     condorsub.write("queue scriptname matching "+job_parent_folder+"/IEta_*_*/job_file_*/*.sh\n")
 else:
     condorsub.write("queue scriptname matching "+job_parent_folder+"/IEta_*_*_IPhi_*_*/job_file_*/*.sh\n")
 condorsub.close()
 
 submit_command = "condor_submit "+condorsubFilename
+
+#with --reduce the monitoring jobs and the reduce jobs are the two nodes of a DAG
+if options.reduce:
+    reducesubFilename=job_parent_folder+"/reduce_jobs.sub"
+    reducesub = open( reducesubFilename,"w")
+    reducesub.write("executable            = $(scriptname)\n")
+    reducesub.write("output                = $(scriptname).$(ClusterId).out\n")
+    reducesub.write("error                 = $(scriptname).$(ClusterId).err\n")
+    reducesub.write("log                   = "+job_parent_folder+"/log/log_reduce.$(ClusterId).log\n")
+    reducesub.write('+JobFlavour           = "espresso"\n')
+    if options.tier0:
+        reducesub.write('+AccountingGroup      = "group_u_CMS.CAF.ALCA"\n')
+    reducesub.write("queue scriptname matching "+job_parent_folder+"/IEta_*_*_IPhi_*_*/reduce/reduce.sh\n")
+    reducesub.close()
+
+    dagFilename=job_parent_folder+"/submit_manager.dag"
+    dagFile = open( dagFilename,"w")
+    dagFile.write("JOB monitoring "+condorsubFilename+"\n")
+    dagFile.write("JOB reduce "+reducesubFilename+"\n")
+    dagFile.write("PARENT monitoring CHILD reduce\n")
+    dagFile.write("Retry monitoring 3\n")
+    dagFile.write("Retry reduce 3\n")
+    dagFile.close()
+    submit_command = "condor_submit_dag "+dagFilename
+
 print("SUBMIT COMMAND: "+submit_command)
-#submit in case the option is given
-if(options.submit):
+print("ACCOUNTING REPORT (after the jobs): python "+jobAccounting.accounting_script+" report --jobdir "+job_parent_folder)
+#submit in case the option is given, or run the jobs on this machine
+if(options.local>0):
+    if options.reduce:
+        sys.exit(localExecutor.RunDag(dagFilename,options.local))
+    sys.exit(localExecutor.RunSubFile(condorsubFilename,options.local,3))
+elif(options.submit):
     os.system(submit_command)
@@ -0,0 +1,227 @@
+#!/bin/python
+import os
+import sys
+import re
+import json
+import time
+import socket
+import subprocess
+from optparse import OptionParser
+
+#############################################################################
+# resource accounting of the jobs generated by harness_monitoring.py and calibration.py
+# run:    the job scripts execute their commands through this script, which records for each command
+#         wall time, cpu time, peak RSS, bytes read, entries processed and exit code in a json sidecar next to the script
+#         (<script>.acct.json, one step per command); the output of the command is forwarded unchanged
+#         and the exit code of the command is returned, so that the scripts behave the same under condor and localExecutor
+# report: collect the sidecars of a job folder, rank the slowest jobs and report the events/s of each executable
+#         and the throughput spread over the campaign
+#############################################################################
+
+#entries printed by the executables before looping on the trees, e.g. "123456 total entries", "123456 entries"
+#the loops of a step run on the same input (e.g. RunDivide and FillTimeBins) --> the entries of the step are the max, not the sum
+entries_regex = re.compile(r"(\d+) (?:total )?entries")
+accounting_script = os.path.abspath(__file__).replace(".pyc",".py")
+
+def GetSidecarName(scriptname):
+    return os.path.abspath(scriptname)+".acct.json"
+
+def AccountedCommand(command,scriptname,reset=False):
+    #command line of a job script running command with the accounting of this module
+    #reset=True on the first command of the script: the sidecar of a previous attempt is overwritten
+    return "python "+accounting_script+" run --json "+GetSidecarName(scriptname)+(" --reset" if reset else "")+" -- "+command
+
+def ReadIOBytes():
+    #bytes read by this process and by its reaped children (local files, xrootd, pipes)
+    try:
+        with open("/proc/self/io") as iofile:
+            for line in iofile:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+def RunCommand(command,sidecarname,reset):
+    io_start = ReadIOBytes()
+    start = time.time()
+    try:
+        process = subprocess.Popen(command,stdout=subprocess.PIPE)
+    except OSError as error:
+        print("[ERROR]: can't execute "+" ".join(command)+": "+str(error))
+        return 127
+    #forward the output as it comes (progress lines end with \r) and read the entries
+    entries = 0
+    forwarded = 0
+    buffer = ""
+    while True:
+        chunk = os.read(process.stdout.fileno(),65536)
+        if chunk=="":
+            break
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+        forwarded += len(chunk)
+        buffer += chunk
+        lines = re.split(r"[\r\n]",buffer)
+        buffer = lines.pop()
+        for line in lines:
+            match = entries_regex.search(line)
+            if match:
+                entries = max(entries,int(match.group(1)))
+    match = entries_regex.search(buffer)
+    if match:
+        entries = max(entries,int(match.group(1)))
+    pid,status,rusage = os.wait4(process.pid,0)
+    wall = time.time()-start
+    if os.WIFSIGNALED(status):
+        exitcode = -os.WTERMSIG(status)
+    else:
+        exitcode = os.WEXITSTATUS(status)
+    io_end = ReadIOBytes()
+    if io_start is not None and io_end is not None:
+        input_bytes = io_end-io_start-forwarded
+    else:
+        input_bytes = rusage.ru_inblock*512
+
+    step = {"executable": os.path.basename(command[0]),
+            "command": " ".join(command),
+            "host": socket.gethostname(),
+            "batch": "condor" if "_CONDOR_SCRATCH_DIR" in os.environ else "local",
+            "start": start,
+            "wall_time": wall,
+            "cpu_time": rusage.ru_utime+rusage.ru_stime,
+            "peak_rss_MB": rusage.ru_maxrss/1024.,
+            "input_bytes": input_bytes,
+            "entries": entries,
+            "exit_code": exitcode}
+
+    sidecar = {"script": sidecarname[:-len(".acct.json")], "steps": []}
+    if not reset and os.path.isfile(sidecarname):
+        try:
+            with open(sidecarname) as infile:
+                sidecar = json.load(infile)
+        except ValueError:
+            print("[WARNING]: corrupted accounting file "+sidecarname+" --> overwritten")
+    sidecar["steps"].append(step)
+    with open(sidecarname+".tmp","w") as outfile:
+        json.dump(sidecar,outfile,indent=1)
+    os.rename(sidecarname+".tmp",sidecarname)
+    return exitcode
+
+def LoadJobs(jobdir):
+    #one record per job script: the steps are summed, the exit code is the first non-zero one
+    jobs = []
+    for root,dirs,files in os.walk(jobdir):
+        for filename in files:
+            if not filename.endswith(".acct.json"):
+                continue
+            try:
+                with open(os.path.join(root,filename)) as infile:
+                    sidecar = json.load(infile)
+            except ValueError:
+                print("[WARNING]: can't read "+os.path.join(root,filename))
+                continue
+            steps = sidecar["steps"]
+            if len(steps)==0:
+                continue
+            job = {"script": os.path.relpath(sidecar["script"],jobdir),
+                   "executable": max(steps,key=lambda step:step["wall_time"])["executable"],
+                   "host": steps[0]["host"],
+                   "batch": steps[0]["batch"]}
+            for key in ["wall_time","cpu_time","input_bytes","entries"]:
+                job[key] = sum(step[key] for step in steps)
+            job["peak_rss_MB"] = max(step["peak_rss_MB"] for step in steps)
+            job["exit_code"] = ([step["exit_code"] for step in steps if step["exit_code"]!=0]+[0])[0]
+            job["steps"] = steps
+            jobs.append(job)
+    return jobs
+
+def Quantile(values,q):
+    values = sorted(values)
+    if len(values)==0:
+        return 0.
+    position = q*(len(values)-1)
+    low = int(position)
+    high = min(low+1,len(values)-1)
+    return values[low]+(values[high]-values[low])*(position-low)
+
+def GetRateSummary(rates):
+    summary = {"N": len(rates)}
+    for name,q in [("min",0.),("p10",0.1),("median",0.5),("p90",0.9),("max",1.)]:
+        summary[name] = Quantile(rates,q)
+    summary["p90/p10"] = summary["p90"]/summary["p10"] if summary["p10"]>0 else 0.
+    return summary
+
+def Report(jobdir,Nslowest,jsonfilename):
+    jobs = LoadJobs(jobdir)
+    if len(jobs)==0:
+        print("[ERROR]: no accounting file found in "+jobdir)
+        return 1
+    failed = [job for job in jobs if job["exit_code"]!=0]
+    print("----------------------------------------------------------------------------------")
+    print("%i jobs with accounting in %s (%i failed)"%(len(jobs),jobdir,len(failed)))
+    print("total wall time %.1f h, total cpu time %.1f h"%(sum(job["wall_time"] for job in jobs)/3600.,sum(job["cpu_time"] for job in jobs)/3600.))
+
+    print("----------------------------------------------------------------------------------")
+    print("%i slowest jobs"%min(Nslowest,len(jobs)))
+    print("%10s %8s %9s %10s %12s %10s %5s  %s"%("wall [s]","cpu/wall","RSS [MB]","read [MB]","entries","ev/s","exit","script"))
+    for job in sorted(jobs,key=lambda job:job["wall_time"],reverse=True)[:Nslowest]:
+        print("%10.1f %8.2f %9.0f %10.1f %12i %10.0f %5i  %s"%(
+            job["wall_time"],job["cpu_time"]/job["wall_time"] if job["wall_time"]>0 else 0.,job["peak_rss_MB"],
+            job["input_bytes"]/1e6,job["entries"],job["entries"]/job["wall_time"] if job["wall_time"]>0 else 0.,
+            job["exit_code"],job["script"]))
+
+    #throughput of each executable: only the successful steps which processed entries
+    executables = {}
+    for job in jobs:
+        for step in job["steps"]:
+            if step["exit_code"]==0 and step["entries"]>0 and step["wall_time"]>0:
+                executables.setdefault(step["executable"],[]).append(step)
+    summary = {"Njobs": len(jobs), "Nfailed": len(failed), "executables": {}}
+    print("----------------------------------------------------------------------------------")
+    print("throughput per executable (events/s of the single jobs)")
+    print("%-28s %6s %12s %10s %10s %10s %10s %8s %9s"%("executable","jobs","entries","total ev/s","p10","median","p90","p90/p10","RSS [MB]"))
+    all_rates = []
+    for executable in sorted(executables.keys()):
+        steps = executables[executable]
+        rates = [step["entries"]/step["wall_time"] for step in steps]
+        all_rates.extend(rates)
+        rate_summary = GetRateSummary(rates)
+        rate_summary["entries"] = sum(step["entries"] for step in steps)
+        rate_summary["total_rate"] = rate_summary["entries"]/sum(step["wall_time"] for step in steps)
+        rate_summary["max_peak_rss_MB"] = max(step["peak_rss_MB"] for step in steps)
+        summary["executables"][executable] = rate_summary
+        print("%-28s %6i %12i %10.0f %10.0f %10.0f %10.0f %8.2f %9.0f"%(
+            executable,rate_summary["N"],rate_summary["entries"],rate_summary["total_rate"],
+            rate_summary["p10"],rate_summary["median"],rate_summary["p90"],rate_summary["p90/p10"],rate_summary["max_peak_rss_MB"]))
+    if len(all_rates)>0:
+        summary["campaign"] = GetRateSummary(all_rates)
+        print("----------------------------------------------------------------------------------")
+        print("campaign throughput spread: min %.0f, p10 %.0f, median %.0f, p90 %.0f, max %.0f events/s (p90/p10 = %.2f)"%(
+            summary["campaign"]["min"],summary["campaign"]["p10"],summary["campaign"]["median"],
+            summary["campaign"]["p90"],summary["campaign"]["max"],summary["campaign"]["p90/p10"]))
+    print("----------------------------------------------------------------------------------")
+    if jsonfilename!="":
+        summary["slowest"] = [dict((key,job[key]) for key in job if key!="steps") for job in sorted(jobs,key=lambda job:job["wall_time"],reverse=True)[:Nslowest]]
+        with open(jsonfilename,"w") as outfile:
+            json.dump(summary,outfile,indent=1)
+        print(">> summary saved in "+jsonfilename)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog run --json <sidecar> [--reset] -- <command>\n       %prog report --jobdir <jobs/label/> [-n N] [--output summary.json]")
+    parser.add_option("--json",      action="store",      type="str", dest="json",   default="",  help="run: json sidecar of the job")
+    parser.add_option("--reset",     action="store_true",             dest="reset",  default=False, help="run: overwrite the sidecar instead of appending the step")
+    parser.add_option("--jobdir",    action="store",      type="str", dest="jobdir", default="",  help="report: job folder (jobs/<label>/)")
+    parser.add_option("-n", "--Nslowest", action="store", type="int", dest="Nslowest", default=20, help="report: number of slowest jobs listed")
+    parser.add_option("-o", "--output", action="store",   type="str", dest="output", default="",  help="report: save the summary in this json file")
+    parser.disable_interspersed_args()
+    mode = sys.argv[1] if len(sys.argv)>1 else ""
+    (options, args) = parser.parse_args(sys.argv[2:])
+    if mode=="run" and options.json!="" and len(args)>0:
+        sys.exit(RunCommand(args,options.json,options.reset))
+    elif mode=="report" and options.jobdir!="":
+        sys.exit(Report(options.jobdir,options.Nslowest,options.output))
+    parser.print_help()
+    sys.exit(1)
@@ -0,0 +1,269 @@
+#!/bin/python
+import os
+import glob
+import sys
+import time
+import datetime
+import subprocess
+import threading
+import Queue
+from optparse import OptionParser
+
+
+#############################################################################
+# local execution of the condor submit files and DAGs generated by the job scripts
+# every node of the DAG is the cluster of jobs of its .sub file: a node starts when all its parents succeeded
+# and its jobs run on a pool of Nprocesses workers shared by all the nodes ready to run
+# supported: JOB [DONE], PARENT ... CHILD ..., Retry <node> <N> [UNLESS-EXIT <code>], ABORT-DAG-ON <node> <code> [RETURN <code>]
+# submit files: executable, arguments, output, error and queue [N] / queue <var> matching <globs or ( list )> / queue <var> from <file>
+#############################################################################
+
+def ReadLogicalLines(filename):
+    #lines ending with a backslash continue on the next line (as in condor submit files)
+    lines = []
+    current = ""
+    with open(filename) as infile:
+        for line in infile:
+            line = line.strip()
+            if line.endswith("\\"):
+                current += line[:-1]+" "
+                continue
+            current += line
+            if current.strip()!="" and not current.strip().startswith("#"):
+                lines.append(current.strip())
+            current = ""
+    if current.strip()!="":
+        lines.append(current.strip())
+    return lines
+
+def ExpandMacros(value,macros):
+    for name,macrovalue in macros.items():
+        value = value.replace("$("+name+")",macrovalue)
+    return value
+
+def ParseSubFile(subfilename):
+    #return the list of jobs of the submit file: each job is a dict with cmd, output, error
+    commands = {}
+    jobs = []
+    for line in ReadLogicalLines(subfilename):
+        if line.lower().startswith("queue"):
+            tokens = line.split()
+            if len(tokens)>=3 and tokens[2].lower()=="matching":
+                #queue <var> matching <items>: each item is a glob, optionally enclosed in ( )
+                items = [item for item in tokens[3:] if item not in ["(",")"]]
+                items = [item.strip("()") for item in items]
+                values = []
+                for item in items:
+                    matches = sorted(glob.glob(item))
+                    values.extend(matches if len(matches)>0 else ([] if any(c in item for c in "*?[") else [item]))
+                macros_list = [{tokens[1]:value} for value in values]
+            elif len(tokens)>=4 and tokens[2].lower()=="from":
+                #queue <var> from <file>: one value per line
+                with open(tokens[3]) as valuesfile:
+                    macros_list = [{tokens[1]:value.strip()} for value in valuesfile if value.strip()!=""]
+            elif len(tokens)>=2:
+                macros_list = [{"Process":str(iproc)} for iproc in range(0,int(tokens[1]))]
+            else:
+                macros_list = [{"Process":"0"}]
+            for macros in macros_list:
+                macros["ClusterId"] = "local"
+                macros.setdefault("Process","0")
+                executable = ExpandMacros(commands.get("executable",""),macros)
+                arguments = ExpandMacros(commands.get("arguments",""),macros)
+                output = ExpandMacros(commands.get("output",executable+".local.out"),macros)
+                error = ExpandMacros(commands.get("error",executable+".local.err"),macros)
+                jobs.append({"cmd":[executable]+arguments.split(), "output":output, "error":error})
+            continue
+        if "=" in line:
+            key,value = line.split("=",1)
+            commands[key.strip().lower()] = value.strip().strip('"')
+    return jobs
+
+def ParseDagFile(dagfilename):
+    #return the nodes (name -> submit file, in the DAG order), the parents of each node, the retries, the abort conditions
+    #and the nodes already done (JOB <node> <file> DONE, as in the rescue DAGs)
+    nodes = []
+    subfiles = {}
+    done = set()
+    parents = {}
+    retries = {}
+    aborts = {}
+    for line in ReadLogicalLines(dagfilename):
+        tokens = line.split()
+        keyword = tokens[0].upper()
+        if keyword=="JOB":
+            nodes.append(tokens[1])
+            subfiles[tokens[1]] = tokens[2]
+            parents.setdefault(tokens[1],set())
+            if len(tokens)>=4 and tokens[3].upper()=="DONE":
+                done.add(tokens[1])
+        elif keyword=="PARENT":
+            ichild = [token.upper() for token in tokens].index("CHILD")
+            for child in tokens[ichild+1:]:
+                parents.setdefault(child,set()).update(tokens[1:ichild])
+        elif keyword=="RETRY":
+            unless_exit = None
+            if len(tokens)>=5 and tokens[3].upper()=="UNLESS-EXIT":
+                unless_exit = int(tokens[4])
+            retries[tokens[1]] = (int(tokens[2]),unless_exit)
+        elif keyword=="ABORT-DAG-ON":
+            return_value = int(tokens[2])
+            if len(tokens)>=5 and tokens[3].upper()=="RETURN":
+                return_value = int(tokens[4])
+            aborts[tokens[1]] = (int(tokens[2]),return_value)
+        else:
+            print("[WARNING]: DAG keyword "+tokens[0]+" not supported by the local executor --> ignored")
+    for node in parents:
+        for parent in parents[node]:
+            if parent not in subfiles:
+                print("[ERROR]: unknown DAG node "+parent)
+                sys.exit(1)
+    return nodes,subfiles,parents,retries,aborts,done
+
+def RunJob(job,nodename,ijob,results):
+    #run a single job with its stdout/stderr redirected to the files of the submit file
+    for logname in [job["output"],job["error"]]:
+        logdir = os.path.dirname(os.path.abspath(logname))
+        if not os.path.isdir(logdir):
+            os.makedirs(logdir)
+    start = time.time()
+    try:
+        with open(job["output"],"w") as out, open(job["error"],"w") as err:
+            returncode = subprocess.call(job["cmd"],stdout=out,stderr=err)
+    except OSError as error:
+        print("[ERROR]: can't execute "+" ".join(job["cmd"])+": "+str(error))
+        returncode = -1
+    results.put((nodename,ijob,returncode,time.time()-start))
+
+def RunDag(dagfilename,Nprocesses):
+    #run the DAG locally, return 0 if all the nodes succeeded (or the DAG was aborted with RETURN 0)
+    nodes,subfiles,parents,retries,aborts,done = ParseDagFile(dagfilename)
+    print(">> Running locally "+dagfilename+": "+str(len(nodes))+" nodes ("+str(len(done))+" already done) on "+str(Nprocesses)+" processes")
+    node_jobs = {}
+    for node in nodes:
+        node_jobs[node] = ParseSubFile(subfiles[node]) if node not in done else []
+
+    status = dict((node,"done" if node in done else "waiting") for node in nodes)
+    attempts = dict((node,0) for node in nodes)
+    pending = dict((node,0) for node in nodes)
+    failed_jobs = dict((node,[]) for node in nodes)
+    node_start = {}
+    node_time = {}
+    Njobs_total = sum(len(jobs) for jobs in node_jobs.values())
+    Njobs_done = [0]
+
+    results = Queue.Queue()
+    queued = []       #jobs waiting for a free worker
+    running = [0]
+    abort_return = [None]
+    start = time.time()
+
+    def Launch():
+        while running[0]<Nprocesses and len(queued)>0 and abort_return[0] is None:
+            nodename,ijob = queued.pop(0)
+            running[0] += 1
+            worker = threading.Thread(target=RunJob,args=(node_jobs[nodename][ijob],nodename,ijob,results))
+            worker.daemon = True
+            worker.start()
+
+    def StartNode(node,ijobs):
+        status[node] = "running"
+        attempts[node] += 1
+        node_start.setdefault(node,time.time())
+        failed_jobs[node] = []
+        pending[node] = len(ijobs)
+        if len(ijobs)==0:
+            FinishNode(node)
+            return
+        for ijob in ijobs:
+            queued.append((node,ijob))
+
+    def FinishNode(node):
+        if len(failed_jobs[node])==0:
+            status[node] = "done"
+            node_time[node] = time.time()-node_start[node]
+            return
+        Nretry,unless_exit = retries.get(node,(0,None))
+        exitcodes = [returncode for ijob,returncode in failed_jobs[node]]
+        if attempts[node]<=Nretry and not (unless_exit is not None and unless_exit in exitcodes):
+            print(">> node "+node+": "+str(len(exitcodes))+" failed jobs --> retry "+str(attempts[node])+"/"+str(Nretry))
+            StartNode(node,[ijob for ijob,returncode in failed_jobs[node]])
+        else:
+            status[node] = "failed"
+            node_time[node] = time.time()-node_start[node]
+            print("[ERROR]: node "+node+" failed (exit codes "+str(sorted(set(exitcodes)))+")")
+
+    def ScheduleReady():
+        #nodes without jobs finish immediately and can make other nodes ready
+        ready = True
+        while ready:
+            ready = False
+            for node in nodes:
+                if status[node]=="waiting" and all(status[parent]=="done" for parent in parents[node]):
+                    StartNode(node,range(0,len(node_jobs[node])))
+                    ready = True
+
+    ScheduleReady()
+    Launch()
+    while running[0]>0:
+        nodename,ijob,returncode,jobtime = results.get()
+        running[0] -= 1
+        Njobs_done[0] += 1
+        if nodename in aborts and returncode==aborts[nodename][0] and abort_return[0] is None:
+            print(">> node "+nodename+" exited with "+str(returncode)+" --> ABORT-DAG-ON: stop the DAG")
+            abort_return[0] = aborts[nodename][1]
+            status[nodename] = "aborted"
+            del queued[:]
+        if returncode!=0:
+            failed_jobs[nodename].append((ijob,returncode))
+        pending[nodename] -= 1
+        if pending[nodename]==0 and abort_return[0] is None:
+            FinishNode(nodename)
+            ScheduleReady()
+        Launch()
+        PrintProgress(status,Njobs_done[0],Njobs_total,running[0],len(queued),time.time()-start)
+
+    print("")
+    PrintSummary(nodes,status,attempts,node_jobs,node_time,time.time()-start)
+    if abort_return[0] is not None:
+        return abort_return[0]
+    if all(status[node]=="done" for node in nodes):
+        return 0
+    return 1
+
+def RunSubFile(subfilename,Nprocesses,Nretry=0):
+    #a single submit file is a DAG with a single node
+    dagfilename = subfilename.replace(".sub","")+"_local.dag"
+    with open(dagfilename,"w") as dagfile:
+        dagfile.write("JOB jobs "+os.path.abspath(subfilename)+"\n")
+        if Nretry>0:
+            dagfile.write("Retry jobs "+str(Nretry)+"\n")
+    return RunDag(dagfilename,Nprocesses)
+
+def PrintProgress(status,Njobs_done,Njobs_total,Nrunning,Nqueued,elapsed):
+    Nnodes_done = len([node for node in status if status[node]=="done"])
+    Nnodes_failed = len([node for node in status if status[node]=="failed"])
+    sys.stdout.write("\r>> jobs %i/%i finished, %i running, %i queued | nodes %i/%i done, %i failed | %s"%(
+        Njobs_done,Njobs_total,Nrunning,Nqueued,Nnodes_done,len(status),Nnodes_failed,str(datetime.timedelta(seconds=int(elapsed)))))
+    sys.stdout.flush()
+
+def PrintSummary(nodes,status,attempts,node_jobs,node_time,elapsed):
+    print("----------------------------------------------------------------------------------")
+    print("%-45s %-8s %6s %8s %10s"%("node","status","jobs","attempts","time [s]"))
+    for node in nodes:
+        print("%-45s %-8s %6i %8i %10.1f"%(node,status[node],len(node_jobs[node]),attempts[node],node_time.get(node,0.)))
+    print("total time "+str(datetime.timedelta(seconds=int(elapsed))))
+    print("----------------------------------------------------------------------------------")
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options] <file.dag or file.sub>")
+    parser.add_option("-j", "--Nprocesses", action="store", type="int", dest="Nprocesses", default=4, help="number of jobs running in parallel")
+    parser.add_option("--retry",            action="store", type="int", dest="retry",      default=0, help="retries of the failed jobs of a .sub file (DAGs use their Retry)")
+    (options, args) = parser.parse_args()
+    if len(args)!=1:
+        parser.print_help()
+        sys.exit(1)
+    if args[0].endswith(".sub"):
+        sys.exit(RunSubFile(args[0],options.Nprocesses,options.retry))
+    sys.exit(RunDag(args[0],options.Nprocesses))
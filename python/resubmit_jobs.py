@@ -1,53 +1,349 @@
 #!/bin/python
 import os
 import glob
+import re
+import sys
+import multiprocessing
 from optparse import OptionParser
-import harness_definition
+import localExecutor
+
+#############################################################################
+# check the outputs of the jobs generated by harness_monitoring.py and calibration.py and resubmit the failed ones
+# the jobs and their outputs are discovered from the job folder: every .sh script is parsed to get the files it writes
+#   LaserMonitoring.exe --cfg <cfg> <tasks>     --> output of each task in the cfg (harness tokens expanded with the harness map)
+#   <task>.exe ... --<task>_output <file>       --> BuildEopEta/ComputeIC outputs (_odd and _even with --oddeven)
+#   SkimCalibration.exe ... --output <file>     --> calibration skim
+#   hadd -f -k <file> ...                       --> merged outputs of the calibration loops
+# an output is valid if it is not empty and it can be opened with at least one readable key (a TTree for LaserMonitoring)
+# job folders with a DAG (calibration loops, monitoring with --reduce) are resubmitted as a rescue DAG keeping the dependencies:
+#   a node is DONE if the outputs of all its jobs are valid and all its parents are DONE, the other nodes run again in the DAG order
+#   the nodes with all the parents DONE run only their failed jobs
+#   the loops after the one where the ICs converged (--finalLoop file of CheckICConvergence) are not run
+#############################################################################
+
+#task option of LaserMonitoring.exe --> cfg block with the output of the task
+laser_monitoring_outputs = {"buildTemplate":"BuildTemplate", "runDivide":"RunDivide", "scaleMonitor":"scaleMonitor", "merge":"merge"}
+
+def ParseCfgOutputs(cfgfilename):
+    #return {block name: output} of the LaserMonitoring blocks and the harness map (if any)
+    outputs = {}
+    harnessmap = ""
+    blocks = []
+    with open(cfgfilename) as cfgfile:
+        for line in cfgfile:
+            line = line.split("#")[0].strip()
+            if line=="":
+                continue
+            if line.startswith("</"):
+                if len(blocks)>0:
+                    blocks.pop()
+                continue
+            if line.startswith("<"):
+                blocks.append(line.strip("<>").strip())
+                continue
+            tokens = line.split()
+            if len(tokens)<2:
+                continue
+            if tokens[0]=="harnessmap":
+                harnessmap = tokens[1].strip("'\"")
+            elif tokens[0]=="output" and len(blocks)>0:
+                outputs[blocks[-1]] = tokens[1].strip("'\"")
+    return outputs,harnessmap
+
+def ReadHarnessMap(harnessmapfilename):
+    harness_ranges = []
+    with open(harnessmapfilename) as harnessmapfile:
+        for line in harnessmapfile:
+            if len(line.split())==4:
+                harness_ranges.append([int(token) for token in line.split()])
+    return harness_ranges
+
+def ExpandHarnessTokens(filename,harnessmap):
+    #multi-harness jobs write one output per harness
+    if not "IETAMIN" in filename:
+        return [filename]
+    filenames = []
+    for ietamin,ietamax,iphimin,iphimax in ReadHarnessMap(harnessmap):
+        filenames.append(filename.replace("IETAMIN",str(ietamin)).replace("IETAMAX",str(ietamax)).replace("IPHIMIN",str(iphimin)).replace("IPHIMAX",str(iphimax)))
+    return filenames
+
+def GetOptionValue(tokens,option):
+    if option in tokens and tokens.index(option)+1<len(tokens):
+        return tokens[tokens.index(option)+1]
+    return None
+
+def GetExpectedOutputs(scriptname):
+    #return the list of (filename, requiretree) written by the script
+    outputs = []
+    with open(scriptname) as script:
+        for line in script:
+            tokens = line.split()
+            if len(tokens)>=2 and os.path.basename(tokens[1]).startswith("jobAccounting.py") and "--" in tokens:
+                #command run through the resource accounting
+                tokens = tokens[tokens.index("--")+1:]
+            if len(tokens)==0:
+                continue
+            exename = os.path.basename(tokens[0])
+            if exename=="LaserMonitoring.exe":
+                cfgoutputs,harnessmap = ParseCfgOutputs(GetOptionValue(tokens,"--cfg"))
+                for task,block in laser_monitoring_outputs.items():
+                    if "--"+task in tokens and block in cfgoutputs:
+                        outputs.extend([(filename,task!="buildTemplate") for filename in ExpandHarnessTokens(cfgoutputs[block],harnessmap)])
+            elif exename=="SkimCalibration.exe":
+                outputs.append((GetOptionValue(tokens,"--output"),True))
+            elif exename.endswith(".exe"):
+                output = GetOptionValue(tokens,"--"+exename.replace(".exe","")+"_output")
+                if output is None:
+                    continue
+                if "--oddeven" in tokens:
+                    outputs.extend([(output.replace(".root","_"+split+".root"),False) for split in ["odd","even"]])
+                else:
+                    outputs.append((output,False))
+            elif exename=="hadd":
+                #hadd [-f] [-k] ... <target> <sources>
+                options_end = 1
+                while options_end<len(tokens) and tokens[options_end].startswith("-"):
+                    options_end += 1
+                if options_end<len(tokens):
+                    outputs.append((tokens[options_end],False))
+    return outputs
+
+def FindScripts(jobdir):
+    #monitoring: <jobdir>/IEta_*/job_file_*/*.sh, <jobdir>/multiharness/job_file_*/*.sh, <jobdir>/IEta_*/reduce/*.sh
+    #calibration: <jobdir>/job_*/*.sh and <jobdir>/*.sh (merges), the partial merges in <jobdir>/*/ too
+    scripts = []
+    for pattern in ["*.sh","*/*.sh","*/*/*.sh"]:
+        scripts.extend(glob.glob(os.path.join(jobdir,pattern)))
+    return sorted(set(scripts))
+
+def ValidateOutput(output):
+    #executed by the pool of workers: return (filename, error message or "")
+    filename,requiretree = output
+    try:
+        if os.path.getsize(filename)==0:
+            return filename,"empty file"
+    except OSError:
+        return filename,"missing"
+    import ROOT
+    ROOT.gErrorIgnoreLevel = ROOT.kFatal
+    rootfile = ROOT.TFile.Open(filename)
+    if not rootfile or rootfile.IsZombie():
+        return filename,"can't be opened"
+    error = ""
+    if rootfile.TestBit(ROOT.TFile.kRecovered):
+        error = "recovered (not closed properly)"
+    keys = rootfile.GetListOfKeys()
+    if error=="" and (not keys or keys.GetSize()==0):
+        error = "no keys"
+    if error=="":
+        trees = [key for key in keys if key.GetClassName() in ["TTree","TNtuple"]]
+        if requiretree and len(trees)==0:
+            error = "no tree"
+        else:
+            key = trees[0] if len(trees)>0 else keys.At(0)
+            obj = key.ReadObj()
+            if not obj:
+                error = "key "+key.GetName()+" not readable"
+            elif obj.InheritsFrom("TTree") and obj.GetEntries()<0:
+                error = "tree "+key.GetName()+" not readable"
+    rootfile.Close()
+    return filename,error
+
+def ValidateOutputs(outputs,Nworkers):
+    #the checks run in a bounded pool of worker processes (ROOT I/O does not release the python GIL)
+    pool = multiprocessing.Pool(max(1,min(Nworkers,len(outputs))))
+    results = dict(pool.map(ValidateOutput,outputs,chunksize=max(1,len(outputs)/(4*Nworkers))))
+    pool.close()
+    pool.join()
+    return results
+
+def PrintErrors(scriptnames):
+    if options.verbosity>=1:
+        for scriptname in sorted(set(scriptnames)):
+            for filename,error in script_errors[scriptname]:
+                print "%s: %s (%s)"%(os.path.relpath(scriptname,job_parent_folder),filename,error)
+
+def GetLoop(node):
+    match = re.search(r"_loop_(\d+)",node)
+    return int(match.group(1)) if match else None
+
+def ReadFinalLoop(scriptnames):
+    #return the loop where the ICs converged (None if not converged) and the --finalLoop file of the convergence checks
+    for scriptname in scriptnames:
+        with open(scriptname) as script:
+            for line in script:
+                finalloopfilename = GetOptionValue(line.split(),"--finalLoop")
+                if finalloopfilename is None:
+                    continue
+                if os.path.isfile(finalloopfilename):
+                    with open(finalloopfilename) as finalloopfile:
+                        tokens = finalloopfile.read().split()
+                    if len(tokens)>0:
+                        return int(tokens[0]),finalloopfilename
+                return None,finalloopfilename
+    return None,None
+
+def WriteNodeSubFile(subfilename,scriptnames,node):
+    #submit file of the node running only the given scripts, None if the node does not queue one job per script
+    lines = localExecutor.ReadLogicalLines(subfilename)
+    if not any(line.replace(" ","")=="executable=$(scriptname)" for line in lines):
+        return None
+    listfilename = job_parent_folder+"/resubmit_"+node+"_list.txt"
+    with open(listfilename,"w") as listfile:
+        for scriptname in scriptnames:
+            listfile.write(scriptname+"\n")
+    nodesubfilename = job_parent_folder+"/resubmit_"+node+".sub"
+    with open(nodesubfilename,"w") as nodesub:
+        for line in lines:
+            if not line.lower().startswith("queue"):
+                nodesub.write(line+"\n")
+        nodesub.write("queue scriptname from "+listfilename+"\n")
+    return nodesubfilename
+
+def WriteRescueDag(dagfilename,failed_scripts):
+    #write the rescue DAG of the job folder, return its name (None if all the nodes are done)
+    nodes,subfiles,parents,retries,aborts,done_nodes = localExecutor.ParseDagFile(dagfilename)
+    node_scripts = {}
+    for node in nodes:
+        node_scripts[node] = sorted(set([os.path.abspath(job["cmd"][0]) for job in localExecutor.ParseSubFile(subfiles[node])]))
+    children = dict((node,[child for child in nodes if node in parents[child]]) for node in nodes)
+    finalloop,finalloopfilename = ReadFinalLoop([scriptname for node in nodes for scriptname in node_scripts[node] if node.startswith("checkConvergence")])
+
+    valid = {}
+    def IsValid(node):
+        #the nodes without outputs (convergence checks) succeeded if the DAG went on after them or if they stopped it
+        if not node in valid:
+            scripts = [scriptname for scriptname in node_scripts[node] if scriptname in script_outputs]
+            if len(scripts)>0:
+                valid[node] = all(not scriptname in failed_scripts for scriptname in scripts)
+            elif node.startswith("checkConvergence") and finalloop is not None and GetLoop(node)==finalloop:
+                valid[node] = True
+            else:
+                valid[node] = any(IsValid(child) for child in children[node])
+        return valid[node]
+
+    done = {}
+    def IsDone(node):
+        #the outputs of a node are stale if one of its parents runs again
+        if not node in done:
+            done[node] = IsValid(node) and all(IsDone(parent) for parent in parents[node])
+        return done[node]
+
+    skipped = []
+    if finalloop is not None:
+        checknode = "checkConvergence_loop_"+str(finalloop)
+        if checknode in nodes and IsDone(checknode):
+            skipped = [node for node in nodes if GetLoop(node)>finalloop]
+            print "ICs converged at loop %i (%s) --> %i nodes of the following loops not run"%(finalloop,finalloopfilename,len(skipped))
+        elif checknode in nodes:
+            #the convergence check runs again and writes the file only if the ICs converge again
+            print "[WARNING]: loop %i runs again, %s removed"%(finalloop,finalloopfilename)
+            os.remove(finalloopfilename)
+
+    PrintErrors([scriptname for node in nodes if not node in skipped for scriptname in node_scripts[node] if scriptname in failed_scripts])
+    torun = [node for node in nodes if not IsDone(node) and not node in skipped]
+    print "%i DAG nodes: %i done, %i skipped, %i to run"%(len(nodes),len(nodes)-len(torun)-len(skipped),len(skipped),len(torun))
+    if len(torun)==0:
+        return None
+
+    rescue_subfiles = {}
+    for node in torun:
+        failed = [scriptname for scriptname in node_scripts[node] if scriptname in failed_scripts]
+        if options.verbosity>=1:
+            print "  %-45s %i/%i jobs"%(node,len(failed) if all(IsDone(parent) for parent in parents[node]) else len(node_scripts[node]),len(node_scripts[node]))
+        #only the nodes ready to run can skip their valid jobs, the others have stale inputs
+        if all(IsDone(parent) for parent in parents[node]) and 0<len(failed)<len(node_scripts[node]):
+            nodesubfilename = WriteNodeSubFile(subfiles[node],failed,node)
+            if nodesubfilename is not None:
+                rescue_subfiles[node] = nodesubfilename
+
+    rescuedagfilename = job_parent_folder+"/resubmit_manager.dag"
+    with open(rescuedagfilename,"w") as rescuedag:
+        for line in localExecutor.ReadLogicalLines(dagfilename):
+            tokens = line.split()
+            if tokens[0].upper()=="JOB":
+                line = "JOB "+tokens[1]+" "+rescue_subfiles.get(tokens[1],tokens[2])
+                if IsDone(tokens[1]) or tokens[1] in skipped:
+                    line += " DONE"
+            rescuedag.write(line+"\n")
+    return rescuedagfilename
+
 #parse arguments
-parser = OptionParser()
+parser = OptionParser(usage="usage: %prog [options] --jobdir <jobs/label/>")
 parser.add_option('--submit',          action='store_true',             dest='submit',          default=False,      help='submit jobs')
-parser.add_option("--expectedoutput",  action="store",      type="str", dest="expectedoutput",                      help="expected output filename syntax (keywords are HARNESS and FILE)")
-parser.add_option("--Nfiles",          action="store",      type="int", dest="Nfile",           default=1,          help="number of output files for each harness (keywords are HARNESS and FILE)")
-parser.add_option("--condorsub",       action="store",      type="str", dest="condorsub",                           help="condor submission file")
-parser.add_option("--script",          action="store",      type="str", dest="script",                              help="script syntax")
-
+parser.add_option("--local",           action="store",      type="int", dest="local",           default=0,          help="run the failed jobs on this machine with the given number of parallel processes instead of submitting them")
+parser.add_option("--jobdir",          action="store",      type="str", dest="jobdir",                              help="job folder written by harness_monitoring.py or calibration.py (jobs/<label>/)")
+parser.add_option("-j", "--Nworkers",  action="store",      type="int", dest="Nworkers",        default=16,         help="number of outputs checked in parallel")
+parser.add_option("-q", "--queue",     action="store",      type="str", dest="condor_queue",    default="workday",  help="condor queue: espresso, longlunch, workday... (jobs without a DAG, the DAG nodes keep their submit files)")
+parser.add_option('--tier0',           action='store_true',             dest='tier0',           default=False,      help='submit to CAF queues (only if you are logged in lxplus-t0.cern.ch)')
+parser.add_option("--verbosity",       action="store",      type="int", dest="verbosity",       default=1,          help="verbosity level")
 (options, args) = parser.parse_args()
 
-missing_harness = []
-missing_scripts = []
-for harness_range in harness_definition.GetHarnessRanges():
-    etamin = harness_range[0]
-    etamax = harness_range[1]
-    phimin = harness_range[2]
-    phimax = harness_range[3]
-    harnessname = "IEta_%i_%i_IPhi_%i_%i"%(etamin,etamax,phimin,phimax)
-    for ifile in range(0,options.Nfile):
-        outfilename = options.expectedoutput.replace("HARNESS",harnessname).replace("FILE",str(ifile))
-        if not (os.path.isfile(outfilename)):
-            scriptname = options.script.replace("HARNESS",harnessname).replace("FILE",str(ifile))
-            missing_harness.append(harnessname)
-            missing_scripts.append(scriptname)
-
-if(len(missing_harness)==0):
+if options.jobdir is None or not os.path.isdir(options.jobdir):
+    parser.print_help()
+    sys.exit(1)
+job_parent_folder = os.path.abspath(options.jobdir)
+
+#discover the jobs and their outputs
+script_outputs = {}
+for scriptname in FindScripts(job_parent_folder):
+    outputs = GetExpectedOutputs(scriptname)
+    if len(outputs)>0:
+        script_outputs[scriptname] = outputs
+Ngroups = len(set(re.findall(r"job_file_(\d+)","\n".join(script_outputs.keys()))))
+all_outputs = sorted(set([output for outputs in script_outputs.values() for output in outputs]))
+print "%i jobs (%i file groups) writing %i outputs"%(len(script_outputs),Ngroups,len(all_outputs))
+if len(all_outputs)==0:
+    print "[ERROR]: no job found in "+job_parent_folder
+    sys.exit(1)
+
+#validate all the outputs at once
+results = ValidateOutputs(all_outputs,options.Nworkers)
+script_errors = {}
+for scriptname in sorted(script_outputs.keys()):
+    errors = [(filename,results[filename]) for filename,requiretree in script_outputs[scriptname] if results[filename]!=""]
+    if len(errors)>0:
+        script_errors[scriptname] = errors
+missing_scripts = sorted(script_errors.keys())
+
+#the jobs of a DAG are resubmitted in the DAG order
+dagFilename = job_parent_folder+"/submit_manager.dag"
+if os.path.isfile(dagFilename):
+    rescueDagFilename = WriteRescueDag(dagFilename,set(missing_scripts))
+    if rescueDagFilename is None:
+        print "all jobs succeded --> exit"
+        exit()
+    print "SUBMIT COMMAND: condor_submit_dag "+rescueDagFilename
+    if(options.local>0):
+        sys.exit(localExecutor.RunDag(rescueDagFilename,options.local))
+    elif options.submit:
+        os.system("condor_submit_dag "+rescueDagFilename)
+    exit()
+
+PrintErrors(missing_scripts)
+if(len(missing_scripts)==0):
     print "all jobs succeded --> exit"
     exit()
 
-else:
-    print "%i jobs to resubmit"%len(missing_harness)
-    print missing_harness
-    condorResubFilename = options.condorsub.replace(".sub","_resubmit.sub")
-    job_parent_folder = os.path.dirname(options.condorsub)
-    condorsub = open( condorResubFilename,"w")
-    condorsub.write("executable            = $(scriptname)\n")
-    condorsub.write("output                = $(scriptname).$(ClusterId).out\n")
-    condorsub.write("error                 = $(scriptname).$(ClusterId).err\n")
-    condorsub.write("log                   = "+job_parent_folder+"/log/log.$(ClusterId).log\n")
-    condorsub.write('+JobFlavour           = "workday"\n')
-    condorsub.write("queue scriptname matching ( \\ \n")
+print "%i jobs to resubmit"%len(missing_scripts)
+#one compact list of the scripts to resubmit, read by the submit file
+resubmitListFilename = job_parent_folder+"/resubmit_list.txt"
+with open(resubmitListFilename,"w") as resubmitList:
     for scriptname in missing_scripts:
-        condorsub.write("%s \\ \n"%scriptname)
-    condorsub.write(")\n")
-    condorsub.close()
-    print "SUBMIT COMMAND: condor_submit "+condorResubFilename
-    if options.submit:
-        os.system("condor_submit "+condorResubFilename)
+        resubmitList.write(scriptname+"\n")
+condorResubFilename = job_parent_folder+"/resubmit_jobs.sub"
+condorsub = open( condorResubFilename,"w")
+condorsub.write("executable            = $(scriptname)\n")
+condorsub.write("output                = $(scriptname).$(ClusterId).out\n")
+condorsub.write("error                 = $(scriptname).$(ClusterId).err\n")
+condorsub.write("log                   = "+job_parent_folder+"/log/log.$(ClusterId).log\n")
+condorsub.write('+JobFlavour           = "'+options.condor_queue.strip('"')+'"\n')
+if options.tier0:
+    condorsub.write('+AccountingGroup      = "group_u_CMS.CAF.ALCA"\n')
+condorsub.write("queue scriptname from "+resubmitListFilename+"\n")
+condorsub.close()
+print "SUBMIT COMMAND: condor_submit "+condorResubFilename
+if(options.local>0):
+    sys.exit(localExecutor.RunSubFile(condorResubFilename,options.local))
+elif options.submit:
+    os.system("condor_submit "+condorResubFilename)
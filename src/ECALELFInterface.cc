@@ -4,9 +4,26 @@
 #include "TList.h"
 #include "TFriendElement.h"
 #include "TROOT.h"
+#include "TEnv.h"
+#include "TLeaf.h"
 
 using namespace std;
 
+//branches read by the accessors, activated with RequireBranches when the branch pruning is on
+//event and seed are always active (run/ls/time lookups, isEB/isEE, seed and harness accessors)
+static const std::map<std::string, std::vector<std::string> > accessorbranches = {
+  {"event",    {"runNumber", "lumiBlock", "eventTime", "eventNumber"}},
+  {"seed",     {"etaSCEle", "xSeedSC", "ySeedSC"}},
+  {"energy",   {"energy_ECAL_ele", "rawEnergySCEle", "esEnergySCEle"}},
+  {"momentum", {"chargeEle", "phiEle", "pAtVtxGsfEle", "esEnergySCEle"}},
+  {"mass",     {"invMass_ECAL_ele"}},
+  {"rechits",  {"energyRecHitSCEle1", "XRecHitSCEle1", "YRecHitSCEle1", "ZRecHitSCEle1", "recoFlagRecHitSCEle1", "fracRecHitSCEle1",
+		"energyRecHitSCEle2", "XRecHitSCEle2", "YRecHitSCEle2", "ZRecHitSCEle2", "recoFlagRecHitSCEle2", "fracRecHitSCEle2"}},
+  {"ICenergy", {"energy_ECAL_ele", "rawEnergySCEle", "esEnergySCEle",
+		"energyRecHitSCEle1", "XRecHitSCEle1", "YRecHitSCEle1", "ZRecHitSCEle1", "recoFlagRecHitSCEle1", "fracRecHitSCEle1",
+		"energyRecHitSCEle2", "XRecHitSCEle2", "YRecHitSCEle2", "ZRecHitSCEle2", "recoFlagRecHitSCEle2", "fracRecHitSCEle2"}}
+};
+
 void ECALELFInterface::BranchSelected(TChain* chain)
 {
   chain->SetBranchAddress("runNumber",          &runNumber_);
@@ -58,10 +75,172 @@ void ECALELFInterface::BranchExtraCalib(TChain* chain)
 }
 
 
+//calibration skim written by SkimCalibration: one entry per selected electron
+//the skim variables are copied, event by event, in the slot 0 of the ECALELF variables, the slot 1 is left empty
+void ECALELFInterface::BranchSkim(TChain* chain)
+{
+  skim_=true;
+  for(int i=0;i<2;++i)
+  {
+    ERecHit_[i]=new std::vector<float>;
+    XRecHit_[i]=new std::vector<int>;
+    YRecHit_[i]=new std::vector<int>;
+    ZRecHit_[i]=new std::vector<int>;
+    recoFlagRecHit_[i]=new std::vector<int>;
+    fracRecHit_[i]=new std::vector<float>;
+  }
+  skimele_.XRecHit=0;
+  skimele_.YRecHit=0;
+  skimele_.ZRecHit=0;
+  skimele_.EfracRecHit=0;
+  skimele_.recoFlagRecHit=0;
+
+  chain->SetBranchAddress("entry",              &skimele_.entry);
+  chain->SetBranchAddress("runNumber",          &skimele_.runNumber);
+  chain->SetBranchAddress("lumiBlock",          &skimele_.lumiBlock);
+  chain->SetBranchAddress("eventTime",          &skimele_.eventTime);
+  chain->SetBranchAddress("eventNumber",        &skimele_.eventNumber);
+  chain->SetBranchAddress("chargeEle",          &skimele_.chargeEle);
+  chain->SetBranchAddress("xSeedSC",            &skimele_.xSeedSC);
+  chain->SetBranchAddress("ySeedSC",            &skimele_.ySeedSC);
+  chain->SetBranchAddress("etaSCEle",           &skimele_.etaSCEle);
+  chain->SetBranchAddress("phiEle",             &skimele_.phiEle);
+  chain->SetBranchAddress("rawEnergySCEle",     &skimele_.rawEnergySCEle);
+  chain->SetBranchAddress("energy_ECAL_ele",    &skimele_.energySCEle);
+  chain->SetBranchAddress("esEnergySCEle",      &skimele_.esEnergySCEle);
+  chain->SetBranchAddress("pAtVtxGsfEle",       &skimele_.pAtVtxGsfEle);
+  chain->SetBranchAddress("XRecHit",            &skimele_.XRecHit);
+  chain->SetBranchAddress("YRecHit",            &skimele_.YRecHit);
+  chain->SetBranchAddress("ZRecHit",            &skimele_.ZRecHit);
+  chain->SetBranchAddress("EfracRecHit",        &skimele_.EfracRecHit);
+  chain->SetBranchAddress("recoFlagRecHit",     &skimele_.recoFlagRecHit);
+}
+
+void ECALELFInterface::LoadSkimElectron()
+{
+  runNumber_         = skimele_.runNumber;
+  lumiBlock_         = skimele_.lumiBlock;
+  eventTime_         = skimele_.eventTime;
+  eventNumber_       = skimele_.eventNumber;
+  chargeEle_[0]      = skimele_.chargeEle;
+  xSeed_[0]          = skimele_.xSeedSC;
+  ySeed_[0]          = skimele_.ySeedSC;
+  etaSCEle_[0]       = skimele_.etaSCEle;
+  phiEle_[0]         = skimele_.phiEle;
+  rawEnergySCEle_[0] = skimele_.rawEnergySCEle;
+  energySCEle_[0]    = skimele_.energySCEle;
+  esEnergySCEle_[0]  = skimele_.esEnergySCEle;
+  pAtVtxGsfEle_[0]   = skimele_.pAtVtxGsfEle;
+  ERecHit_[0]->assign(skimele_.EfracRecHit->begin(), skimele_.EfracRecHit->end());
+  fracRecHit_[0]->assign(skimele_.EfracRecHit->size(), 1.);
+  XRecHit_[0]->assign(skimele_.XRecHit->begin(), skimele_.XRecHit->end());
+  YRecHit_[0]->assign(skimele_.YRecHit->begin(), skimele_.YRecHit->end());
+  ZRecHit_[0]->assign(skimele_.ZRecHit->begin(), skimele_.ZRecHit->end());
+  recoFlagRecHit_[0]->assign(skimele_.recoFlagRecHit->begin(), skimele_.recoFlagRecHit->end());
+}
+
+TTree* ECALELFInterface::BookSkimTree(const char* treename)
+{
+  skimele_.XRecHit        = new std::vector<short>;
+  skimele_.YRecHit        = new std::vector<short>;
+  skimele_.ZRecHit        = new std::vector<short>;
+  skimele_.EfracRecHit    = new std::vector<float>;
+  skimele_.recoFlagRecHit = new std::vector<short>;
+
+  TTree* skimtree = new TTree(treename,treename);
+  skimtree->Branch("entry",              &skimele_.entry);
+  skimtree->Branch("runNumber",          &skimele_.runNumber);
+  skimtree->Branch("lumiBlock",          &skimele_.lumiBlock);
+  skimtree->Branch("eventTime",          &skimele_.eventTime);
+  skimtree->Branch("eventNumber",        &skimele_.eventNumber);
+  skimtree->Branch("chargeEle",          &skimele_.chargeEle);
+  skimtree->Branch("xSeedSC",            &skimele_.xSeedSC);
+  skimtree->Branch("ySeedSC",            &skimele_.ySeedSC);
+  skimtree->Branch("etaSCEle",           &skimele_.etaSCEle);
+  skimtree->Branch("phiEle",             &skimele_.phiEle);
+  skimtree->Branch("rawEnergySCEle",     &skimele_.rawEnergySCEle);
+  skimtree->Branch("energy_ECAL_ele",    &skimele_.energySCEle);
+  skimtree->Branch("esEnergySCEle",      &skimele_.esEnergySCEle);
+  skimtree->Branch("pAtVtxGsfEle",       &skimele_.pAtVtxGsfEle);
+  skimtree->Branch("XRecHit",            &skimele_.XRecHit);
+  skimtree->Branch("YRecHit",            &skimele_.YRecHit);
+  skimtree->Branch("ZRecHit",            &skimele_.ZRecHit);
+  skimtree->Branch("EfracRecHit",        &skimele_.EfracRecHit);
+  skimtree->Branch("recoFlagRecHit",     &skimele_.recoFlagRecHit);
+  return skimtree;
+}
+
+void ECALELFInterface::FillSkimTree(TTree* skimtree, const Long64_t &entry, const Int_t &i)
+{
+  skimele_.entry          = entry;
+  skimele_.runNumber      = runNumber_;
+  skimele_.lumiBlock      = lumiBlock_;
+  skimele_.eventTime      = eventTime_;
+  skimele_.eventNumber    = eventNumber_;
+  skimele_.chargeEle      = chargeEle_[i];
+  skimele_.xSeedSC        = xSeed_[i];
+  skimele_.ySeedSC        = ySeed_[i];
+  skimele_.etaSCEle       = etaSCEle_[i];
+  skimele_.phiEle         = phiEle_[i];
+  skimele_.rawEnergySCEle = rawEnergySCEle_[i];
+  skimele_.energySCEle    = energySCEle_[i];
+  skimele_.esEnergySCEle  = esEnergySCEle_[i];
+  skimele_.pAtVtxGsfEle   = pAtVtxGsfEle_[i];
+  skimele_.XRecHit->clear();
+  skimele_.YRecHit->clear();
+  skimele_.ZRecHit->clear();
+  skimele_.EfracRecHit->clear();
+  skimele_.recoFlagRecHit->clear();
+  for(unsigned iRecHit=0; iRecHit<ERecHit_[i]->size(); ++iRecHit)
+  {
+    skimele_.XRecHit->push_back(XRecHit_[i]->at(iRecHit));
+    skimele_.YRecHit->push_back(YRecHit_[i]->at(iRecHit));
+    skimele_.ZRecHit->push_back(ZRecHit_[i]->at(iRecHit));
+    skimele_.EfracRecHit->push_back(ERecHit_[i]->at(iRecHit) * fracRecHit_[i]->at(iRecHit));
+    skimele_.recoFlagRecHit->push_back(recoFlagRecHit_[i]->at(iRecHit));
+  }
+  skimtree->Fill();
+}
+
 ECALELFInterface::ECALELFInterface(CfgManager conf):
   eeRing_(0),
-  selection_(0)
+  selection_(0),
+  branchpruning_(true),
+  branchespruned_(false),
+  cachesize_(-1),
+  cachelearnentries_(-1),
+  prefetch_(false),
+  skim_(false)
 {
+  skimele_.XRecHit=0;
+  skimele_.YRecHit=0;
+  skimele_.ZRecHit=0;
+  skimele_.EfracRecHit=0;
+  skimele_.recoFlagRecHit=0;
+
+  //-------------------------------------
+  //read-ahead cache of the chains: size in MB (0 disables it), entries used to learn the branches to cache, asynchronous prefetching
+  //the prefetching must be enabled before the caches are created, i.e. before the first file is loaded
+  if(conf.OptExist("Input.cacheSize"))
+    cachesize_ = conf.GetOpt<float> ("Input.cacheSize");
+  if(conf.OptExist("Input.cacheLearnEntries"))
+    cachelearnentries_ = conf.GetOpt<int> ("Input.cacheLearnEntries");
+  if(conf.OptExist("Input.prefetch"))
+    prefetch_ = conf.GetOpt<bool> ("Input.prefetch");
+  if(prefetch_)
+    gEnv->SetValue("TFile.AsyncPrefetching", 1);
+  if(cachelearnentries_>0)
+    TTreeCache::SetLearnEntries(cachelearnentries_);
+
+  //-------------------------------------
+  //branch pruning: only the branches used by the selection, by the variables and by the accessors required
+  //with RequireBranches (plus Input.activeBranches) are read, the others are disabled at the first GetEntry
+  if(conf.OptExist("Input.branchPruning"))
+    branchpruning_ = conf.GetOpt<bool> ("Input.branchPruning");
+  RequireBranches({"event","seed"});
+  if(conf.OptExist("Input.activeBranches"))
+    RequireBranches( conf.GetOpt<std::vector<std::string> > ("Input.activeBranches") );
+
   //-------------------------------------
   //initialize chain and branch tree
   std::vector<std::string> treelist = conf.GetOpt<std::vector<std::string> >("Input.treelist");
@@ -77,7 +256,12 @@ ECALELFInterface::ECALELFInterface(CfgManager conf):
       if(treename=="extraCalibTree")
 	BranchExtraCalib(ch_[treename]);
       else
-	cerr<<"[WARNING]: unknown tree "<<treename<<endl;
+	if(treename=="calibskim")
+	  BranchSkim(ch_[treename]);
+	else
+	  cerr<<"[WARNING]: unknown tree "<<treename<<endl;
+    if(cachesize_>=0)
+      ch_[treename]->SetCacheSize( Long64_t(cachesize_*1024*1024) );
   }
 
   auto Nentries = ch_[treelist.at(0)]->GetEntries(); 
@@ -92,8 +276,14 @@ ECALELFInterface::ECALELFInterface(CfgManager conf):
   Ncurrtree_=1;
 
   //-------------------------------------
-  //load event selection
-  this->SetSelection( conf.GetOpt<string> ("Input.selection") );
+  //load event selection (already applied when the skim was produced)
+  if(skim_)
+  {
+    cout<<">>> Reading calibration skim: Input.selection already applied"<<endl;
+    this->SetSelection("1");
+  }
+  else
+    this->SetSelection( conf.GetOpt<string> ("Input.selection") );
 
   //-------------------------------------
   //initialize EEring
@@ -117,11 +307,32 @@ ECALELFInterface::~ECALELFInterface()
     if(customvariablesiterator.second)
       delete customvariablesiterator.second;
 
+  //in skim mode the rechit vectors of the ECALELF variables are owned by the interface
+  if(skim_)
+    for(int i=0;i<2;++i)
+    {
+      delete ERecHit_[i];
+      delete XRecHit_[i];
+      delete YRecHit_[i];
+      delete ZRecHit_[i];
+      delete recoFlagRecHit_[i];
+      delete fracRecHit_[i];
+    }
+  if(skimele_.XRecHit)        delete skimele_.XRecHit;
+  if(skimele_.YRecHit)        delete skimele_.YRecHit;
+  if(skimele_.ZRecHit)        delete skimele_.ZRecHit;
+  if(skimele_.EfracRecHit)    delete skimele_.EfracRecHit;
+  if(skimele_.recoFlagRecHit) delete skimele_.recoFlagRecHit;
 }
 
 Long64_t ECALELFInterface::GetEntry(const Long64_t &entry)
 {
+  StageTimer timer(profiler_, StageProfiler::kIO);
+  if(!branchespruned_)
+    PruneBranches();
   Long64_t i=chain_->GetEntry(entry);
+  if(skim_)
+    LoadSkimElectron();
   if(chain_->GetTreeNumber() != Ncurrtree_)
   {
     Ncurrtree_ = chain_->GetTreeNumber();
@@ -222,6 +433,7 @@ void ECALELFInterface::SetSelection(string selection_str)
     delete selection_;
   selection_str_ = selection_str;
   selection_ = new TTreeFormula("selection", selection_str_.c_str(), chain_);
+  AddFormulaBranches(selection_);
 } 
 
 
@@ -239,6 +451,7 @@ void ECALELFInterface::AddSelection(string additional_selection_str)
   }
 
   selection_ = new TTreeFormula("selection", selection_str_.c_str(), chain_);
+  AddFormulaBranches(selection_);
 } 
 
 void ECALELFInterface::PrintSettings()
@@ -273,12 +486,87 @@ void ECALELFInterface::PrintSettings()
   }
 
   cout<<"> APPLIED SELECTION: "<<selection_->GetExpFormula().Data()<<endl;
+  if(branchpruning_ && !skim_)
+    cout<<">>> BRANCH PRUNING: on ("<<requiredbranches_.size()<<" branches required so far)"<<endl;
+  else
+    cout<<">>> BRANCH PRUNING: off"<<endl;
+  if(cachesize_>=0)
+    cout<<">>> TTREECACHE SIZE: "<<cachesize_<<" MB"<<endl;
+  if(cachelearnentries_>0)
+    cout<<">>> TTREECACHE LEARN ENTRIES: "<<cachelearnentries_<<endl;
+  cout<<">>> PREFETCH: "<<(prefetch_ ? "on" : "off")<<endl;
   cout<<"----------------------------------------------------------------------------------"<<endl;
 }
 
 void ECALELFInterface::AddVariable(const string &name, const string &expr)
 {
   customvariablesmap_[name] = new TTreeFormula(name.c_str(), expr.c_str(), chain_);
+  AddFormulaBranches(customvariablesmap_[name]);
+}
+
+//groups are the keys of accessorbranches or branch names
+//the branches required after the pruning are activated immediately
+void ECALELFInterface::RequireBranches(const vector<string> &groups)
+{
+  set<string> branches;
+  for(auto group : groups)
+  {
+    auto groupbranches = accessorbranches.find(group);
+    if(groupbranches != accessorbranches.end())
+      branches.insert(groupbranches->second.begin(), groupbranches->second.end());
+    else
+      branches.insert(group);
+  }
+  for(auto branchname : branches)
+  {
+    if(requiredbranches_.count(branchname)>0)
+      continue;
+    requiredbranches_.insert(branchname);
+    if(branchespruned_ && branchpruning_ && !skim_)
+      for(auto ch_iterator : ch_)
+	if(ch_iterator.second->GetListOfBranches() && ch_iterator.second->GetListOfBranches()->FindObject(branchname.c_str()))
+	  ch_iterator.second->SetBranchStatus(branchname.c_str(), 1);
+  }
+}
+
+//branches of the leaves used by the formula (selection or variable)
+void ECALELFInterface::AddFormulaBranches(TTreeFormula* formula)
+{
+  vector<string> branches;
+  for(int icode=0; icode<formula->GetNcodes(); ++icode)
+  {
+    TLeaf* leaf = formula->GetLeaf(icode);
+    if(leaf)
+      branches.push_back(leaf->GetBranch()->GetMother()->GetName());
+  }
+  RequireBranches(branches);
+}
+
+//disable the branches not required, branch by branch in the chain owning it:
+//the status is applied again by the chain to each new file (and a friend chain keeps its own statuses)
+void ECALELFInterface::PruneBranches()
+{
+  branchespruned_=true;
+  if(!branchpruning_ || skim_)
+    return;
+  int Nbranches=0;
+  string activebranches="";
+  for(auto ch_iterator : ch_)
+  {
+    TObjArray* branches = ch_iterator.second->GetListOfBranches();
+    if(!branches)
+      continue;
+    for(int ibranch=0; ibranch<branches->GetEntriesFast(); ++ibranch)
+    {
+      string branchname = branches->At(ibranch)->GetName();
+      bool active = requiredbranches_.count(branchname)>0;
+      ch_iterator.second->SetBranchStatus(branchname.c_str(), active);
+      if(active)
+	activebranches += " "+branchname;
+      ++Nbranches;
+    }
+  }
+  cout<<">> Branch pruning: reading"<<activebranches<<" ("<<Nbranches<<" branches in the trees)"<<endl;
 }
 
 double ECALELFInterface::GetVariableValue(const string &name, const Int_t &i)
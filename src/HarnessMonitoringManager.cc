@@ -0,0 +1,191 @@
+#include "HarnessMonitoringManager.h"
+
+#include <fstream>
+
+using namespace std;
+
+HarnessMonitoringManager::HarnessMonitoringManager(CfgManager conf):
+  MonitoringManager(conf),
+  base_conf_(conf),
+  selected_harness_(-1)
+{
+  LoadHarnessMap( conf.GetOpt<string> ("LaserMonitoring.harnessmap") );
+  //all the time bins of all the harnesses are filled at the same time --> smaller buffers of the quantile sketches
+  if(!conf.OptExist("LaserMonitoring.scaleMonitor.sketchBuffer"))
+    sketchbufferfactor_ = 1.;
+}
+
+HarnessMonitoringManager::~HarnessMonitoringManager()
+{}
+
+//harness map is a txt file with one harness per line: ietamin ietamax iphimin iphimax
+//(it is generated by harness_definition.WriteHarnessRanges)
+bool HarnessMonitoringManager::LoadHarnessMap(const string &harnessmapfilename)
+{
+  cout<<">> Loading harness map from "<<harnessmapfilename<<endl;
+  ifstream harnessmapfile(harnessmapfilename.c_str());
+  if(!harnessmapfile.is_open())
+  {
+    cout<<"[ERROR]: can't open harness map file "<<harnessmapfilename<<endl;
+    return false;
+  }
+
+  harnessranges_.clear();
+  harness_conf_.clear();
+  //EB crystals in the ECALELF reference: ieta in [-85,85], iphi in [1,360]
+  harnessmap_.assign(171*360, -1);
+  HarnessRange harness;
+  while(harnessmapfile >> harness.ietamin >> harness.ietamax >> harness.iphimin >> harness.iphimax)
+  {
+    int iharness = harnessranges_.size();
+    for(int ieta=harness.ietamin; ieta<=harness.ietamax; ++ieta)
+    {
+      if(ieta==0)
+	continue;
+      for(int iphi=harness.iphimin; iphi<=harness.iphimax; ++iphi)
+      {
+	int index = fromIetaIphito1Dindex(ieta, iphi, 171, 360, -85, 1);
+	if(harnessmap_.at(index)>=0)
+	  cout<<"[WARNING]: crystal (ieta,iphi)=("<<ieta<<","<<iphi<<") belongs to more than one harness --> assigned to "<<GetHarnessName(harnessmap_.at(index))<<endl;
+	else
+	  harnessmap_.at(index) = iharness;
+      }
+    }
+    harnessranges_.push_back(harness);
+    harness_conf_.push_back(BuildHarnessConfig(harness));
+  }
+  harnessmapfile.close();
+  cout<<">> Loaded "<<harnessranges_.size()<<" harnesses"<<endl;
+  return harnessranges_.size()>0;
+}
+
+int HarnessMonitoringManager::FindHarness(const int &ieta, const int &iphi) const
+{
+  if(ieta<-85 || ieta>85 || ieta==0 || iphi<1 || iphi>360)
+    return -1;
+  return harnessmap_[fromIetaIphito1Dindex(ieta, iphi, 171, 360, -85, 1)];
+}
+
+string HarnessMonitoringManager::GetHarnessName(const int &iharness) const
+{
+  const HarnessRange &harness = harnessranges_.at(iharness);
+  return string(Form("IEta_%i_%i_IPhi_%i_%i", harness.ietamin, harness.ietamax, harness.iphimin, harness.iphimax));
+}
+
+//copy the cfg replacing the harness tokens in the options that depend on the harness
+CfgManager HarnessMonitoringManager::BuildHarnessConfig(const HarnessRange &harness)
+{
+  CfgManager harnessconf(base_conf_);
+  vector<string> harnesskeys = {"Input.label",
+				"LaserMonitoring.scaleMonitor.output",
+				"LaserMonitoring.RunDivide.output"};
+  if(base_conf_.OptExist("LaserMonitoring.scaleMonitor.MonitoredScales"))
+    for(auto scale : base_conf_.GetOpt<vector<string> > ("LaserMonitoring.scaleMonitor.MonitoredScales"))
+    {
+      harnesskeys.push_back(Form("LaserMonitoring.scaleMonitor.%s.template",scale.c_str()));
+      harnesskeys.push_back(Form("LaserMonitoring.scaleMonitor.%s.fitplots_folder",scale.c_str()));
+    }
+
+  vector<pair<string,string> > tokens = {{"IETAMIN", to_string(harness.ietamin)},
+					 {"IETAMAX", to_string(harness.ietamax)},
+					 {"IPHIMIN", to_string(harness.iphimin)},
+					 {"IPHIMAX", to_string(harness.iphimax)}};
+  for(auto key : harnesskeys)
+  {
+    if(!base_conf_.OptExist(key))
+      continue;
+    option_t values = base_conf_.GetOpt<vector<string> > (key);
+    for(auto &value : values)
+      for(auto token : tokens)
+	while(value.find(token.first) != string::npos)
+	  value.replace(value.find(token.first), token.first.size(), token.second);
+    harnessconf.SetOpt(key, values);
+  }
+  return harnessconf;
+}
+
+//copy the common timebins (already loaded in timebins) to each harness and book the histos
+void HarnessMonitoringManager::InitHarnessTimeBins()
+{
+  SelectHarness(-1);
+  cout<<">> Initializing timebins of "<<harnessranges_.size()<<" harnesses"<<endl;
+  int Nbin_histos = conf_.GetOpt<int>      ("LaserMonitoring.scaleMonitor.Nbin_histos");
+  float xmin_histos = conf_.GetOpt<float>  ("LaserMonitoring.scaleMonitor.xmin_histos");
+  float xmax_histos = conf_.GetOpt<float>  ("LaserMonitoring.scaleMonitor.xmax_histos");
+  harness_timebins_.assign(harnessranges_.size(), timebins);
+  //the histos are owned by their bins: keep them out of gDirectory (appending there is linear in the number of histos)
+  bool addDirectoryStatus = TH1::AddDirectoryStatus();
+  TH1::AddDirectory(kFALSE);
+  for(unsigned iharness=0; iharness<harness_timebins_.size(); ++iharness)
+    for(unsigned ibin=0; ibin<harness_timebins_.at(iharness).size(); ++ibin)
+    {
+      string histoname = Form("Histo_%s_%i", GetHarnessName(iharness).c_str(), ibin);
+      harness_timebins_.at(iharness).at(ibin).InitHisto((char*)histoname.c_str(), (char*)histoname.c_str(), Nbin_histos, xmin_histos, xmax_histos, sketchcompression_, sketchbufferfactor_);
+    }
+  TH1::AddDirectory(addDirectoryStatus);
+}
+
+//Loop once over ECALELF tree to fill the timebins of all the harnesses
+void HarnessMonitoringManager::FillTimeBins()
+{
+  cout<<">> Filling timebin histos of all the harnesses with variable "<<variablename_<<endl;
+  if(harness_timebins_.size()!=harnessranges_.size())
+    InitHarnessTimeBins();
+  SelectHarness(-1);
+
+  long Nentries = this->GetEntries();
+  cout<<Nentries<<" total entries\n"<<endl;
+  for(long ientry=0; ientry<Nentries; ++ientry)
+  {
+    this->GetEntry(ientry);
+    if(ientry%100000==0)
+      cout<<"reading entry "<<ientry<<"\r"<<std::flush;
+
+    for(int iEle=0; iEle<2; ++iEle)
+    {
+      if(this->isSelected(iEle))
+      {
+	int iharness = FindHarness(this->GetixSeed(iEle), this->GetiySeed(iEle));
+	if(iharness<0)
+	  continue;
+	//all the harnesses share the same bin ranges --> search in the common timebins
+	auto bin_iterator = FindBin(this->GetRunNumber(),this->GetLS(),this->GetTime());
+	if(bin_iterator!=timebins.end())
+	{
+	  float value = GetScaleVariableValue(iEle);
+	  profiler_.Start(StageProfiler::kFill);
+	  harness_timebins_[iharness][bin_iterator-timebins.begin()].FillHisto(value);
+	  profiler_.Stop();
+	}
+      }
+    }
+  }
+
+  cout<<">> Histos filled"<<endl;
+
+  //Updating Nev of the bins (just a precaution)
+  for(auto &harnessbins : harness_timebins_)
+    for(std::vector<TimeBin>::iterator it_bin = harnessbins.begin(); it_bin<harnessbins.end(); ++it_bin)
+      it_bin->UpdateNev();
+}
+
+//make the given harness the current one: timebins, cfg and label are swapped with the harness ones
+//iharness=-1 restores the common timebins and the original cfg
+void HarnessMonitoringManager::SelectHarness(const int &iharness)
+{
+  if(iharness == selected_harness_)
+    return;
+  if(selected_harness_>=0)
+    timebins.swap(harness_timebins_.at(selected_harness_));
+
+  if(iharness>=0)
+  {
+    timebins.swap(harness_timebins_.at(iharness));
+    conf_ = harness_conf_.at(iharness);
+  }
+  else
+    conf_ = base_conf_;
+  label_ = conf_.GetOpt<string> ("Input.label");
+  selected_harness_ = iharness;
+  ResetBinIndex();
+}
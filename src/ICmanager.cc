@@ -1,13 +1,26 @@
 #include "ICmanager.h"
 #include "TMath.h"
 #include "assert.h"
+#include <algorithm>
+#include <cstdlib>
 //#include "utils.h"
 
 using namespace std;
 
-ICmanager::ICmanager(CfgManager conf)
+ICmanager::ICmanager(CfgManager conf):
+  IOVoverlap_(false),
+  lastIOV_(-1),
+  maxLoadedIOVs_(50),
+  lastAccessedIOV_(-1),
+  cubeNeta_(0),
+  cubeNphi_(0),
+  cubeietamin_(0),
+  cubeiphimin_(0)
 {
   InitIC(1);
+  //max number of IOVs kept in memory when the txtICdictionary or binICdictionary IOVs are loaded on demand
+  if(conf.OptExist("Input.maxLoadedIOVs"))
+    maxLoadedIOVs_ = max(1, conf.GetOpt<int> ("Input.maxLoadedIOVs"));
   //-------------------------------------
   //load input IC
   if(conf.OptExist("Input.inputIC"))
@@ -17,13 +30,29 @@ ICmanager::ICmanager(CfgManager conf)
   
 }
 
-ICmanager::ICmanager(const std::vector<std::string> &ICcfg)
+ICmanager::ICmanager(const std::vector<std::string> &ICcfg):
+  IOVoverlap_(false),
+  lastIOV_(-1),
+  maxLoadedIOVs_(50),
+  lastAccessedIOV_(-1),
+  cubeNeta_(0),
+  cubeNphi_(0),
+  cubeietamin_(0),
+  cubeiphimin_(0)
 {
   InitIC(1);
   LoadIC( ICcfg );
 }
 
-ICmanager::ICmanager()
+ICmanager::ICmanager():
+  IOVoverlap_(false),
+  lastIOV_(-1),
+  maxLoadedIOVs_(50),
+  lastAccessedIOV_(-1),
+  cubeNeta_(0),
+  cubeNphi_(0),
+  cubeietamin_(0),
+  cubeiphimin_(0)
 {  
   InitIC(1);
 }  
@@ -34,12 +63,22 @@ ICmanager::~ICmanager()
 void ICmanager::LoadIC(TH2D* ICmap, const int &iz)
 {
   timedependent_ICvalues_.clear();
+  IOVlist_.clear();
+  IOVfilenames_.clear();
+  ICcube_.clear();
+  loadedIOVs_.clear();
+  lastAccessedIOV_=-1;
   timedependent_ICvalues_.push_back( GetICFromTH2D(ICmap,iz) );
 }
 
 void ICmanager::LoadIC(const std::vector<std::string> &ICcfg)
 {
   timedependent_ICvalues_.clear();
+  IOVlist_.clear();
+  IOVfilenames_.clear();
+  ICcube_.clear();
+  loadedIOVs_.clear();
+  lastAccessedIOV_=-1;
 
   string inputtype   = ICcfg.front();
   string filename    = ICcfg.back();
@@ -60,11 +99,18 @@ void ICmanager::LoadIC(const std::vector<std::string> &ICcfg)
 	if(!(ICdictionary  >> runmin >> lsmin >> runmax >> lsmax >> ICfilename))
 	  continue;
 	IOV thisIOV{runmin,lsmin,runmax,lsmax};
-	cout<<"> Loading IC for IOV "<<runmin<<":"<<lsmin<<" - "<<runmax<<":"<<lsmax<<" from txt file "<<ICfilename<<endl;
 	IOVlist_.push_back( thisIOV );
-	timedependent_ICvalues_.push_back( GetICFromtxt(ICfilename) );
+	//the IC of the IOV are read from ICfilename at the first access (see AccessIOV)
+	IOVfilenames_.push_back( ICfilename );
+	timedependent_ICvalues_.push_back( IC() );
       }
       ICdictionary.close();
+      cout<<"> Found "<<IOVlist_.size()<<" IOVs in "<<filename<<", IC loaded on demand (max "<<maxLoadedIOVs_<<" IOVs in memory)"<<endl;
+    }
+    else if(inputtype=="binICdictionary")
+    {
+      cout<<"> Loading IC cube from binary file "<<filename<<endl;
+      LoadICFromBinary(filename);
     }
     else
     {
@@ -81,26 +127,128 @@ void ICmanager::LoadIC(const std::vector<std::string> &ICcfg)
       timedependent_ICvalues_.push_back( GetICFromTH2D(ICmap,iz) );
       inICfile->Close();
     }
+  BuildIOVIndex();
+}
+
+IC ICmanager::GetEmptyIC()
+{
+  IC icvalues;
+  icvalues.values.assign(kNcrystals, 0.);
+  icvalues.valid.assign(kNcrystals, 0);
+  return icvalues;
+}
+
+bool ICmanager::IsValid(const Int_t &ix, const Int_t &iy, const Int_t &iz, const Int_t &iIOV)
+{
+  if(!IsInRange(ix,iy,iz) || iIOV<0 || iIOV>=(int)timedependent_ICvalues_.size())
+    return false;
+  if(iIOV!=lastAccessedIOV_)
+    AccessIOV(iIOV);
+  return timedependent_ICvalues_[iIOV].valid[GetICIndex(ix,iy,iz)];
 }
 
 IC ICmanager::GetICFromtxt(const std::string &txtfilename)
 {
   int ix, iy, iz;
   double icvalue, eic;
-  IC icvalues;
+  IC icvalues = GetEmptyIC();
+  int Nskipped=0;
   ifstream infile(txtfilename.c_str());
-  while (!infile.eof()) 
+  while (infile >> ix >> iy >> iz >> icvalue >> eic) 
   {
-    infile >> ix >> iy >> iz >> icvalue >> eic ;
     //cout << ix <<"\t"<< iy <<"\t"<< iz <<"\t"<< icvalue << "\t"<< eic <<endl ;
-    icvalues[ix][iy][iz] = icvalue;
+    if(!IsInRange(ix,iy,iz))
+    {
+      ++Nskipped;
+      continue;
+    }
+    int index = GetICIndex(ix,iy,iz);
+    icvalues.values[index] = icvalue;
+    icvalues.valid[index] = 1;
+  }
+  if(Nskipped>0)
+    cout<<"[WARNING]: "<<Nskipped<<" lines of "<<txtfilename<<" out of the ECAL range --> skipped"<<endl;
+  return icvalues;
+}
+
+//binary multi-IOV IC file written by harness_corrections.py --GetPointCorrections (little endian)
+//  char[8]   magic "EopICv01"
+//  int32[6]  nIOV, Neta, Nphi, ietamin, iphimin, unused
+//  uint32[4] runmin, lsmin, runmax, lsmax of each IOV
+//  float32   IC[iIOV][ieta-ietamin][iphi-iphimin] (barrel only)
+//the float cube is kept as it is, the dense IC of an IOV is built at its first access (see AccessIOV)
+void ICmanager::LoadICFromBinary(const std::string &binfilename)
+{
+  ifstream infile(binfilename.c_str(), ios::in | ios::binary);
+  if(!infile.is_open())
+  {
+    cout<<"[ERROR]: can't open IC file "<<binfilename<<endl;
+    exit(-1);
+  }
+  char magic[8];
+  Int_t header[6];
+  infile.read(magic, 8);
+  infile.read((char*)header, sizeof(header));
+  if(!infile || string(magic,8)!="EopICv01")
+  {
+    cout<<"[ERROR]: "<<binfilename<<" is not a binary IC file"<<endl;
+    exit(-1);
+  }
+  int nIOV=header[0];
+  if(nIOV<=0 || header[1]<=0 || header[2]<=0)
+  {
+    cout<<"[ERROR]: binary IC file "<<binfilename<<" has no IOV (nIOV="<<nIOV<<", Neta="<<header[1]<<", Nphi="<<header[2]<<")"<<endl;
+    exit(-1);
+  }
+  cubeNeta_=header[1];
+  cubeNphi_=header[2];
+  cubeietamin_=header[3];
+  cubeiphimin_=header[4];
+
+  vector<UInt_t> IOVtable(4*nIOV);
+  infile.read((char*)IOVtable.data(), IOVtable.size()*sizeof(UInt_t));
+  //the whole cube is read at once, no parsing needed
+  ICcube_.resize((size_t)nIOV*cubeNeta_*cubeNphi_);
+  infile.read((char*)ICcube_.data(), ICcube_.size()*sizeof(Float_t));
+  if(!infile)
+  {
+    cout<<"[ERROR]: IC file "<<binfilename<<" is truncated"<<endl;
+    exit(-1);
+  }
+  infile.close();
+
+  for(int iIOV=0; iIOV<nIOV; ++iIOV)
+  {
+    IOV thisIOV{IOVtable[4*iIOV], (UShort_t)IOVtable[4*iIOV+1], IOVtable[4*iIOV+2], (UShort_t)IOVtable[4*iIOV+3]};
+    IOVlist_.push_back( thisIOV );
+    timedependent_ICvalues_.push_back( IC() );
+  }
+  cout<<"> Found "<<nIOV<<" IOVs, IC loaded on demand (max "<<maxLoadedIOVs_<<" IOVs in memory)"<<endl;
+}
+
+IC ICmanager::GetICFromBinaryCube(const Int_t &iIOV)
+{
+  IC icvalues = GetEmptyIC();
+  const Float_t* IOVcube = ICcube_.data() + (size_t)iIOV*cubeNeta_*cubeNphi_;
+  for(int ieta=cubeietamin_; ieta<cubeietamin_+cubeNeta_; ++ieta)
+  {
+    if(ieta==0)
+      continue;
+    for(int iphi=cubeiphimin_; iphi<cubeiphimin_+cubeNphi_; ++iphi)
+    {
+      if(!IsInRange(ieta,iphi,0))
+	continue;
+      int index = GetICIndex(ieta,iphi,0);
+      icvalues.values[index] = IOVcube[fromIetaIphito1Dindex(ieta, iphi, cubeNeta_, cubeNphi_, cubeietamin_, cubeiphimin_)];
+      icvalues.valid[index] = 1;
+    }
   }
   return icvalues;
 }
 
 IC ICmanager::GetICFromTH2D(TH2D* ICmap, const int &iz)
 {
-  IC icvalues;
+  IC icvalues = GetEmptyIC();
   bool toshift = (ICmap->GetXaxis()->GetXmin() == 1);
   for(int xbin=1; xbin<ICmap->GetXaxis()->GetXmax()+1; ++xbin)
   {
@@ -108,10 +256,14 @@ IC ICmanager::GetICFromTH2D(TH2D* ICmap, const int &iz)
     for(int ybin=1; ybin<ICmap->GetYaxis()->GetXmax()+1; ++ybin)
     {
       int iy = (int) (ICmap->GetYaxis()->GetBinCenter(ybin) - 0.5*toshift);
-      if(iz==0)//for barrel, for historical reason, in the th2f ix(ieta) and iy(iphi) are inverted 
-	icvalues[iy][ix][iz] = ICmap->GetBinContent(xbin,ybin);
-      else
-	icvalues[ix][iy][iz] = ICmap->GetBinContent(xbin,ybin);
+      //for barrel, for historical reason, in the th2f ix(ieta) and iy(iphi) are inverted 
+      int ICix = (iz==0 ? iy : ix);
+      int ICiy = (iz==0 ? ix : iy);
+      if(!IsInRange(ICix,ICiy,iz))
+	continue;
+      int index = GetICIndex(ICix,ICiy,iz);
+      icvalues.values[index] = ICmap->GetBinContent(xbin,ybin);
+      icvalues.valid[index] = 1;
     }
   }
   return icvalues;
@@ -120,45 +272,92 @@ IC ICmanager::GetICFromTH2D(TH2D* ICmap, const int &iz)
 void ICmanager::InitIC(Int_t ICvalue)
 {
   IC icvalues;
-  for(int iz=izmin_; iz<=izmax_; ++iz)
-    for(int ix=ixmin_.at(iz); ix<=ixmax_.at(iz); ++ix)
-      for(int iy=iymin_.at(iz); iy<=iymax_.at(iz); ++iy)
-	icvalues[ix][iy][iz]=1.;
-
+  icvalues.values.assign(kNcrystals, ICvalue);
+  icvalues.valid.assign(kNcrystals, 1);
   timedependent_ICvalues_.push_back( icvalues );
 }
 
-Float_t ICmanager::GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz)
+//sort the IOVs by their first (run,ls) for the binary search in FindIOVNumber
+void ICmanager::BuildIOVIndex()
 {
-  //#ifdef DEBUG
-  assert(iz>=izmin_     && iz<=izmax_); 
-  assert(ix>=ixmin_.at(iz) && ix<=ixmax_.at(iz));
-  assert(iy>=iymin_.at(iz) && iy<=iymax_.at(iz));
-  //#endif
-  return timedependent_ICvalues_.at(0)[ix][iy][iz];
+  IOVorder_.resize(IOVlist_.size());
+  for(unsigned iIOV=0; iIOV<IOVlist_.size(); ++iIOV)
+    IOVorder_[iIOV] = iIOV;
+  std::stable_sort(IOVorder_.begin(), IOVorder_.end(),
+		   [this](const int &a, const int &b) {return IOVlist_[a].StartKey() < IOVlist_[b].StartKey();});
+  IOVstarts_.resize(IOVorder_.size());
+  IOVmaxends_.resize(IOVorder_.size());
+  IOVoverlap_ = false;
+  int firstoverlap = -1;
+  for(unsigned i=0; i<IOVorder_.size(); ++i)
+  {
+    const IOV &thisIOV = IOVlist_[IOVorder_[i]];
+    IOVstarts_[i] = thisIOV.StartKey();
+    IOVmaxends_[i] = thisIOV.EndKey();
+    if(i>0)
+    {
+      //IOVs sharing a boundary (run,ls) or overlapping
+      if(IOVmaxends_[i-1] >= IOVstarts_[i] && !IOVoverlap_)
+      {
+	IOVoverlap_ = true;
+	firstoverlap = i;
+      }
+      IOVmaxends_[i] = std::max(IOVmaxends_[i], IOVmaxends_[i-1]);
+    }
+  }
+  lastIOV_=-1;
+
+  //check the lookup on the first shared (run,ls): the first IOV of the list containing it is used, as in a linear scan
+  if(IOVoverlap_)
+  {
+    UInt_t run = IOVstarts_[firstoverlap]>>16;
+    UShort_t ls = IOVstarts_[firstoverlap] & 0xFFFF;
+    int firstIOV = -1;
+    for(unsigned iIOV=0; iIOV<IOVlist_.size() && firstIOV<0; ++iIOV)
+      if(IOVlist_[iIOV].Contains(run,ls))
+	firstIOV = iIOV;
+    cout<<"[WARNING]: overlapping IOVs, e.g. (run,ls)=("<<run<<","<<ls<<") --> the first IOV of the list containing it is used (IOV "<<firstIOV<<")"<<endl;
+    int foundIOV = FindIOVNumber(run,ls);
+    assert(foundIOV==firstIOV);
+    lastIOV_=-1;
+  }
 }
 
-Float_t ICmanager::GetIC(const Int_t &ix, const Int_t &iy, const Int_t &iz, const Int_t &iIOV)
+//last IOV starting before or at (run,ls), -1 if (run,ls) comes before all the IOVs
+int ICmanager::FindIOVBefore(const UInt_t &run, const UShort_t &ls)
 {
-  //#ifdef DEBUG
-  assert(iz>=izmin_     && iz<=izmax_); 
-  assert(ix>=ixmin_.at(iz) && ix<=ixmax_.at(iz));
-  assert(iy>=iymin_.at(iz) && iy<=iymax_.at(iz));
-  assert(iIOV<timedependent_ICvalues_.size());
-  //#endif
-  return timedependent_ICvalues_.at(iIOV)[ix][iy][iz];
+  if(IOVstarts_.size()!=IOVlist_.size())
+    BuildIOVIndex();
+  ULong64_t key = ((ULong64_t)run<<16) | ls;
+  int position = std::upper_bound(IOVstarts_.begin(), IOVstarts_.end(), key) - IOVstarts_.begin() - 1;
+  if(position<0)
+    return -1;
+  return IOVorder_[position];
 }
 
+//the first IOV of the list containing (run,ls) (as a linear scan), -1 if none
+//the candidates are the IOVs starting before or at (run,ls) and ending after it: the binary search gives the last one starting before (run,ls),
+//the previous ones are checked while one of them can still contain (run,ls), i.e. only for overlapping IOVs or IOVs sharing a boundary
 int ICmanager::FindIOVNumber(const UInt_t &run, const UShort_t &ls)
 {
   if(IOVlist_.size()==0)
     return 0;
-  int iIOV=0;
-  for(int iIOV=0; iIOV<IOVlist_.size(); ++iIOV)
-    if(IOVlist_.at(iIOV).Contains(run,ls))
-      return iIOV;
+  //consecutive events usually belong to the same IOV (when the IOVs overlap a previous one in the list could contain them as well)
+  if(!IOVoverlap_ && lastIOV_>=0 && lastIOV_<(int)IOVlist_.size() && IOVlist_[lastIOV_].Contains(run,ls))
+    return lastIOV_;
+  if(IOVstarts_.size()!=IOVlist_.size())
+    BuildIOVIndex();
+  ULong64_t key = ((ULong64_t)run<<16) | ls;
+  int position = std::upper_bound(IOVstarts_.begin(), IOVstarts_.end(), key) - IOVstarts_.begin() - 1;
+  int found = -1;
+  for(int icandidate=position; icandidate>=0 && IOVmaxends_[icandidate]>=key; --icandidate)
+    if(IOVlist_[IOVorder_[icandidate]].Contains(run,ls))
+      if(found<0 || IOVorder_[icandidate]<found)
+	found = IOVorder_[icandidate];
+  if(found>=0)
+    lastIOV_ = found;
   //cout<<"[ERROR]: can't find the given (run,ls)=("<<run<<","<<ls<<") in the IOV list --> will use the first "<<endl;
-  return -1;
+  return found;
 }
 
 
@@ -171,14 +370,37 @@ int ICmanager::FindCloserIOVNumber(const UInt_t &run, const UShort_t &ls)
   if(IOVlist_.size()==0)
     return 0;
 
-  if(IOVlist_.at(0).GreaterThan(run,ls))
-    return 0;
-
-  for(int iIOV=0; iIOV<IOVlist_.size()-1; ++iIOV)
-    if(IOVlist_.at(iIOV).SmallerThan(run,ls) && IOVlist_.at(iIOV+1).GreaterThan(run,ls))
-      return iIOV;
+  //(run,ls) is in a gap between two IOVs (or after the last one) --> previous IOV, before the first IOV --> first IOV
+  iIOV = FindIOVBefore(run,ls);
+  if(iIOV<0)
+    return IOVorder_.front();
+  return iIOV;
+}
 
-  return IOVlist_.size()-1;
+//load the IOV if needed and keep at most maxLoadedIOVs_ IOVs in memory, dropping the least recently used ones
+void ICmanager::AccessIOV(const Int_t &iIOV)
+{
+  lastAccessedIOV_ = iIOV;
+  if(IOVfilenames_.size()==0 && ICcube_.size()==0)
+    return;
+  loadedIOVs_.remove(iIOV);
+  loadedIOVs_.push_front(iIOV);
+  if(timedependent_ICvalues_[iIOV].values.size()==0)
+  {
+    if(ICcube_.size()>0)
+      timedependent_ICvalues_[iIOV] = GetICFromBinaryCube(iIOV);
+    else
+    {
+      const IOV &thisIOV = IOVlist_[iIOV];
+      cout<<"> Loading IC for IOV "<<thisIOV.runmin<<":"<<thisIOV.lsmin<<" - "<<thisIOV.runmax<<":"<<thisIOV.lsmax<<" from txt file "<<IOVfilenames_[iIOV]<<endl;
+      timedependent_ICvalues_[iIOV] = GetICFromtxt(IOVfilenames_[iIOV]);
+    }
+  }
+  while((int)loadedIOVs_.size()>maxLoadedIOVs_)
+  {
+    timedependent_ICvalues_[loadedIOVs_.back()] = IC();
+    loadedIOVs_.pop_back();
+  }
 }
 
 TH2D* ICmanager::GetHisto(const int &iz, const char* name, const char* title)
@@ -211,11 +433,6 @@ TH2D* ICmanager::GetHisto(const int &iz, const char* name, const char* title)
   return ICmap;
 }
 
-double&  ICmanager::operator()(const Int_t &ix, const Int_t &iy, const Int_t &iz)
-{
-  return (timedependent_ICvalues_.at(0))[ix][iy][iz];
-}
-
 TH2D* ICmanager::GetPulledIC(TH2D* h2_ICpull, const int &iz)
 {
   bool toshift = (h2_ICpull->GetXaxis()->GetXmin()==1);
@@ -611,15 +828,7 @@ TH2D* GetICpull(TH2D* h2_numerator,TH2D* h2_denominator)
 //4  1-D index
 //   360*171 bins
 
-int fromIetaIphito1Dindex(const int &ieta, const int &iphi, const int &Neta, const int &Nphi, const int &ietamin, const int &iphimin)
-{
-  return (iphi - iphimin)+Nphi*(ieta - ietamin);
-}
-
-int fromTH2indexto1Dindex(const int &binx, const int &biny, const int &Nbinx, const int &Nbiny)
-{
-  return (binx - 1)+Nbinx*(biny - 1);
-}
+//fromIetaIphito1Dindex and fromTH2indexto1Dindex are inlined in ICmanager.h
 
 void from1DindextoIetaIphi(const int &index, int &ieta, int &iphi, const int &Neta, const int &Nphi, const int &ietamin, const int &iphimin)
 {
@@ -2,17 +2,31 @@
 #include "histoFunc.h"
 #include "FitUtils.h"
 
+#include <algorithm>
+#include <atomic>
+#include <thread>
+
+#include "TROOT.h"
+#include "Math/MinimizerOptions.h"
+
 using namespace std;
 
 MonitoringManager::MonitoringManager(CfgManager conf):
   calibrator(conf),
   conf_(conf),
-  h_template_(0)
+  h_template_(0),
+  savehistos_(false)
 {
   label_ = conf.GetOpt<string> ("Input.label");  
   variablename_ = conf.GetOpt<string> ("LaserMonitoring.variable");
+  sketchcompression_ = 200.;
+  if(conf.OptExist("LaserMonitoring.scaleMonitor.sketchCompression"))
+    sketchcompression_ = conf.GetOpt<double> ("LaserMonitoring.scaleMonitor.sketchCompression");
+  sketchbufferfactor_ = 5.;
+  if(conf.OptExist("LaserMonitoring.scaleMonitor.sketchBuffer"))
+    sketchbufferfactor_ = conf.GetOpt<double> ("LaserMonitoring.scaleMonitor.sketchBuffer");
   SetScaleVariable(variablename_);
-  last_accessed_bin_=timebins.end();
+  ResetBinIndex();
 }
 
 MonitoringManager::~MonitoringManager()
@@ -27,12 +41,14 @@ void MonitoringManager::SetScaleVariable(const string &variablename)
   {
     cout<<">> SetScaleVariable: special keyword detected"<<endl;
     variabletype_=kICenergy_over_p;
+    RequireBranches({"ICenergy","momentum"});
   }
   else
     if(variablename=="ICMee")
     {
       cout<<">> SetScaleVariable: special keyword detected"<<endl;
       variabletype_=kICMee;
+      RequireBranches({"ICenergy","mass"});
     }
     else
     {
@@ -43,6 +59,7 @@ void MonitoringManager::SetScaleVariable(const string &variablename)
 
 float MonitoringManager::GetScaleVariableValue(const int &iEle)
 {
+  StageTimer timer(profiler_, StageProfiler::kVariable);
   if(variabletype_==kICenergy_over_p)
   {
     if(GetP(iEle)!=0)
@@ -82,6 +99,7 @@ TH1F* MonitoringManager::BuildTemplate()
 
 void  MonitoringManager::fitScale()
 {
+  StageTimer timer(profiler_, StageProfiler::kFit);
   cout<<">> fitScale in function"<<endl;
   //Parse the cfg
   string xname = conf_.GetOpt<string>    ("LaserMonitoring.scaleFit.xname");
@@ -161,11 +179,26 @@ void  MonitoringManager::fitScale()
   
 }
 
-void  MonitoringManager::RunDivide()
+//if fillhistos is true, the scale variable is also filled in one histo per lumisection, merged together with the lumisections
+//--> the timebins are ready for the scale monitoring without a second loop over the ntuple
+void  MonitoringManager::RunDivide(const bool &fillhistos)
 {
   cout<<">> Running RunDivide"<<endl;
   int    Nevmax_bin     = conf_.GetOpt<int>          ("LaserMonitoring.RunDivide.Nevmax_bin");
   float  maxduration    = 60*60*conf_.GetOpt<float>  ("LaserMonitoring.RunDivide.maxduration");//It is provided in hours
+  int    Nbin_histos = 0;
+  float  xmin_histos = 0.;
+  float  xmax_histos = 0.;
+  bool   addDirectoryStatus = TH1::AddDirectoryStatus();
+  if(fillhistos)
+  {
+    cout<<">> Filling lumisection histos with variable "<<variablename_<<endl;
+    Nbin_histos = conf_.GetOpt<int>      ("LaserMonitoring.scaleMonitor.Nbin_histos");
+    xmin_histos = conf_.GetOpt<float>    ("LaserMonitoring.scaleMonitor.xmin_histos");
+    xmax_histos = conf_.GetOpt<float>    ("LaserMonitoring.scaleMonitor.xmax_histos");
+    //the lumisection histos are owned by their bins: keep them out of gDirectory (appending there is linear in the number of histos)
+    TH1::AddDirectory(kFALSE);
+  }
 
   //Loop on events to build bins corresponding to single lumisections, they will be merged afterward
   //Exploit methods inherited from ECALELFInterface to access the ntuple content
@@ -193,21 +226,39 @@ void  MonitoringManager::RunDivide()
 	newbin.SetBinRanges(run,run,ls,ls,t,t);
 	newbin.SetNev(w);
 	timebins.push_back(newbin);
-	last_accessed_bin_ = timebins.end();
+	lsbins_[TimeBin::RunLSKey(run,ls)] = timebins.size()-1;
+	last_accessed_bin_ = timebins.end()-1;
+	bin_iterator = last_accessed_bin_;
+	if(fillhistos)
+	  bin_iterator->InitHisto( Form("Histo_ls%i",int(timebins.size()-1)), Form("Histo_ls%i",int(timebins.size()-1)), Nbin_histos, xmin_histos, xmax_histos, sketchcompression_, sketchbufferfactor_);
       }
+      if(fillhistos)
+	for(int iEle=0; iEle<2; ++iEle)
+	  if(this->isSelected(iEle))
+	  {
+	    float value = GetScaleVariableValue(iEle);
+	    profiler_.Start(StageProfiler::kFill);
+	    bin_iterator->FillHisto(value);
+	    profiler_.Stop();
+	  }
     }
   }
   cout<<endl;
+  lsbins_.clear();
 
   //Merge the lumisections to create TimeBins with about the required number of events
+  //the lumisections are sorted through their positions, to avoid copying their histos around
   cout<<">> Merging lumisections"<<endl;
-  std::sort(timebins.begin(), timebins.end());
   vector<TimeBin> ls_bins;
   timebins.swap(ls_bins);//switch the contents of timebins vector with the one of ls_bins vector(empty)
-  auto lsbin_iterator = ls_bins.begin();
-  TimeBin bufferbin(*lsbin_iterator);
+  vector<int> ls_order(ls_bins.size());
+  for(unsigned ibin=0; ibin<ls_order.size(); ++ibin)
+    ls_order[ibin] = ibin;
+  std::sort(ls_order.begin(), ls_order.end(), [&ls_bins](const int &ibin, const int &jbin) {return ls_bins[ibin] < ls_bins[jbin];});
+  auto lsbin_iterator = ls_order.begin();
+  TimeBin bufferbin(ls_bins[*lsbin_iterator]);
   lsbin_iterator++;
-  while(lsbin_iterator != ls_bins.end())
+  while(lsbin_iterator != ls_order.end())
   {
     if(bufferbin.DeltaT() > maxduration)
     {
@@ -222,7 +273,7 @@ void  MonitoringManager::RunDivide()
       }
       else
       {
-	bufferbin.AddEvent(*lsbin_iterator);
+	bufferbin.AddEvent(ls_bins[*lsbin_iterator]);
 	lsbin_iterator++;
       }
   }
@@ -238,7 +289,15 @@ void  MonitoringManager::RunDivide()
     LoadIntegratedLuminosity(intlumi_vs_time_filename);
   }
 
-  last_accessed_bin_ = timebins.end();
+  //same histo names of FillTimeBins (they are used for the fit plots)
+  if(fillhistos)
+  {
+    for(unsigned ibin=0; ibin<timebins.size(); ++ibin)
+      timebins.at(ibin).RenameHisto( Form("Histo%i",ibin) );
+    TH1::AddDirectory(addDirectoryStatus);
+  }
+
+  ResetBinIndex();
 
 }
 
@@ -263,18 +322,33 @@ void  MonitoringManager::LoadIntegratedLuminosity(string intlumi_vs_time_filenam
 
 void  MonitoringManager::SaveTimeBins(std::string outfilename, std::string writemethod)
 {
+  StageTimer timer(profiler_, StageProfiler::kWrite);
   TFile* outfile = new TFile(outfilename.c_str(), writemethod.c_str());
   outfile->cd();
   TTree* outtree = new TTree(label_.c_str(), label_.c_str());
   TimeBin bin( *(timebins.begin()) );
   bin.BranchOutput(outtree);
+  //the histos are saved with the tree entry number, to be merged with the outputs of other jobs
+  TDirectory* histodir = 0;
+  if(savehistos_)
+  {
+    string histodirname = label_+"_histos";
+    histodir = outfile->GetDirectory(histodirname.c_str());
+    if(!histodir)
+      histodir = outfile->mkdir(histodirname.c_str());
+  }
   
-  for(auto bincontent : timebins)
+  int ientry=0;
+  for(auto &bincontent : timebins)
   {
     if(bincontent.GetNev() > 0)
     {
+      bincontent.CompressSketch();
       bin=bincontent;
       outtree->Fill();
+      if(histodir)
+	bincontent.WriteHisto(histodir, Form("Histo%i",ientry));
+      ++ientry;
     }
   }
 
@@ -311,7 +385,7 @@ void  MonitoringManager::LoadTimeBins(std::vector<UInt_t>& runs, std::vector<UIn
   }
   std::sort(timebins.begin(), timebins.end());//It should be already ordered, just for security
   cout<<">> Loaded "<<timebins.size()<<" bins"<<endl;
-  last_accessed_bin_=timebins.end();    
+  ResetBinIndex();
 }
 
 void  MonitoringManager::LoadTimeBins(string inputfilename, string objname, std::string option)
@@ -358,7 +432,93 @@ void  MonitoringManager::LoadTimeBins(string inputfilename, string objname, std:
   std::sort(timebins.begin(), timebins.end());//It should be already ordered, just for security
   cout<<">> Loaded "<<timebins.size()<<" bins"<<endl;
   inputfile->Close();
-  last_accessed_bin_=timebins.end();
+  ResetBinIndex();
+}
+
+//sum the timebins of the outputs of different jobs (e.g. the file groups of the same harness)
+//bins with the same run/ls ranges are merged together with their quantile sketches and histos, the scale variables are dropped
+//the histos are kept only if all the inputs have them (saved with --saveHistos)
+void  MonitoringManager::MergeTimeBins(const std::vector<std::string> &inputfilenames, string objname)
+{
+  cout<<">> Merging timebins of "<<inputfilenames.size()<<" files"<<endl;
+  if(objname=="")
+    objname=label_;
+  timebins.clear();
+  map<pair<ULong64_t,ULong64_t>,int> binpositions;
+  bool mergehistos = true;
+  for(auto inputfilename : inputfilenames)
+  {
+    TFile* inputfile = new TFile(inputfilename.c_str(),"READ");
+    if(inputfile->IsZombie())
+    {
+      cout<<"[WARNING]: can't open "<<inputfilename<<" --> skip it"<<endl;
+      delete inputfile;
+      continue;
+    }
+    TTree* intree = (TTree*) inputfile->Get(objname.c_str());
+    if(!intree)
+    {
+      cout<<"[WARNING]: can't get tree "<<objname<<" in "<<inputfilename<<" --> skip it"<<endl;
+      inputfile->Close();
+      continue;
+    }
+    TDirectory* histodir = inputfile->GetDirectory((objname+"_histos").c_str());
+    if(!histodir && mergehistos)
+    {
+      cout<<"[WARNING]: no histos in "<<inputfilename<<" --> the merged timebins will not have histos"<<endl;
+      mergehistos = false;
+    }
+    TimeBin bin;
+    bin.BranchInput(intree,true);
+    for(Long64_t ibin=0; ibin<intree->GetEntries(); ++ibin)
+    {
+      intree->GetEntry(ibin);
+      if(mergehistos)
+      {
+	TH1F* h = (TH1F*) histodir->Get(Form("Histo%lli",ibin));
+	if(!h)
+	{
+	  cout<<"[WARNING]: no histo for entry "<<ibin<<" of "<<inputfilename<<" --> the merged timebins will not have histos"<<endl;
+	  mergehistos = false;
+	}
+	bin.SetHisto(h);
+      }
+      else
+	bin.SetHisto(0);
+      auto key = make_pair(bin.GetStartKey(), TimeBin::RunLSKey(bin.GetRunmax(),bin.GetLsmax()));
+      auto it_position = binpositions.find(key);
+      if(it_position==binpositions.end())
+      {
+	binpositions[key] = timebins.size();
+	TimeBin newbin;
+	newbin.SetSketchCompression(sketchcompression_);
+	newbin.AddEvent(bin);
+	timebins.push_back(newbin);
+      }
+      else
+	timebins.at(it_position->second).AddEvent(bin);
+    }
+    inputfile->Close();
+  }
+
+  std::sort(timebins.begin(), timebins.end());
+  for(unsigned ibin=0; ibin<timebins.size(); ++ibin)
+    if(mergehistos)
+      timebins.at(ibin).RenameHisto( Form("Histo%i",ibin) );
+    else
+      timebins.at(ibin).SetHisto(0);
+  cout<<">> Merged into "<<timebins.size()<<" bins"<<(mergehistos ? " with histos" : "")<<endl;
+  ResetBinIndex();
+}
+
+bool  MonitoringManager::HasHistos() const
+{
+  if(timebins.size()==0)
+    return false;
+  for(auto &bin : timebins)
+    if(!bin.HasHisto())
+      return false;
+  return true;
 }
 
 bool MonitoringManager::BookHistos()
@@ -367,7 +527,7 @@ bool MonitoringManager::BookHistos()
   float xmin_histos = conf_.GetOpt<float>  ("LaserMonitoring.scaleMonitor.xmin_histos");
   float xmax_histos = conf_.GetOpt<float>  ("LaserMonitoring.scaleMonitor.xmax_histos");
   for(unsigned ibin=0; ibin<timebins.size(); ++ibin)
-    if(!timebins.at(ibin).InitHisto( Form("Histo%i",ibin), Form("Histo%i",ibin), Nbin_histos, xmin_histos, xmax_histos))
+    if(!timebins.at(ibin).InitHisto( Form("Histo%i",ibin), Form("Histo%i",ibin), Nbin_histos, xmin_histos, xmax_histos, sketchcompression_, sketchbufferfactor_))
       return false;
 
   return true;
@@ -401,7 +561,12 @@ void  MonitoringManager::FillTimeBins()
 	//getchar();
 	auto bin_iterator = FindBin(this->GetRunNumber(),this->GetLS(),this->GetTime());
 	if(bin_iterator!=timebins.end())
-	  bin_iterator->FillHisto( GetScaleVariableValue(iEle) );
+	{
+	  float value = GetScaleVariableValue(iEle);
+	  profiler_.Start(StageProfiler::kFill);
+	  bin_iterator->FillHisto(value);
+	  profiler_.Stop();
+	}
       }
     }
   }
@@ -409,13 +574,19 @@ void  MonitoringManager::FillTimeBins()
   cout<<">> Histos filled"<<endl;
 
   //Updating Nev of the bins (just a precaution)
+  UpdateNev();
+
+}
+
+void  MonitoringManager::UpdateNev()
+{
   for(std::vector<TimeBin>::iterator it_bin = timebins.begin(); it_bin<timebins.end(); ++it_bin)
     it_bin->UpdateNev();
-
 }
 
 std::vector<TimeBin>::iterator MonitoringManager::FindBin(const UInt_t &run, const UShort_t &ls)
 {
+  StageTimer timer(profiler_, StageProfiler::kLookup);
   //cout<<"finding bin"<<endl;
   //usually events are in the same time bin of the previous iteration or in adjacent timebins so i start to look for them from there
   std::vector<TimeBin>::iterator it_end   = timebins.end();
@@ -440,23 +611,14 @@ std::vector<TimeBin>::iterator MonitoringManager::FindBin(const UInt_t &run, con
 	 return (last_accessed_bin_);
        }
   }    
-  //if I am here, unfortunately I have to perform a search through the entire set
-  //cout<<"last_accessed_bin_=it_end"<<endl;
-  for(std::vector<TimeBin>::iterator it_bin = it_begin; it_bin<it_end; ++it_bin)//not the smarter way considering that the bins are ordered --> can be improved
-    if(it_bin -> Match(run,ls))
-    {
-      //cout<<"match with bin "<<it_bin-it_begin<<endl;
-      last_accessed_bin_=it_bin;
-      return (last_accessed_bin_);
-    }
-
-  //if I am here, I didn't found any match
-  return it_end;
+  //if I am here, I have to search in the whole set
+  return SearchBin(run,ls,0,false);
 }
 
 
 std::vector<TimeBin>::iterator MonitoringManager::FindBin(const UInt_t &run, const UShort_t &ls, const UInt_t &time)
 {
+  StageTimer timer(profiler_, StageProfiler::kLookup);
   //cout<<"finding bin"<<endl;
   //usually events are in the same time bin of the previous iteration or in adjacent timebins so i start to look for them from there
   std::vector<TimeBin>::iterator it_end   = timebins.end();
@@ -482,22 +644,69 @@ std::vector<TimeBin>::iterator MonitoringManager::FindBin(const UInt_t &run, con
 	 return (last_accessed_bin_);
        }
   }    
-  //if I am here, unfortunately I have to perform a search through the entire set
-  //cout<<"last_accessed_bin_=it_end"<<endl;
-  for(std::vector<TimeBin>::iterator it_bin = it_begin; it_bin<it_end; ++it_bin)//not the smarter way considering that the bins are ordered --> can be improved
-    if(it_bin -> Match(run,ls,time))
-    {
-      //cout<<"match with bin "<<it_bin-it_begin<<endl;
-      last_accessed_bin_=it_bin;
-      return (last_accessed_bin_);
-    }
+  //if I am here, I have to search in the whole set
+  return SearchBin(run,ls,time,true);
+}
 
-  //if I am here, I didn't found any match
-  return it_end;
+//to be called every time timebins is modified
+void MonitoringManager::ResetBinIndex()
+{
+  last_accessed_bin_ = timebins.end();
+  binorder_.clear();
+  binstarts_.clear();
+}
+
+void MonitoringManager::BuildBinIndex()
+{
+  binorder_.resize(timebins.size());
+  for(unsigned ibin=0; ibin<timebins.size(); ++ibin)
+    binorder_[ibin] = ibin;
+  //timebins is usually already sorted, in that case the sort is linear
+  std::stable_sort(binorder_.begin(), binorder_.end(),
+		   [this](const int &a, const int &b) {return timebins[a].GetStartKey() < timebins[b].GetStartKey();});
+  binstarts_.resize(binorder_.size());
+  for(unsigned i=0; i<binorder_.size(); ++i)
+    binstarts_[i] = timebins[binorder_[i]].GetStartKey();
+}
+
+//per-lumisection bins of RunDivide are looked up in the (run,ls) hash map
+//the other bins with a binary search on their first (run,ls): the candidate is the last bin starting before (run,ls),
+//the previous one is also checked because contiguous bins can share their boundary run (the first in timebins wins, as in a linear search)
+std::vector<TimeBin>::iterator MonitoringManager::SearchBin(const UInt_t &run, const UShort_t &ls, const UInt_t &time, const bool &usetime)
+{
+  std::vector<TimeBin>::iterator it_end = timebins.end();
+  if(!lsbins_.empty())
+  {
+    auto lsbin = lsbins_.find(TimeBin::RunLSKey(run,ls));
+    if(lsbin==lsbins_.end())
+      return it_end;
+    std::vector<TimeBin>::iterator it_bin = timebins.begin() + lsbin->second;
+    if(usetime && !it_bin->Match(run,ls,time))
+      return it_end;
+    last_accessed_bin_ = it_bin;
+    return last_accessed_bin_;
+  }
+
+  if(binstarts_.size()!=timebins.size())
+    BuildBinIndex();
+  int position = std::upper_bound(binstarts_.begin(), binstarts_.end(), TimeBin::RunLSKey(run,ls)) - binstarts_.begin() - 1;
+  int found = -1;
+  for(int icandidate=position; icandidate>=0 && icandidate>=position-1; --icandidate)
+  {
+    const TimeBin &candidate = timebins[binorder_[icandidate]];
+    if(usetime ? candidate.Match(run,ls,time) : candidate.Match(run,ls))
+      if(found<0 || binorder_[icandidate]<found)
+	found = binorder_[icandidate];
+  }
+  if(found<0)
+    return it_end;
+  last_accessed_bin_ = timebins.begin() + found;
+  return last_accessed_bin_;
 }
 	     
 void  MonitoringManager::RunTemplateFit(string scale)
 {
+  StageTimer timer(profiler_, StageProfiler::kFit);
   cout<<">> RunTemplateFit in function"<<endl;
   if(h_template_)
   {
@@ -525,53 +734,148 @@ void  MonitoringManager::RunTemplateFit(string scale)
     Ntrialfit = conf_.GetOpt<int> (Form("LaserMonitoring.scaleMonitor.%s.Ntrialfit",scale.c_str()));
   if(conf_.OptExist(Form("LaserMonitoring.scaleMonitor.%s.fitplots_folder",scale.c_str())))
     TemplatePlotsFolder=conf_.GetOpt<string> (Form("LaserMonitoring.scaleMonitor.%s.fitplots_folder",scale.c_str()));
-
-  histoFunc* templateHistoFunc = new histoFunc(h_template_);
-  TF1* fitfunc = new TF1("fitfunc",templateHistoFunc, xmin_fit, xmax_fit, 3, "histofunc");
-  fitfunc -> SetParName(0, "Norm");
-  fitfunc -> SetParName(1, "Scale factor");
-  fitfunc -> SetLineWidth(1);
-  fitfunc -> SetNpx(10000);
-  fitfunc -> SetLineColor(kGreen + 2);
+  //minimizer: process default, unless given in the cfg or the fits run on several threads (Minuit2, the thread-safe one)
+  //set it in the cfg to get the same fitted scales whatever the number of threads
+  string minimizer = "";
+  if(conf_.OptExist(Form("LaserMonitoring.scaleMonitor.%s.minimizer",scale.c_str())))
+    minimizer = conf_.GetOpt<string> (Form("LaserMonitoring.scaleMonitor.%s.minimizer",scale.c_str()));
+
+  int Nthreads = 1;
+  if(conf_.OptExist("LaserMonitoring.scaleMonitor.Nthreads"))
+    Nthreads = conf_.GetOpt<int> ("LaserMonitoring.scaleMonitor.Nthreads");
+  if(Nthreads > (int)timebins.size())
+    Nthreads = timebins.size();
+  if(Nthreads < 1)
+    Nthreads = 1;
+  if(Nthreads > 1 && minimizer != "" && minimizer != "Minuit2")
+  {
+    //TMinuit is not thread-safe
+    cout<<"[WARNING]: minimizer "<<minimizer<<" is not thread-safe --> run the fits on 1 thread"<<endl;
+    Nthreads = 1;
+  }
+  if(Nthreads > 1)
+  {
+    if(minimizer == "")
+    {
+      cout<<">> The fits on more threads use Minuit2 (set "<<scale<<".minimizer in the cfg to use it on 1 thread as well)"<<endl;
+      minimizer = "Minuit2";
+    }
+    cout<<">> Running the fits on "<<Nthreads<<" threads"<<endl;
+    ROOT::EnableThreadSafety();
+  }
+  //the default minimizer of the process is restored at the end of the fits
+  string previousMinimizer = ROOT::Math::MinimizerOptions::DefaultMinimizerType();
+  string previousAlgorithm = ROOT::Math::MinimizerOptions::DefaultMinimizerAlgo();
+  if(minimizer != "")
+    ROOT::Math::MinimizerOptions::SetDefaultMinimizer(minimizer.c_str());
+
+  //each thread has its own copy of the template and of the fit function
+  vector<TH1F*> templates;
+  vector<histoFunc*> templateHistoFuncs;
+  vector<TF1*> fitfuncs;
+  for(int ithread=0; ithread<Nthreads; ++ithread)
+  {
+    TH1F* h_template_copy = h_template_;
+    if(ithread > 0)
+    {
+      h_template_copy = new TH1F(*h_template_);
+      h_template_copy -> SetDirectory(0);
+    }
+    templates.push_back(h_template_copy);
+    templateHistoFuncs.push_back(new histoFunc(h_template_copy));
+    TF1* fitfunc = new TF1(ithread==0 ? "fitfunc" : Form("fitfunc_%i",ithread), templateHistoFuncs.back(), xmin_fit, xmax_fit, 3, "histofunc");
+    fitfunc -> SetParName(0, "Norm");
+    fitfunc -> SetParName(1, "Scale factor");
+    fitfunc -> SetLineWidth(1);
+    fitfunc -> SetNpx(10000);
+    fitfunc -> SetLineColor(kGreen + 2);
+    fitfuncs.push_back(fitfunc);
+  }
 
   double templateIntegral = h_template_->Integral(h_template_->GetXaxis()->FindBin(xmin_fit), h_template_->GetXaxis()->FindBin(xmax_fit));
-  //Run the fits
   for(std::vector<TimeBin>::iterator it_bin = timebins.begin(); it_bin<timebins.end(); ++it_bin)
-  {
-    double binwidthRatio = it_bin->GetBinWidth(1) / h_template_->GetBinWidth(1); 
     if(xmin_fit <= it_bin->GetXminScale() || xmax_fit >= it_bin->GetXmaxScale())
       cout<<"[WARNING]: the fit range is wider or equal to the histogram range! Possible issues in the normalization or fitting..."<<endl;
-    double xNorm = it_bin->GetIntegral(xmin_fit,xmax_fit) / templateIntegral * binwidthRatio;
+
+  //Run the fits
+  //(one entry per bin, written only by the thread fitting the bin)
+  vector<char>   isgoodfit(timebins.size(), false);
+  vector<float>  fitscale(timebins.size(), 0.);
+  vector<double> fitscale_unc(timebins.size(), 0.);
+  auto FitBin = [&](const int &ibin, TF1* fitfunc)
+  {
+    TimeBin &bin = timebins.at(ibin);
+    double binwidthRatio = bin.GetBinWidth(1) / h_template_->GetBinWidth(1); 
+    double xNorm = bin.GetIntegral(xmin_fit,xmax_fit) / templateIntegral * binwidthRatio;
     fitfunc -> FixParameter(0, xNorm);
     fitfunc -> SetParameter(1, 0.99);
+    fitfunc -> SetParError(1, 0.);//the step of the previous fit of the thread is not reused
     fitfunc -> FixParameter(2, 0.);
     
     //cout<<"prefit fitfunc integral = "<<fitfunc->Integral(xmin_fit,xmax_fit)<<endl;
-    //cout<<"reading bin "<<it_bin-timebins.begin()<<endl;
-    bool isgoodfit = it_bin->Fit(fitfunc,fitopt,Ntrialfit,TemplatePlotsFolder);
-    float fitscale = fitfunc->GetParameter(1);
-    if(isgoodfit && fitscale!=0)
+    //cout<<"reading bin "<<ibin<<endl;
+    if(Nthreads > 1)
+      isgoodfit[ibin] = bin.FitNoGraph(fitfunc,fitopt,Ntrialfit);
+    else
+      isgoodfit[ibin] = bin.Fit(fitfunc,fitopt,Ntrialfit,TemplatePlotsFolder);
+    fitscale[ibin] = fitfunc->GetParameter(1);
+    fitscale_unc[ibin] = fitfunc->GetParError(1);
+  };
+
+  if(Nthreads == 1)
+    for(unsigned ibin=0; ibin<timebins.size(); ++ibin)
+      FitBin(ibin, fitfuncs.at(0));
+  else
+  {
+    //the bins are handed out one at a time to the first free thread
+    std::atomic<int> nextbin(0);
+    vector<std::thread> threads;
+    for(int ithread=0; ithread<Nthreads; ++ithread)
+      threads.push_back(std::thread([&, ithread]()
+				    {
+				      for(int ibin=nextbin++; ibin<(int)timebins.size(); ibin=nextbin++)
+					FitBin(ibin, fitfuncs.at(ithread));
+				    }));
+    for(auto &thread : threads)
+      thread.join();
+    if(TemplatePlotsFolder!="")
+      for(std::vector<TimeBin>::iterator it_bin = timebins.begin(); it_bin<timebins.end(); ++it_bin)
+	it_bin->SaveFitPlot(TemplatePlotsFolder);
+  }
+  ROOT::Math::MinimizerOptions::SetDefaultMinimizer(previousMinimizer.c_str(), previousAlgorithm.c_str());
+
+  //Save the results in the bins (in the bin order)
+  for(unsigned ibin=0; ibin<timebins.size(); ++ibin)
+  {
+    TimeBin &bin = timebins.at(ibin);
+    if(isgoodfit[ibin] && fitscale[ibin]!=0)
     {
-      it_bin->SetVariable("scale_"+scale,    1./fitscale);
-      if (fitfunc->GetParError(1) / fitscale / fitscale > 0.001)  it_bin->SetVariable("scale_unc_"+scale, fitfunc->GetParError(1) / fitscale / fitscale);
-      else  it_bin->SetVariable("scale_unc_"+scale, 0.001 );
+      bin.SetVariable("scale_"+scale,    1./fitscale[ibin]);
+      if (fitscale_unc[ibin] / fitscale[ibin] / fitscale[ibin] > 0.001)  bin.SetVariable("scale_unc_"+scale, fitscale_unc[ibin] / fitscale[ibin] / fitscale[ibin]);
+      else  bin.SetVariable("scale_unc_"+scale, 0.001 );
 
     }
     else
     {
-      it_bin->SetVariable("scale_"+scale,    -999);
-      it_bin->SetVariable("scale_unc_"+scale, 0);
+      bin.SetVariable("scale_"+scale,    -999);
+      bin.SetVariable("scale_unc_"+scale, 0);
     }
     //cout<<"postfit fitfunc integral = "<<fitfunc->Integral(xmin_fit,xmax_fit)<<endl;
   }
 
-  delete fitfunc;
-  delete templateHistoFunc;
+  for(int ithread=0; ithread<Nthreads; ++ithread)
+  {
+    delete fitfuncs.at(ithread);
+    delete templateHistoFuncs.at(ithread);
+    if(ithread > 0)
+      delete templates.at(ithread);
+  }
 }
 		 
 	  
 void  MonitoringManager::RunComputeMean(string scale)
 {
+  StageTimer timer(profiler_, StageProfiler::kFit);
   cout<<">> RunComputeMean in function"<<endl;
   for(std::vector<TimeBin>::iterator it_bin = timebins.begin(); it_bin<timebins.end(); ++it_bin)
   {
@@ -593,6 +897,7 @@ void  MonitoringManager::RunComputeMean(string scale)
 	  
 void  MonitoringManager::RunComputeMedian(string scale)
 {
+  StageTimer timer(profiler_, StageProfiler::kFit);
   cout<<">> RunComputeMedian in function"<<endl;
   for(std::vector<TimeBin>::iterator it_bin = timebins.begin(); it_bin<timebins.end(); ++it_bin)
   {
@@ -611,6 +916,26 @@ void  MonitoringManager::RunComputeMedian(string scale)
   }
 }
 
+void  MonitoringManager::RunComputeQuantile(string scale, const double &q)
+{
+  StageTimer timer(profiler_, StageProfiler::kFit);
+  cout<<">> RunComputeQuantile in function (q="<<q<<")"<<endl;
+  for(std::vector<TimeBin>::iterator it_bin = timebins.begin(); it_bin<timebins.end(); ++it_bin)
+  {
+    if(it_bin->GetNev()==0)
+    {
+      cout<<"[ERROR]: bin "<<it_bin-timebins.begin()<<" is empty"<<endl;
+      it_bin->SetVariable("scale_"+scale, -999.);
+      it_bin->SetVariable("scale_unc_"+scale, 0.);
+    }
+    else
+    {
+      it_bin->SetVariable("scale_"+scale, it_bin->GetQuantile(q));
+      it_bin->SetVariable("scale_unc_"+scale, it_bin->GetMeanError());
+    }
+  }
+}
+
 void  MonitoringManager::PrintScales()
 {
   auto firstbin=timebins.begin();
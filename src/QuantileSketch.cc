@@ -0,0 +1,216 @@
+#include "QuantileSketch.h"
+#include "TMath.h"
+
+#include <algorithm>
+#include <cmath>
+
+using namespace std;
+
+QuantileSketch::QuantileSketch(const double &compression, const double &bufferfactor):
+  compression_(compression),
+  bufferfactor_(bufferfactor),
+  Nunmerged_(0),
+  n_(0.),
+  sumx_(0.),
+  sumx2_(0.),
+  min_(0.),
+  max_(0.),
+  inmeans_(0),
+  inweights_(0)
+  {}
+
+//scale function of the t-digest: centroids span at most one unit of k
+double QuantileSketch::K(const double &q) const
+{
+  return compression_ / (2.*TMath::Pi()) * asin(2.*q-1.);
+}
+
+double QuantileSketch::Kinv(const double &k) const
+{
+  if(k >= compression_/4.)
+    return 1.;
+  return 0.5 * (sin(2.*TMath::Pi()*k/compression_) + 1.);
+}
+
+void QuantileSketch::Add(const double &x, const double &w)
+{
+  if(n_==0)
+    min_ = max_ = x;
+  else
+  {
+    if(x<min_) min_=x;
+    if(x>max_) max_=x;
+  }
+  means_.push_back(x);
+  weights_.push_back(w);
+  ++Nunmerged_;
+  n_     += w;
+  sumx_  += w*x;
+  sumx2_ += w*x*x;
+  if(Nunmerged_ > bufferfactor_*compression_)
+    Compress();
+}
+
+void QuantileSketch::Merge(const QuantileSketch &other)
+{
+  if(other.n_==0)
+    return;
+  if(n_==0)
+  {
+    min_ = other.min_;
+    max_ = other.max_;
+  }
+  else
+  {
+    min_ = std::min(min_, other.min_);
+    max_ = std::max(max_, other.max_);
+  }
+  means_.insert(means_.end(), other.means_.begin(), other.means_.end());
+  weights_.insert(weights_.end(), other.weights_.begin(), other.weights_.end());
+  Nunmerged_ += other.means_.size();
+  n_     += other.n_;
+  sumx_  += other.sumx_;
+  sumx2_ += other.sumx2_;
+  Compress();
+}
+
+//sort the centroids and merge the adjacent ones as long as they stay within one unit of k
+//the memory of the buffer is released with the old centroids
+void QuantileSketch::Compress()
+{
+  if(Nunmerged_==0 || means_.size()==0)
+    return;
+
+  vector<int> order(means_.size());
+  for(unsigned i=0; i<order.size(); ++i)
+    order[i] = i;
+  std::sort(order.begin(), order.end(), [this](const int &i, const int &j) {return means_[i] < means_[j];});
+  double W = 0.;
+  for(auto w : weights_)
+    W += w;
+
+  vector<float> newmeans, newweights;
+  double wsofar = 0.;
+  double curmean = means_[order[0]];
+  double curw    = weights_[order[0]];
+  double wlimit  = Kinv(K(0.)+1.) * W;
+  for(unsigned i=1; i<order.size(); ++i)
+  {
+    double x = means_[order[i]];
+    double w = weights_[order[i]];
+    if(wsofar + curw + w <= wlimit)
+    {
+      curmean += (x-curmean) * w / (curw+w);
+      curw    += w;
+    }
+    else
+    {
+      newmeans.push_back(curmean);
+      newweights.push_back(curw);
+      wsofar += curw;
+      wlimit  = Kinv(K(wsofar/W)+1.) * W;
+      curmean = x;
+      curw    = w;
+    }
+  }
+  newmeans.push_back(curmean);
+  newweights.push_back(curw);
+
+  means_.swap(newmeans);
+  weights_.swap(newweights);
+  Nunmerged_ = 0;
+}
+
+void QuantileSketch::Reset()
+{
+  means_.clear();
+  weights_.clear();
+  Nunmerged_ = 0;
+  n_     = 0.;
+  sumx_  = 0.;
+  sumx2_ = 0.;
+  min_   = 0.;
+  max_   = 0.;
+}
+
+//linear interpolation between the centroid centers, the tails are interpolated to the min and max values
+double QuantileSketch::Quantile(const double &q)
+{
+  Compress();
+  if(means_.size()==0)
+  {
+    cerr<<"[ERROR]: quantile of an empty sketch"<<endl;
+    return 0.;
+  }
+  if(means_.size()==1)
+    return means_[0];
+
+  double W = 0.;
+  for(auto w : weights_)
+    W += w;
+  double target = std::max(0., std::min(1., q)) * W;
+
+  if(target < 0.5*weights_.front())
+    return min_ + (means_.front()-min_) * target / (0.5*weights_.front());
+
+  double cum = 0.;
+  for(unsigned i=0; i+1<means_.size(); ++i)
+  {
+    double center     = cum + 0.5*weights_[i];
+    double nextcenter = cum + weights_[i] + 0.5*weights_[i+1];
+    if(target <= nextcenter)
+      return means_[i] + (means_[i+1]-means_[i]) * (target-center) / (nextcenter-center);
+    cum += weights_[i];
+  }
+
+  double lastcenter = W - 0.5*weights_.back();
+  return means_.back() + (max_-means_.back()) * (target-lastcenter) / (0.5*weights_.back());
+}
+
+double QuantileSketch::GetMean() const
+{
+  if(n_<=0)
+    return 0.;
+  return sumx_/n_;
+}
+
+double QuantileSketch::GetMeanError() const
+{
+  if(n_<=0)
+    return 0.;
+  double variance = sumx2_/n_ - GetMean()*GetMean();
+  if(variance<0)
+    variance = 0.;
+  return sqrt(variance/n_);
+}
+
+//the sketch must be compressed before filling the tree
+void QuantileSketch::BranchOutput(TTree* outtree)
+{
+  outtree->Branch("sketch_mean",   &means_);
+  outtree->Branch("sketch_weight", &weights_);
+  outtree->Branch("sketch_n",      &n_);
+  outtree->Branch("sketch_sumx",   &sumx_);
+  outtree->Branch("sketch_sumx2",  &sumx2_);
+  outtree->Branch("sketch_min",    &min_);
+  outtree->Branch("sketch_max",    &max_);
+}
+
+void QuantileSketch::BranchInput(TTree* intree)
+{
+  if(!intree->GetBranch("sketch_mean"))
+  {
+    cout<<"[WARNING]: no quantile sketch in tree "<<intree->GetName()<<endl;
+    return;
+  }
+  inmeans_   = &means_;
+  inweights_ = &weights_;
+  Nunmerged_ = 0;
+  intree->SetBranchAddress("sketch_mean",   &inmeans_);
+  intree->SetBranchAddress("sketch_weight", &inweights_);
+  intree->SetBranchAddress("sketch_n",      &n_);
+  intree->SetBranchAddress("sketch_sumx",   &sumx_);
+  intree->SetBranchAddress("sketch_sumx2",  &sumx2_);
+  intree->SetBranchAddress("sketch_min",    &min_);
+  intree->SetBranchAddress("sketch_max",    &max_);
+}
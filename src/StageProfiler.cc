@@ -0,0 +1,118 @@
+#include "StageProfiler.h"
+
+#include <fstream>
+#include <iomanip>
+#include <ctime>
+
+using namespace std;
+
+StageProfiler::StageProfiler():
+  enabled_(false),
+  executable_("")
+{
+  for(int istage=0; istage<kNstages; ++istage)
+  {
+    time_[istage]  = 0.;
+    calls_[istage] = 0;
+  }
+}
+
+const char* StageProfiler::GetStageName(const int &stage)
+{
+  static const char* names[kNstages] = {"io", "selection", "variable", "lookup", "fill", "fit", "write"};
+  if(stage<0 || stage>=kNstages)
+    return "unknown";
+  return names[stage];
+}
+
+void StageProfiler::Enable(const string &executable)
+{
+  cout<<">> Profiling the stages of "<<executable<<endl;
+  enabled_    = true;
+  executable_ = executable;
+  begin_      = clock::now();
+  last_       = begin_;
+}
+
+void StageProfiler::Push(const Stage &stage)
+{
+  clock::time_point now = clock::now();
+  if(stack_.size()>0)
+    time_[stack_.back()] += chrono::duration<double>(now-last_).count();
+  stack_.push_back(stage);
+  ++calls_[stage];
+  last_ = now;
+}
+
+void StageProfiler::Pop()
+{
+  if(stack_.size()==0)
+    return;
+  clock::time_point now = clock::now();
+  time_[stack_.back()] += chrono::duration<double>(now-last_).count();
+  stack_.pop_back();
+  last_ = now;
+}
+
+double StageProfiler::GetWallTime() const
+{
+  return chrono::duration<double>(clock::now()-begin_).count();
+}
+
+void StageProfiler::Print()
+{
+  if(!enabled_)
+    return;
+  double wall = GetWallTime();
+  double tracked = 0.;
+  cout<<"----------------------------------------------------------------------------------"<<endl;
+  cout<<"> profile of "<<executable_<<": "<<wall<<" s"<<endl;
+  cout<<std::left<<setw(12)<<"stage"<<std::right<<setw(12)<<"time [s]"<<setw(10)<<"fraction"<<setw(14)<<"calls"<<setw(14)<<"ns/call"<<endl;
+  for(int istage=0; istage<kNstages; ++istage)
+  {
+    tracked += time_[istage];
+    cout<<std::left<<setw(12)<<GetStageName(istage)<<std::right<<fixed<<setprecision(3)
+	<<setw(12)<<time_[istage]
+	<<setw(10)<<(wall>0 ? time_[istage]/wall : 0.)
+	<<setw(14)<<calls_[istage]
+	<<setprecision(1)<<setw(14)<<(calls_[istage]>0 ? 1e9*time_[istage]/calls_[istage] : 0.)<<endl;
+  }
+  cout<<std::left<<setw(12)<<"untracked"<<std::right<<setprecision(3)<<setw(12)<<wall-tracked<<setw(10)<<(wall>0 ? (wall-tracked)/wall : 0.)<<endl;
+  cout.unsetf(ios::floatfield);
+  cout<<setprecision(6);
+  cout<<"----------------------------------------------------------------------------------"<<endl;
+}
+
+//json with the wall time, the entries read (calls of the io stage) and, for each stage, time and calls
+bool StageProfiler::Save(const string &filename)
+{
+  if(!enabled_)
+    return true;
+  Print();
+  ofstream outfile(filename.c_str());
+  if(!outfile.is_open())
+  {
+    cout<<"[ERROR]: can't write the profile to "<<filename<<endl;
+    return false;
+  }
+  double wall = GetWallTime();
+  double tracked = 0.;
+  outfile<<setprecision(9);
+  outfile<<"{"<<endl;
+  outfile<<"  \"executable\": \""<<executable_<<"\","<<endl;
+  outfile<<"  \"timestamp\": "<<time(0)<<","<<endl;
+  outfile<<"  \"wall_time\": "<<wall<<","<<endl;
+  outfile<<"  \"entries\": "<<calls_[kIO]<<","<<endl;
+  outfile<<"  \"stages\": {"<<endl;
+  for(int istage=0; istage<kNstages; ++istage)
+  {
+    tracked += time_[istage];
+    outfile<<"    \""<<GetStageName(istage)<<"\": {\"time\": "<<time_[istage]<<", \"calls\": "<<calls_[istage]<<"},"<<endl;
+  }
+  outfile<<"    \"untracked\": {\"time\": "<<wall-tracked<<", \"calls\": 0}"<<endl;
+  outfile<<"  }"<<endl;
+  outfile<<"}"<<endl;
+  outfile.close();
+  cout<<">> Profile saved in "<<filename<<endl;
+  return true;
+}
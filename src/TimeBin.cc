@@ -26,7 +26,8 @@ TimeBin::TimeBin(const TimeBin &bincopy):
   timemax_      (bincopy.timemax_),
   intlumimin_   (bincopy.intlumimin_),
   intlumimax_   (bincopy.intlumimax_),
-  Nev_          (bincopy.Nev_)
+  Nev_          (bincopy.Nev_),
+  sketch_       (bincopy.sketch_)
   {
     for (auto variableindex : bincopy.variablelist_)
       variablelist_[variableindex.first] = variableindex.second;
@@ -105,6 +106,19 @@ void TimeBin::AddEvent(const TimeBin& other)
   }
 
   Nev_ += other.Nev_;
+  sketch_.Merge(other.sketch_);
+
+  //histos filled during RunDivide are merged together with the bins
+  if(other.h_scale_)
+  {
+    if(h_scale_)
+      h_scale_->Add(other.h_scale_);
+    else
+    {
+      h_scale_ = new TH1F(*(other.h_scale_));
+      h_scale_->SetDirectory(0);
+    }
+  }
 }  
 
 void TimeBin::SetBinRanges(const UInt_t &runmin, const UInt_t &runmax, const UShort_t &lsmin, const UShort_t &lsmax, const UInt_t &timemin, const UInt_t &timemax)
@@ -130,6 +144,7 @@ void TimeBin::Reset()
   Nev_=0;
   if(h_scale_)
     h_scale_->Reset();
+  sketch_.Reset();
 }
 
 void TimeBin::SetNev(const int &Nev_bin)
@@ -139,6 +154,8 @@ void TimeBin::SetNev(const int &Nev_bin)
 
 TimeBin& TimeBin::operator=(const TimeBin& other)
 {
+  if(this == &other)
+    return *this;
   runmin_       = other.runmin_;
   runmax_       = other.runmax_;
   lsmin_        = other.lsmin_;
@@ -148,8 +165,11 @@ TimeBin& TimeBin::operator=(const TimeBin& other)
   intlumimin_   = other.intlumimin_;
   intlumimax_   = other.intlumimax_;
   Nev_          = other.Nev_;
+  sketch_       = other.sketch_;
   for (auto variableindex : other.variablelist_)
     variablelist_[variableindex.first] = variableindex.second;
+  if(h_scale_)
+    delete h_scale_;
   if(other.h_scale_)
   {
     h_scale_      = new TH1F(*(other.h_scale_));
@@ -157,6 +177,7 @@ TimeBin& TimeBin::operator=(const TimeBin& other)
   }
   else
     h_scale_=0;
+  return *this;
 }
 
 bool TimeBin::operator<(const TimeBin& other) const
@@ -199,6 +220,7 @@ void TimeBin::BranchOutput(TTree* outtree)
   outtree->Branch("intlumimin",&intlumimin_);
   outtree->Branch("intlumimax",&intlumimax_);
   outtree->Branch("Nev",&Nev_);
+  sketch_.BranchOutput(outtree);
   for(map<string,float>::iterator it=variablelist_.begin(); it!=variablelist_.end(); ++it)
   {
     string variablename  = it->first;
@@ -206,7 +228,8 @@ void TimeBin::BranchOutput(TTree* outtree)
   }
 }
 
-void TimeBin::BranchInput(TTree* intree)
+//the quantile sketch is loaded only on request (to merge the outputs of different jobs)
+void TimeBin::BranchInput(TTree* intree, const bool &loadsketch)
 {
   intree->SetBranchAddress("runmin",&runmin_);
   intree->SetBranchAddress("runmax",&runmax_);
@@ -217,6 +240,8 @@ void TimeBin::BranchInput(TTree* intree)
   intree->SetBranchAddress("intlumimin",&intlumimin_);
   intree->SetBranchAddress("intlumimax",&intlumimax_);
   intree->SetBranchAddress("Nev",&Nev_);
+  if(loadsketch)
+    sketch_.BranchInput(intree);
   
   //loop over ttree keys to load all the other variables identified by the prefix "scale_"
   TObjArray *branchList = intree->GetListOfBranches();
@@ -257,27 +282,58 @@ bool TimeBin::Match(const UInt_t &run, const UShort_t &ls, const UInt_t &time) c
   return false;
 }
 	
-bool TimeBin::InitHisto( char* name, char* title, const int &Nbin, const double &xmin, const double &xmax)
+bool TimeBin::InitHisto( char* name, char* title, const int &Nbin, const double &xmin, const double &xmax, const double &sketchcompression, const double &sketchbufferfactor)
 {
   if(!h_scale_)
   {
     h_scale_=new TH1F(name,title,Nbin,xmin,xmax);
+    sketch_.SetCompression(sketchcompression);
+    sketch_.SetBufferFactor(sketchbufferfactor);
     return true;
   }
   else
     return false;
 }
 
+void TimeBin::FillHisto(double x)
+{
+  h_scale_->Fill(x);
+  if(x>=h_scale_->GetXaxis()->GetXmin() && x<h_scale_->GetXaxis()->GetXmax())
+    sketch_.Add(x);
+}
+
+//the bin takes the ownership of the histo (h=0 deletes the current one)
+void TimeBin::SetHisto(TH1F* h)
+{
+  if(h_scale_)
+    delete h_scale_;
+  h_scale_ = h;
+  if(h_scale_)
+    h_scale_->SetDirectory(0);
+}
+
 bool TimeBin::Fit(TF1* fitfunc, string fitopt, int nTrial, string TemplatePlotsFolder)
 {
   bool isgoodfit = FitUtils::PerseverantFit(h_scale_, fitfunc, fitopt, nTrial, TemplatePlotsFolder);
   return isgoodfit;
 }
 
+//thread-safe version of Fit, the plot is saved by SaveFitPlot
+bool TimeBin::FitNoGraph(TF1* fitfunc, string fitopt, int nTrial)
+{
+  return FitUtils::PerseverantFitNoGraph(h_scale_, fitfunc, fitopt, nTrial);
+}
+
+void TimeBin::SaveFitPlot(string TemplatePlotsFolder)
+{
+  FitUtils::SaveFitPlot(h_scale_, TemplatePlotsFolder);
+}
+
+//without histo (merged outputs) mean and median are computed from the quantile sketch
 double TimeBin::GetMean()
 {
   if(!h_scale_)
-    cerr<<"[ERROR]: histogram is not booked"<<endl;
+    return sketch_.GetMean();
 
   return h_scale_->GetMean();
 }
@@ -285,7 +341,7 @@ double TimeBin::GetMean()
 double TimeBin::GetMeanError()
 {
   if(!h_scale_)
-    cerr<<"[ERROR]: histogram is not booked"<<endl;
+    return sketch_.GetMeanError();
 
   return h_scale_->GetMeanError();
 }
@@ -293,14 +349,25 @@ double TimeBin::GetMeanError()
 
 double TimeBin::GetMedian()
 {
+  //The median is just the 0.5 quantile
+  return GetQuantile(0.5);
+}
+
+//the quantile sketch is not limited by the histo binning, the histo is used if the sketch is empty
+double TimeBin::GetQuantile(const double &q)
+{
+  if(sketch_.GetN()>0)
+    return sketch_.Quantile(q);
   if(!h_scale_)
+  {
     cerr<<"[ERROR]: histogram is not booked"<<endl;
+    return -999.;
+  }
 
-  //The median is just the 0.5 quantile
-  Double_t x, q;
-  q = 0.5; // 0.5 for "median"
+  Double_t x, qq;
+  qq = q;
   h_scale_->ComputeIntegral(); // just a precaution
-  h_scale_->GetQuantiles(1, &x, &q);
+  h_scale_->GetQuantiles(1, &x, &qq);
   return x;
 }
 
@@ -327,8 +394,10 @@ void TimeBin::PrintVariables()
 
 }
 
+//called when the bin is filled: the values buffered in the sketch are compressed as well
 void TimeBin::UpdateNev()
 {
+  sketch_.Compress();
   if(h_scale_)
     if( Nev_ != h_scale_->GetEntries() )
     {
@@ -200,6 +200,18 @@ Float_t calibrator::GetICEnergyEE(const Int_t &i)
   float IC = 1.;
   int ix,iy,iz,iIOV;
 
+  //all the rechits of the electron belong to the same IOV
+  profiler_.Start(StageProfiler::kLookup);
+  iIOV = FindIOVNumber( GetRunNumber() , GetLS() );
+  if(iIOV<0)
+  {
+#ifdef DEBUG
+    cout<<"[WARNING]: IOV not found for (run,lumi)=("<<GetRunNumber()<<","<<GetLS()<<") --> Find closer IOV"<<endl;
+#endif
+    iIOV = FindCloserIOVNumber( GetRunNumber() , GetLS() );
+  }
+  profiler_.Stop();
+
   for(unsigned int iRecHit = 0; iRecHit < ERecHit_[i]->size(); iRecHit++) 
   {
     if(recoFlagRecHit_[i]->at(iRecHit) >= 4)
@@ -207,14 +219,6 @@ Float_t calibrator::GetICEnergyEE(const Int_t &i)
     ix = XRecHit_[i]->at(iRecHit);
     iy = YRecHit_[i]->at(iRecHit);
     iz = ZRecHit_[i]->at(iRecHit);
-    iIOV = FindIOVNumber( GetRunNumber() , GetLS() );
-    if(iIOV<0)
-    {
-#ifdef DEBUG
-      cout<<"[WARNING]: IOV not found for (run,lumi)=("<<GetRunNumber()<<","<<GetLS()<<") --> Find closer IOV"<<endl;
-#endif
-      iIOV = FindCloserIOVNumber( GetRunNumber() , GetLS() );
-    }
     IC = GetIC(ix,iy,iz,iIOV);
     E += kRegression * ERecHit_[i]->at(iRecHit) * fracRecHit_[i]->at(iRecHit) * IC;
     //cout<<"GetICEnergy\tiRECHIT="<<iRecHit<<"\tix="<<XRecHit_[i]->at(iRecHit)<<"\tiy="<<YRecHit_[i]->at(iRecHit)<<"\tiz="<<ZRecHit_[i]->at(iRecHit)<<"\tIC="<<IC<<endl;
@@ -256,6 +260,18 @@ Float_t calibrator::GetICEnergyEB(const Int_t &i)
   float IC = 1.;
   int ix,iy,iz,iIOV;
 
+  //all the rechits of the electron belong to the same IOV
+  profiler_.Start(StageProfiler::kLookup);
+  iIOV = FindIOVNumber( GetRunNumber() , GetLS() );
+  if(iIOV<0)
+  {
+#ifdef DEBUG
+    cout<<"[WARNING]: IOV not found for (run,lumi)=("<<GetRunNumber()<<","<<GetLS()<<") --> Find closer IOV"<<endl;
+#endif
+    iIOV = FindCloserIOVNumber( GetRunNumber() , GetLS() );
+  }
+  profiler_.Stop();
+
   for(unsigned int iRecHit = 0; iRecHit < ERecHit_[i]->size(); iRecHit++) 
   {
     if(recoFlagRecHit_[i]->at(iRecHit) >= 4)
@@ -263,14 +279,6 @@ Float_t calibrator::GetICEnergyEB(const Int_t &i)
     ix = XRecHit_[i]->at(iRecHit);
     iy = YRecHit_[i]->at(iRecHit);
     iz = ZRecHit_[i]->at(iRecHit);
-    iIOV = FindIOVNumber( GetRunNumber() , GetLS() );
-    if(iIOV<0)
-    {
-#ifdef DEBUG
-      cout<<"[WARNING]: IOV not found for (run,lumi)=("<<GetRunNumber()<<","<<GetLS()<<") --> Find closer IOV"<<endl;
-#endif
-      iIOV = FindCloserIOVNumber( GetRunNumber() , GetLS() );
-    }
     IC = GetIC(ix,iy,iz,iIOV);
     //printf("(ix,iy,iz,iIOV)=(%i,%i,%i,%i)\t (run,lumi)=(%u,%u)\t IC=%f\n",ix,iy,iz,iIOV,GetRunNumber(),GetLS(),IC);
     E += kRegression * ERecHit_[i]->at(iRecHit) * fracRecHit_[i]->at(iRecHit) * IC;